@@ -1,15 +1,27 @@
-from dash import html, dcc
+from dash import html, dcc, DiskcacheManager
 from dash.dependencies import Input, Output
 import dash
+import diskcache
 import os
+import json
 
-app = dash.Dash(__name__, use_pages=True, suppress_callback_exceptions=True)
+# Background callbacks (e.g. Skills Matcher requests) run in separate processes, so slow upstream calls don't hold a server worker
+# TO-DO: CeleryManager (redis) when deployed with several gunicorn workers/hosts
+background_callback_manager = DiskcacheManager(diskcache.Cache(os.path.join('output', 'callback_cache')))
+
+app = dash.Dash(__name__, use_pages=True, suppress_callback_exceptions=True, background_callback_manager=background_callback_manager)
 server = app.server
+
+# County lookup for the county dropdowns of every page, sent to the browser once (see assets/clientside.js)
+with open('counties.json', 'r') as file: 
+    counties_dict = json.load(file)
+
 app.layout = html.Div(
     [
         dcc.Store(id="store", data={}),
         dcc.Store(id="county-comparison-beneficiary-store", data={}),
         dcc.Store(id="county-comparison-df-store", data={}), 
+        dcc.Store(id="counties-store", data=counties_dict), 
         html.H1("Benefits Cliffs Dashboard Demo"),
         html.Div( # The "Nav Bar" 
             [
@@ -0,0 +1,54 @@
+// Clientside callbacks: show/hide divs and fill dropdowns from lookup tables already in the browser,
+// so these interactions don't make a request to the server.
+// Registered in the pages with dash.clientside_callback(ClientsideFunction('clientside', '<function name>'), ...)
+// Lookup tables are dcc.Store's sent once with the layout (counties: 'counties-store' in app.py, jobs: compare-jobs page)
+
+const SHOW = {'display': 'block'};
+const HIDE = {'display': 'none'};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    clientside: {
+
+        // ## Dropdowns
+
+        // County options of the chosen state (lookup: {state abbreviation: [county, ...]})
+        update_county_options: function(chosen_state_value, counties_lookup) {
+            if (!chosen_state_value || !counties_lookup || !(chosen_state_value in counties_lookup)) {
+                return [];
+            }
+            return counties_lookup[chosen_state_value].map(county => ({'label': county, 'value': county}));
+        },
+
+        // Target job options of the chosen broad occupation group (lookup: {occupation group: [job title, ...]})
+        update_target_jobs_options: function(chosen_occ_group, jobs_lookup) {
+            if (!chosen_occ_group || !jobs_lookup || !(chosen_occ_group in jobs_lookup)) {
+                return [];
+            }
+            return jobs_lookup[chosen_occ_group].map(job => ({'label': job, 'value': job}));
+        },
+
+        // ## Showing/hiding plots
+
+        // Show the plots once the multi view figure has data
+        reveal_output_div: function(figure) {
+            if (figure && figure.data && figure.data.length > 0) {
+                return SHOW;
+            }
+            return HIDE;
+        },
+
+        // Show the view toggle after the first submit
+        reveal_view_toggle: function(n_clicks) {
+            return n_clicks > 0 ? SHOW : HIDE;
+        },
+
+        // View toggle radio buttons
+        toggle_multi_view: function(value) {
+            return value === 'All Profiles' ? SHOW : HIDE;
+        },
+
+        toggle_single_view: function(value) {
+            return value === 'Single Profile' ? SHOW : HIDE;
+        }
+    }
+});
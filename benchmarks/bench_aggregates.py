@@ -0,0 +1,95 @@
+## Benchmark national/state aggregates (utils/aggregates.py) against a pandas groupby over the long-format results:
+# building them in one pass, keeping them up to date chunk by chunk (in memory, and through an AggregateStore as
+# precompute_counties.py does, where each chunk should cost about the same however many counties came before), and
+# reading one scope's aggregates from an AggregateStore. Results for every county in counties.json come from the pure-Python
+# stand-in calculator (utils/calculator_worker_stub.py).
+#
+#   python benchmarks/bench_aggregates.py [--repeat 3] [--chunk-size 50]
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # counties.json
+from benchmarks.timing import timeit
+from utils.BeneficiaryProfile import Beneficiary
+from utils.calculator_worker_stub import calculate
+from utils.ingest import compact_dtypes
+from utils.precompute import all_locations
+from utils.aggregates import Aggregates, AggregateStore, aggregate_columns, PERCENTILES
+
+
+def groupby_aggregates(df, columns:list) -> dict:
+    """Same statistics with pandas: mean and percentiles by (state, income) and by income"""
+    quantiles = [q / 100 for q in PERCENTILES]
+    by_state = df.groupby(['stateAbbrev', 'income'], observed=True)[columns]
+    national = df.groupby('income')[columns]
+    return {'state':(by_state.mean(), by_state.quantile(quantiles)), 'national':(national.mean(), national.quantile(quantiles))}
+
+
+class FrameResultsStore:
+    """The two ResultsStore methods AggregateStore.update() uses, over an in-memory table of the first n locations"""
+
+    def __init__(self, df, locations:list):
+        self.df, self.all_locations, self.n = df, locations, 0
+        self.rows = pd.Series(np.arange(len(df))).groupby(df['state_county'].astype(str).to_numpy()).indices
+
+    def locations(self, profile_key) -> list:
+        return self.all_locations[:self.n]
+
+    def query(self, profile_keys=None, locations=None) -> pd.DataFrame:
+        return self.df.iloc[np.concatenate([self.rows[location] for location in locations])]
+
+
+def main(repeat=3, chunk_size=50):
+    beneficiary = Beneficiary('bench', agePerson1=[30], agePerson2=[5])
+    locations = all_locations()
+    df = compact_dtypes(pd.DataFrame(calculate(beneficiary.Profile, locations)))
+    columns = aggregate_columns(df)
+    print(f"{len(locations)} counties, {len(df)} rows, {len(columns)} columns")
+
+    # Position of each row's county in counties.json, so chunks are the counties precompute_counties.py runs together
+    codes = df['state_county'].astype(str).map({location:n for n, location in enumerate(locations)}).to_numpy()
+
+    def incremental():
+        aggregates = Aggregates(columns)
+        for start in range(0, len(locations), chunk_size):
+            aggregates.add(df[(codes >= start) & (codes < start + chunk_size)])
+        aggregates.update_national()
+
+    # Chunk by chunk through an AggregateStore: time of each update (national percentiles once at the end)
+    results_store, chunk_times = FrameResultsStore(df, locations), []
+    chunk_store = AggregateStore(tempfile.mkdtemp())
+    for start in range(0, len(locations), chunk_size):
+        results_store.n = start + chunk_size
+        chunk_start = time.perf_counter()
+        chunk_store.update(beneficiary.profile_key, results_store, national=False)
+        chunk_times.append(time.perf_counter() - chunk_start)
+    final_start = time.perf_counter()
+    chunk_store.update(beneficiary.profile_key, results_store)
+    final_time = time.perf_counter() - final_start
+
+    store = AggregateStore(tempfile.mkdtemp())
+    Aggregates.from_frame(df, columns).save(store.path(beneficiary.profile_key))
+    store.read(beneficiary.profile_key) # first read loads the stats from the file
+
+    cases = [('pandas groupby (all scopes)', lambda: groupby_aggregates(df, columns)),
+             ('Aggregates.from_frame (all scopes)', lambda: Aggregates.from_frame(df, columns)),
+             (f'incremental, {chunk_size} counties per add()', incremental),
+             ('AggregateStore.read (one scope)', lambda: store.read(beneficiary.profile_key, 'TX', 'NetResources'))]
+    for name, fn in cases:
+        print(f"{name:<40}{timeit(fn, repeat) * 1000:>10.2f} ms")
+    print(f"{'AggregateStore.update per chunk':<40}{chunk_times[0] * 1000:>10.2f} ms first, "
+          f"{np.median(chunk_times) * 1000:.2f} ms median, {chunk_times[-1] * 1000:.2f} ms last ({len(chunk_times)} chunks)")
+    print(f"{'AggregateStore.update national':<40}{final_time * 1000:>10.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark national/state aggregates vs. pandas groupby')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (best time is reported)')
+    parser.add_argument('--chunk-size', type=int, default=50, help='counties per incremental update')
+    args = parser.parse_args()
+    main(args.repeat, args.chunk_size)
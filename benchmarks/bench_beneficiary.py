@@ -0,0 +1,64 @@
+## Benchmark building Beneficiary profiles in bulk (as precompute and the county pages' callbacks do): construction
+# with validation, profile_key, the full Profile dict and the non-default dict/YAML form, and rebuilding from it.
+#
+#   python benchmarks/bench_beneficiary.py [--profiles 100000] [--repeat 3]
+import os
+import sys
+import argparse
+import tracemalloc
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from benchmarks.timing import timeit
+from utils.BeneficiaryProfile import Beneficiary
+
+
+def make_configs(n:int, seed=0) -> list:
+    """n household configs like the pages submit: 1-2 adults, 0-3 children, some disabilities and SSDI"""
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        n_adults, n_kids = int(rng.integers(1, 3)), int(rng.integers(0, 4))
+        for i in range(1, n_adults + 1):
+            config[f'agePerson{i}'] = [int(rng.integers(18, 70))]
+            if rng.random() < 0.1:
+                config[f'disability{i}'] = [1]
+                config[f'ssdiPIA{i}'] = [int(rng.integers(500, 2000))]
+        for i in range(7, 7 + n_kids):
+            config[f'agePerson{i}'] = [int(rng.integers(0, 18))]
+        if n_adults == 2:
+            config['married'] = [1]
+        config['locations'] = ['Kent County, DE']
+        configs.append(config)
+    return configs
+
+
+def main(n_profiles=100000, repeat=3):
+    configs = make_configs(n_profiles)
+    profiles = [Beneficiary('bench', **config) for config in configs]
+    non_defaults = [profile.non_default() for profile in profiles]
+
+    cases = [('construct (validate)', lambda: [Beneficiary('bench', **config) for config in configs]),
+             ('construct + profile_key', lambda: [Beneficiary('bench', **config).profile_key for config in configs]),
+             ('Profile (full dict)', lambda: [Beneficiary('bench', **config).Profile for config in configs]),
+             ('non_default (dict form)', lambda: [profile.non_default() for profile in profiles]),
+             ('from non_default dict', lambda: [Beneficiary('bench', **data) for data in non_defaults])]
+    print(f"{n_profiles} profiles")
+    for name, fn in cases:
+        seconds = timeit(fn, repeat)
+        print(f"{name:<28}{seconds:>8.2f} s{seconds / n_profiles * 1e6:>10.1f} us/profile")
+
+    tracemalloc.start()
+    held = [Beneficiary('bench', **config) for config in configs]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'memory held':<28}{current / 2**20:>8.1f} MB{current / n_profiles:>10.0f} B/profile")
+    del held
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark bulk Beneficiary construction')
+    parser.add_argument('--profiles', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (best time is reported)')
+    args = parser.parse_args()
+    main(args.profiles, args.repeat)
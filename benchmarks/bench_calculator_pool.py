@@ -0,0 +1,68 @@
+## Benchmark a warm CalculatorPool against starting a calculator process per profile, with the pure-Python stand-in
+# worker (utils/calculator_worker_stub.py). --startup-delay stands in for the R calculator loading the Policy Rules
+# Database, which is what the pool saves on every run after the first.
+#
+#   python benchmarks/bench_calculator_pool.py [--profiles 20] [--workers 2] [--startup-delay 1.0]
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # python -m utils.calculator_worker_stub
+from utils.BeneficiaryProfile import Beneficiary
+from utils.calculator_pool import CalculatorPool, CalculatorWorker, STUB_WORKER_COMMAND
+
+LOCATIONS = ['Kent County, DE', 'New Castle County, DE', 'Sussex County, DE']
+
+
+def make_profiles(n:int) -> list:
+    """n different households (the child's age varies)"""
+    return [Beneficiary(f'bench_{i}', agePerson1=[30], agePerson2=[i % 18], locations=LOCATIONS) for i in range(n)]
+
+
+def run_spawning(profiles:list, command:list, workers:int) -> float:
+    """One worker process per profile, as with one Rscript run per profile"""
+    def run_one(beneficiary):
+        worker = CalculatorWorker(command)
+        try:
+            return worker.run(beneficiary.Profile, beneficiary.locations)
+        finally:
+            worker.stop()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_one, profiles))
+    return time.perf_counter() - start
+
+
+def run_pooled(profiles:list, command:list, workers:int) -> tuple:
+    """Same profiles on a pool of long-lived workers. Returns (startup seconds, run seconds)"""
+    start = time.perf_counter()
+    pool = CalculatorPool(size=workers, command=command)
+    started = time.perf_counter()
+    with pool, ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(pool.run, profiles))
+        print(f"  pool stats: {pool.stats()}")
+    return started - start, time.perf_counter() - started
+
+
+def main(n_profiles=20, workers=2, startup_delay=1.0):
+    profiles = make_profiles(n_profiles)
+    command = STUB_WORKER_COMMAND + ['--startup-delay', str(startup_delay)]
+    print(f"{n_profiles} profiles x {len(LOCATIONS)} locations, {workers} workers, {startup_delay}s worker startup")
+
+    spawning = run_spawning(profiles, command, workers)
+    pool_startup, pooled = run_pooled(profiles, command, workers)
+    print(f"{'process per profile':<24}{spawning:>8.2f}s  ({spawning / n_profiles * 1000:.0f} ms/profile)")
+    print(f"{'warm pool':<24}{pooled:>8.2f}s  ({pooled / n_profiles * 1000:.0f} ms/profile, +{pool_startup:.2f}s startup once)")
+    print(f"{'speedup':<24}{spawning / pooled:>8.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark a warm calculator pool vs. a process per profile')
+    parser.add_argument('--profiles', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--startup-delay', type=float, default=1.0, help='seconds for a worker to load')
+    args = parser.parse_args()
+    main(args.profiles, args.workers, args.startup_delay)
@@ -0,0 +1,59 @@
+## Benchmark the figure builders: plotting.plot_multi / plot_single_profile with fast=True (figure dict built directly)
+# vs. fast=False (go.Figure add_trace/add_annotation/update_* calls), for 1, 3 and 50 curves.
+# Uses synthetic calculator output, so it runs without example_data/.
+#
+#   python benchmarks/bench_figures.py [--repeat 5]
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from benchmarks.timing import timeit
+import utils.plotting as plotting
+
+BENEFITS = ['value.snap', 'value.schoolmeals', 'value.section8', 'value.liheap', 'value.medicaid.adult', 
+            'value.medicaid.child', 'value.aca', 'value.CCDF', 'value.eitc', 'value.ctc']
+
+
+def make_results(n_curves:int, seed=0) -> pd.DataFrame:
+    """Long-format results: one curve (net resources vs income, 0 to 100k) per county, benefits phasing out at random incomes"""
+    rng = np.random.default_rng(seed)
+    income = np.arange(0, 100001, 1000)
+    frames = []
+    for n in range(n_curves):
+        df = pd.DataFrame({'income':income, 'state_county':f'County {n}, DE'})
+        for col in BENEFITS:
+            cutoff = rng.integers(10000, 90000)
+            df[col] = np.where(income < cutoff, rng.uniform(500, 8000), 0).astype(np.float32)
+        df['NetResources'] = (income * 0.8 + df[BENEFITS].sum(axis=1)).astype(np.float32)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(repeat=5):
+    print(f"{'figure':<22}{'curves':>8}{'fast=False (ms)':>18}{'fast=True (ms)':>17}{'speedup':>10}")
+    for n_curves in (1, 3, 50):
+        df = make_results(n_curves)
+        colors = plotting.general_color_palette
+        color_map = {group:colors[n % len(colors)] for n, group in enumerate(df['state_county'].unique())}
+
+        # Includes serializing the figure, as dash does before sending it
+        def multi(fast):
+            return lambda: pio.to_json(plotting.plot_multi(df, 'income', 'NetResources', 'state_county', color_map=color_map, title='', fast=fast), validate=False)
+        cases = [('plot_multi', multi)]
+        if n_curves == 1:
+            def single(fast):
+                return lambda: pio.to_json(plotting.plot_single_profile(df, 'income', 'NetResources', colors[0], 'Net Resources', title='', fast=fast), validate=False)
+            cases.append(('plot_single_profile', single))
+
+        for name, case in cases:
+            legacy, fast = timeit(case(False), repeat), timeit(case(True), repeat)
+            print(f"{name:<22}{n_curves:>8}{legacy * 1000:>18.1f}{fast * 1000:>17.1f}{legacy / fast:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark fast vs. go.Figure figure builders')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case (best time is reported)')
+    main(parser.parse_args().repeat)
@@ -0,0 +1,12 @@
+## Timing helper shared by the benchmark scripts
+import time
+
+
+def timeit(fn, repeat:int) -> float:
+    """Best time of repeat runs (s)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
@@ -1,12 +1,13 @@
 import yaml 
 import os 
 from utils.AzureStorageManager import AzureBlobStorageManager
+from utils.data_registry import DATA_DIR, DATASETS, dataset_path, cache_path, cache_is_fresh, build_cache, read_blob_versions, record_blob_version, get_cube, load_into_store
 
 
 with open(os.path.join('creds', 'api_info.yaml'), 'r') as file:  
     creds = yaml.full_load(file)
 
-download_dir = 'example_data'
+download_dir = DATA_DIR
 
 if not os.path.exists(download_dir): 
     print(f'Creating directory {download_dir}/ to store downloads.')
@@ -26,15 +27,38 @@ expected_blobs = ["all-counties_three-profile_example.csv",
 "SubmitSkills_example_response.json", 
 "counties.json"]
 
+blob_versions = read_blob_versions()
+
 for blob_name in expected_blobs: 
     if blob_name not in blob_list: 
         print(f'Warning: file {blob_name} expected but not found in azure container {creds["container-name-2"]}')
     else: 
-        if not os.path.isfile(os.path.join('example_data', blob_name)):
+        # Re-download if the blob changed since we last downloaded it 
+        last_modified = azure_manager.get_blob_last_modified(blob_name, date_only=False)
+        is_downloaded = os.path.isfile(os.path.join(download_dir, blob_name))
+        if not is_downloaded or blob_versions.get(blob_name) != str(last_modified):
             print(f"Downloading {blob_name} to {download_dir}/")
             try: 
                 azure_manager.download_blob(blob_name)
+                record_blob_version(blob_name, last_modified)
             except Exception as e: 
                 print(f"Failed to download {blob_name}: {e}")
         else: 
-            print(f"{blob_name} already downloaded to {download_dir}. Skipping.")
\ No newline at end of file
+            print(f"{blob_name} already downloaded to {download_dir}. Skipping.")
+
+# Parse the CSVs once here so the app's workers start from the columnar caches and results cubes 
+for name in DATASETS.keys(): 
+    if not os.path.isfile(dataset_path(name)): 
+        continue
+    if cache_is_fresh(name): 
+        print(f"Columnar cache {cache_path(name)} is up to date. Skipping.")
+    else: 
+        try: 
+            print(f"Building columnar cache {cache_path(name)}")
+            build_cache(name, report=True)
+        except ImportError as e: 
+            print(f"Skipping columnar cache: {e}")
+    if DATASETS[name]['cube']: 
+        get_cube(name) # (re)builds the memory-mapped cube if it's stale 
+        if load_into_store(name): 
+            print(f"Loaded {dataset_path(name)} into the results store")
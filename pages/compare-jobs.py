@@ -1,5 +1,5 @@
 import dash
-from dash import dcc, html, Dash, html, Input, Output, callback
+from dash import dcc, html, Dash, html, Input, Output, callback, clientside_callback, ClientsideFunction
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import us 
@@ -9,6 +9,8 @@ import sys
 import pandas as pd 
 sys.path.append(os.pardir)
 import utils.plotting as plotting
+from utils.data_registry import get_index, get_figure_cache, dataset_version
+from utils.figure_cache import figure_key
 from utils.utils_dash import load_job_dict, _load_target_job_options, create_adult, create_kid, list_ordinals
 
 PAGE_NAME = 'Compare Jobs'
@@ -43,6 +45,8 @@ if TEST_MODE: # run with only default options to match the example data
     us_state_options = [{'label':"Delaware", 'value':"DE"}]
     # County 
     counties_dict = {"DE":["New Castle County"]}
+    counties_store_id = f'counties-store-{PAGE_NUMBER}' # only the test county, sent to the browser with the layout
+    counties_store = dcc.Store(id=counties_store_id, data=counties_dict)
     default_county = 'New Castle County'
 
     # Family parameters  
@@ -55,8 +59,9 @@ if TEST_MODE: # run with only default options to match the example data
     # Benefit program selection 
     program_selection = "All Programs"
 
-    # data file 
-    data = pd.read_csv(TEST_FILE)
+    # data file (shared with the other pages, see utils/data_registry.py)
+    data_index = get_index('dash_exports') # (OCC_CODE, CareerPath) -> rows
+    figure_cache = get_figure_cache() # figures already built for a selection/tab
 
 
 else: 
@@ -67,9 +72,10 @@ else:
     us_state_options = [{'label':s.name, 'value':s.abbr} for s in us.states.STATES]
     us_state_options.insert(8, {'label':'District of Columbia', 'value':'DC'})
 
-    # County
-    with open('counties.json', 'r') as file: 
-        counties_dict = json.load(file)
+    # County (counties.json is already in the browser, see 'counties-store' in app.py)
+    counties_dict = None 
+    counties_store_id = 'counties-store'
+    counties_store = None 
     # WIP: get from Azure
     # response  = requests.get('https://benefitscliffs.blob.core.windows.net/dashboard/counties.json') # WIP -- why can I access this outside of the Dash app?
     #  if response == 200: 
@@ -101,6 +107,10 @@ adult_state_storage = [] # TO-DO: replace with pattern-matching state in display
 # Define the layout of the app
 layout = html.Div([
 
+    # Lookup tables for the dropdowns (options are filled in the browser, see assets/clientside.js)
+    dcc.Store(id=f'jobs-store-{PAGE_NUMBER}', data=job_dict), 
+    counties_store, 
+
     html.Div([
         TEST_MODE_DIV,
         # html.Br(),
@@ -223,20 +233,13 @@ layout = html.Div([
 
  ## ---- CALLBACKS ---- ##
 
-## County Dropdown
-@callback(
+## County Dropdown (clientside, see assets/clientside.js)
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='update_county_options'),
     Output('county-dropdown', 'options'), 
-    [Input('state-dropdown', 'value')]
+    [Input('state-dropdown', 'value')], 
+    [State(counties_store_id, 'data')]
 )
-def update_county_options(chosen_state_value): 
-    
-    global counties_dict
-
-    if chosen_state_value is None: 
-        return []
-    
-    counties_in_state = counties_dict[chosen_state_value]
-    return [{'label':county, 'value':county} for county in counties_in_state]
 
 
 ## Adult Dropdown Content
@@ -338,33 +341,15 @@ def display_benefit_options(value, *values):
     return div_content
 
 
-## Job Selection Dropdowns 
-@callback( 
-    Output('target-occupation-group1-dropdown', 'options'), 
-    [Input('broad-occupation-group1-dropdown', 'value')]
-)
-def update_target_jobs_options1(chosen_occ_group): # isomorphic to update_county_options
-    """Update the options in the target dropdown occupations drop down based on the broad occupation group selection"""
-    result = [] if chosen_occ_group is None else  _load_target_job_options(job_dict, chosen_occ_group)
-    return result
-
-@callback( 
-    Output('target-occupation-group2-dropdown', 'options'), 
-    [Input('broad-occupation-group2-dropdown', 'value')]
-)
-def update_target_jobs_options2(chosen_occ_group):
-    """Update the options in the target dropdown occupations drop down based on the broad occupation group selection"""
-    result = [] if chosen_occ_group is None else  _load_target_job_options(job_dict, chosen_occ_group)
-    return result
-    
-@callback( 
-    Output('target-occupation-group3-dropdown', 'options'), 
-    [Input('broad-occupation-group3-dropdown', 'value')]
-)
-def update_target_jobs_options3(chosen_occ_group): 
-    """Update the options in the target dropdown occupations drop down based on the broad occupation group selection"""
-    result = [] if chosen_occ_group is None else  _load_target_job_options(job_dict, chosen_occ_group)
-    return result
+## Job Selection Dropdowns (clientside, isomorphic to update_county_options)
+# Update the options in the target occupation dropdowns based on the broad occupation group selection
+for n in range(1, 4): 
+    clientside_callback(
+        ClientsideFunction(namespace='clientside', function_name='update_target_jobs_options'),
+        Output(f'target-occupation-group{n}-dropdown', 'options'), 
+        [Input(f'broad-occupation-group{n}-dropdown', 'value')], 
+        [State(f'jobs-store-{PAGE_NUMBER}', 'data')]
+    )
     
 
 ### PLOTS
@@ -381,25 +366,23 @@ def update_target_jobs_options3(chosen_occ_group):
 def update_plot_multi_view(n_clicks, *values):
     if n_clicks > 0:
 
-        global data 
-
         colors = plotting.general_color_palette
 
         # selected_careers = ['Nurse Practitioners', 'Licensed Practical and Licensed Vocational Nurses', 'Health Technologists and Technicians, All Other']
         selected_careers = values
-        data_selected = data[data['CareerPath'].isin(selected_careers)]
-
         color_map = dict(zip(selected_careers, colors))
+        title = 'Net Resources Over Time for Selected Jobs (New Castle County, Chosen Profile)'
 
         # Use input_text here to customize the plot if needed
         # fig = px.line(data, x='Year', y='NetResources', color='CareerPath', title='Sample Plot')
         # fig = plotting.plot_tab1(data_selected, color_map=color_map, title='Net Resources Over Time for Selected Jobs (New Castle County, Chosen Profile)')
-        fig = plotting.plot_multi(data_selected,
+        key = figure_key(dataset_version('dash_exports'), None, selected_careers, 'Year', 'NetResources', title, kind='multi')
+        fig = figure_cache.get_or_build(key, lambda: plotting.plot_multi(data_index.select(CareerPath=selected_careers),
                                 x_var='Year', 
                                 y_var='NetResources', 
                                 group_var='CareerPath',
                                 color_map=color_map, 
-                                title='Net Resources Over Time for Selected Jobs (New Castle County, Chosen Profile)')
+                                title=title))
 
         return fig
     else:
@@ -439,7 +422,6 @@ def render_tabs(n_clicks, *values):
 
 def update_plot_tab2(tab, *values):
 
-        global data 
         colors = plotting.general_color_palette
 
         n = ["plot-2-tab-one-graph", 'plot-2-tab-two-graph', 'plot-2-tab-three-graph'].index(tab)
@@ -451,12 +433,13 @@ def update_plot_tab2(tab, *values):
         #                         legend_text=None)
 
                
-        fig = plotting.plot_single_profile(df=data[data['CareerPath'] == values[n]], 
+        key = figure_key(dataset_version('dash_exports'), None, [values[n]], 'Year', 'NetResources', '', kind='single', curve_color=colors[n])
+        fig = figure_cache.get_or_build(key, lambda: plotting.plot_single_profile(df=data_index.select(CareerPath=values[n]), 
                                 curve_color=colors[n], 
                                 curve_name=values[n], 
                                 x_var='Year', 
                                 y_var='NetResources',
-                                title='')
+                                title=''))
 
         div_content = html.Div([
             # html.H3(values[0]),
@@ -467,13 +450,8 @@ def update_plot_tab2(tab, *values):
 
         return div_content
 
-@callback( 
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='reveal_output_div'),
     Output(f'reveal-div-{PAGE_NUMBER}', 'style'),
     [Input({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure')]
 )
-def reveal_output_div(figure):
-    if figure is not None and 'data' in figure: 
-        if figure['data']:
-            return {"display":"block"}
-    else: 
-        return {'display':'none'}
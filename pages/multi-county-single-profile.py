@@ -1,5 +1,5 @@
 import dash
-from dash import dcc, html, Dash, html, Input, Output, callback, register_page, ALL, MATCH, callback_context
+from dash import dcc, html, Dash, html, Input, Output, callback, register_page, ALL, MATCH, callback_context, clientside_callback, ClientsideFunction
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
@@ -13,37 +13,35 @@ import pandas as pd
 import utils.plotting as plotting
 from utils.load_creds import load_creds
 from utils.BeneficiaryProfile import Beneficiary
-from utils.utils_dash import create_adult, create_kid, list_ordinals, extract_ben_dict
-from utils.AzureStorageManager import AzureBlobStorageManager
-
-from io import StringIO
+from utils.utils_dash import create_adult, create_kid, list_ordinals, extract_ben_dict, show_trace_group
+from utils.data_registry import get_cube, get_results_store, get_figure_cache, dataset_path, dataset_version
+from utils.figure_cache import figure_key
+from utils.calculator_jobs import get_calculator_jobs, format_status
 
 
 PAGE_NAME = "Compare Counties"
 PAGE_NUMBER = 3
 
 TEST_MODE = True
-use_azure = False
 if TEST_MODE:  
-    example_data_fp = os.path.join('example_data', 'all-counties_three-profile_example.csv')
-    if os.path.isfile(example_data_fp) and not use_azure: 
-        df_example = pd.read_csv(example_data_fp)
-    else: 
-        creds = load_creds()
-        azure_manager = AzureBlobStorageManager(container_name=creds['azure']['container-name-2'], 
-                                        connection_str=creds['azure']['conn-str'])  
-        
-        downloaded_blob = azure_manager.container_client.download_blob(os.path.basename(example_data_fp), encoding='utf-8')        
-        df_example = pd.read_csv(StringIO(downloaded_blob.readall()), low_memory=False)
-        print('Downloaded test csv from azure')
+    example_data_fp = dataset_path('all_counties')
+    example_cube = get_cube('all_counties') # memory-mapped, shared by all workers (csv downloaded from azure if not in example_data/)
+
+    select_results = example_cube.select 
+    results_version = lambda: dataset_version('all_counties')
 
     TEST_MODE_DIV = f'TEST_MODE: Using example data file {example_data_fp}: '
-    for profile in df_example['BeneficiaryProfile'].unique(): 
+    for profile in example_cube.profiles.values(): 
         TEST_MODE_DIV += f'\n({profile})'
 
 else: 
     TEST_MODE_DIV = ''
-    df_global = pd.DataFrame()
+    results_store = get_results_store() # SQLite, filled by calculator runs 
+    select_results = results_store.query
+    results_version = results_store.version
+    calculator_jobs = get_calculator_jobs() # calculator runs for submitted profiles, see run_on_submit 
+
+figure_cache = get_figure_cache() # figures already built for a profile/location selection
 
 register_page(__name__, name = PAGE_NAME, path="/multi-county-single-profile")
 
@@ -59,9 +57,7 @@ us_state_options.insert(8, {'label':'District of Columbia', 'value':'DC'})
 
 default_state_value = 'DE'
 
-# County
-with open('counties.json', 'r') as file: 
-    counties_dict = json.load(file)
+# County (options filled in the browser from the counties-store, see update_county_options)
 default_counties = ['New Castle County', 'Kent County', 'Sussex County']
 
 # Family parameters  
@@ -132,7 +128,9 @@ layout = html.Div([
             ## Submit Form
             html.Div([
                 html.Button(id={'type':'submit-button', 'index':PAGE_NUMBER}, n_clicks=0, children='Submit'), 
+                html.Div(id=f'calculator-progress-{PAGE_NUMBER}'), 
             ], style={"text-align":"center"}),
+            dcc.Store(id=f'calculator-job-store-{PAGE_NUMBER}'), # status of the last calculator run (not used in TEST_MODE)
  
         ], id={'type':'select-bar', 'index':PAGE_NUMBER}, className='three columns'), 
         
@@ -141,26 +139,20 @@ layout = html.Div([
         dcc.Graph(id={'type':'plot-multi-view', 'index':PAGE_NUMBER}),
         # Single-View Tabs 
         html.Div(id={'type':'plot-single-view-div', 'index':PAGE_NUMBER}),
+        dcc.Store(id={'type':'trace-group-store', 'index':PAGE_NUMBER}), # trace indices of each single view tab 
             ], id='reveal-div', hidden=True, className='seven columns')
 
     ])
 
  ## ---- CALLBACKS ---- ##
 
-## County Dropdown
-@callback(
+## County Dropdown (clientside, counties-store is in app.py)
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='update_county_options'),
     Output({'type':'county-dropdown', 'index':MATCH}, 'options'), 
-    [Input({'type':'state-dropdown', 'index':MATCH}, 'value')]
+    [Input({'type':'state-dropdown', 'index':MATCH}, 'value')], 
+    [State('counties-store', 'data')]
 )
-def update_county_options(chosen_state_value): 
-    
-    global counties_dict
-
-    if chosen_state_value is None: 
-        return []
-    
-    counties_in_state = counties_dict[chosen_state_value]
-    return [{'label':county, 'value':county} for county in counties_in_state]
 
 
 ## Adult Dropdown Content
@@ -300,116 +292,130 @@ def extract_beneficiary_information(n_clicks, *values):
         # df = pd.read_csv(current_profile.output_path)
 
 
-# @callback(        
-# )
-# TO-DO: def run_on_submit(): 
-#     """Read input/beneficiary state from store, run calculations, and store data in temporary database table"""
-    #   # dcc.Store() not large enough
-    #   # might run for all counties and keep cached?   
+## Calculator runs (not in TEST_MODE, the example cube has the results)
+# Background callback: the calculator job runs in its own process and reports progress to the page. Resubmitting
+# terminates the previous run. Plots update when the job store says the results are in the results store.
+if not TEST_MODE: 
+    @callback(
+        Output(f'calculator-job-store-{PAGE_NUMBER}', 'data'), 
+        [Input('county-comparison-beneficiary-store', 'data')], 
+        background=True, 
+        progress=[Output(f'calculator-progress-{PAGE_NUMBER}', 'children')], 
+        prevent_initial_call=True
+    )
+    def run_on_submit(set_progress, data): 
+        """Run the calculator for the submitted profile (unless the results store already has all its locations)"""
+        if not data: 
+            return dash.no_update
+        ben_profile = Beneficiary(project_name='county-comparison', **data)
+
+        missing = set(data['locations']) - set(results_store.locations(ben_profile.profile_key))
+        if not missing: 
+            set_progress('')
+            return {'state':'done', 'profile_key':ben_profile.profile_key, 'job_id':None}
+
+        # Only the locations without results (same household, so same ProfileKey in the store)
+        ben_profile = Beneficiary(project_name='county-comparison', **dict(data, locations=[location for location in data['locations'] if location in missing]))
+        status = calculator_jobs.run(ben_profile, progress=lambda status: set_progress(format_status(status)))
+        return status
+
+
+def results_ready(data, job) -> bool: 
+    """Whether the results of the submitted profile can be plotted (always in TEST_MODE)"""
+    if TEST_MODE: 
+        return True
+    return job is not None and job['state'] == 'done' and job['profile_key'] == Beneficiary(project_name='county-comparison', **data).profile_key
 
 @callback( 
     Output({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure'),
     [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks'), 
-     Input('county-comparison-beneficiary-store', 'data')] # Not working when store passed in through state parameter
+     Input('county-comparison-beneficiary-store', 'data'), # Not working when store passed in through state parameter
+     Input(f'calculator-job-store-{PAGE_NUMBER}', 'data')]
      # Store only changes when button is clicked so this doesn't create more callbacks
 )
-def update_plot_multi_view(n_clicks, data):
+def update_plot_multi_view(n_clicks, data, job=None):
     """Update Plot Multi View On Click"""
     if n_clicks > 0: 
-        print(data)
-        if TEST_MODE: 
-            df = df_example.copy()  # In  production we will be reading from a pre-generated database table.
-            # This block is awkward way to filter our example CSV by profile. 
-            # Ordinarily there will be just one table for one profile.
-            df = df[df['state_county'].isin(data['locations'])]
-            ben_profile = Beneficiary(project_name='county-comparison', **data)
-            chosen_profile = ben_profile.non_default().copy()
-            chosen_profile.pop('locations')
-            chosen_profile_str = json.dumps(chosen_profile)
-
-            df = df[df['BeneficiaryProfile'] == chosen_profile_str]
-
-        else: 
-            return "Non-test-mode WIP"
+        if not results_ready(data, job): 
+            return dash.no_update
 
+        print(data)
+        # Example cube in TEST_MODE, results store otherwise 
+        ben_profile = Beneficiary(project_name='county-comparison', **data)
         color_map = dict(zip(data['locations'], plotting.general_color_palette))
+        title = f'Net Resources vs. Income Bracket, County Comparison'
 
-        multi_view_fig = plotting.plot_multi(df=df, 
+        key = figure_key(results_version(), ben_profile.profile_key, data['locations'], 'income', 'NetResources', title, kind='multi')
+        multi_view_fig = figure_cache.get_or_build(key, lambda: plotting.plot_multi(
+                                    df=select_results(profile_keys=[ben_profile.profile_key], locations=data['locations']), 
                                     x_var='income', 
                                     y_var='NetResources',
                                     group_var='state_county', 
                                     color_map=color_map, 
-                                    title=f'Net Resources vs. Income Bracket, County Comparison')
+                                    title=title))
         return multi_view_fig 
     
     else:
         return {} 
     
 @callback( 
-    Output({'type':'plot-single-view-div', 'index':PAGE_NUMBER}, 'children'),
+    [Output({'type':'plot-single-view-div', 'index':PAGE_NUMBER}, 'children'),
+     Output({'type':'trace-group-store', 'index':PAGE_NUMBER}, 'data')],
     [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks'), 
-    Input('county-comparison-beneficiary-store', 'data')],
+    Input('county-comparison-beneficiary-store', 'data'), 
+    Input(f'calculator-job-store-{PAGE_NUMBER}', 'data')],
     prevent_initial_call=True,
     )
-def render_single_view_tabs(n_clicks, data):
-    """Renders the single view tabs based on the selected locations"""
-    if n_clicks > 0: 
-         return [
+def render_single_view_tabs(n_clicks, data, job=None):
+    """Renders the single view tabs based on the selected locations. 
+    The figure holds the curves of all locations, switching tabs only changes which are visible (see update_single_view_tabs)"""
+    if n_clicks > 0 and results_ready(data, job): 
+        ben_profile = Beneficiary(project_name='county-comparison', **data)
+        color_map = dict(zip(data['locations'], plotting.general_color_palette))
+
+        key = figure_key(results_version(), ben_profile.profile_key, data['locations'], 'income', 'NetResources', '', kind='single-tabs')
+        fig = figure_cache.get(key)
+        if fig is None: 
+            df = select_results(profile_keys=[ben_profile.profile_key], locations=data['locations'])
+            fig = figure_cache.set(key, plotting.plot_single_profile_tabs(
+                dfs={location:df[df['state_county'] == location] for location in data['locations']}, 
+                x_var='income', 
+                y_var='NetResources',
+                curve_colors=color_map, 
+                curve_names={location:f'Net Resources ({location.split(",")[0]})' for location in data['locations']}, 
+                title=''
+            ))
+
+        return [
             dcc.Tabs(id="plot-single-view-tabs", value=data['locations'][0], children=[
-                dcc.Tab(label=data['locations'][0], value=data['locations'][0]),
-                dcc.Tab(label=data['locations'][1], value=data['locations'][1]),
-                dcc.Tab(label=data['locations'][2], value=data['locations'][2]),
+                dcc.Tab(label=location, value=location) for location in data['locations']
             ]),
-        html.Div(id={'type':"plot-single-view-chosen-tab", 'index':PAGE_NUMBER})
-        ]
+        html.Div([dcc.Graph(id={'type':'plot-single-view', 'index':PAGE_NUMBER}, figure=fig)], 
+                 id={'type':"plot-single-view-chosen-tab", 'index':PAGE_NUMBER})
+        ], fig['layout']['meta']['trace_groups']
+    
+    return dash.no_update, dash.no_update
 
 
-# Load the content of the tabs (based on selected tab)
+# Show the curve of the selected tab (partial update, the figure already has every location's traces)
 @callback(
-    Output({'type':'plot-single-view-chosen-tab', 'index':PAGE_NUMBER}, 'children'),
+    Output({'type':'plot-single-view', 'index':PAGE_NUMBER}, 'figure'),
     [Input('plot-single-view-tabs', 'value')],
-    [State({'type':'county-dropdown', 'index':ALL}, 'value'), 
-     State({'type':'state-dropdown', 'index':ALL}, 'value'),
-     State('county-comparison-beneficiary-store', 'data')] # wait why is passing store as state working here? 
+    [State({'type':'trace-group-store', 'index':PAGE_NUMBER}, 'data')], 
+    prevent_initial_call=True
 )
-def update_single_view_tabs(tab, *values):
-    if TEST_MODE: 
-        df = df_example.copy()
-        ben_profile = Beneficiary(project_name='user', **values[-1]) 
-        chosen_profile = ben_profile.non_default().copy()
-        chosen_profile.pop('locations')
-        chosen_profile_str = json.dumps(chosen_profile) 
-
-        df = df[df['BeneficiaryProfile'] == chosen_profile_str]
-
-        print(ben_profile.non_default())
-
-    locations = [", ".join(tup) for tup in zip(values[0], values[1])]
-    color_map = dict(zip(locations, plotting.general_color_palette))
-
-    fig = plotting.plot_single_profile(
-        df = df[df['state_county'] == tab], 
-        x_var='income', 
-        y_var='NetResources',
-        curve_color=color_map[tab], 
-        curve_name=f'Net Resources ({tab.split(",")[0]})', 
-        title=''
-
-    )
-
-    return dcc.Graph(figure=fig) 
+def update_single_view_tabs(tab, trace_groups):
+    if not trace_groups: 
+        return dash.no_update
+    
+    return show_trace_group(trace_groups, tab)
     
 
-@callback( 
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='reveal_output_div'),
     Output('reveal-div', 'style'),
     [Input({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure')]
 )
-def reveal_output_div(figure):
-    if figure is not None and 'data' in figure: 
-        if figure['data']:
-            return {"display":"block"}
-    else: 
-        return {'display':'none'}
 
 
 
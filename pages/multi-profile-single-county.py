@@ -1,5 +1,5 @@
 import dash
-from dash import dcc, html, Dash, html, Input, Output, callback, register_page, ALL, MATCH, callback_context
+from dash import dcc, html, Dash, html, Input, Output, callback, register_page, ALL, MATCH, callback_context, clientside_callback, ClientsideFunction
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
@@ -7,12 +7,19 @@ import us
 import os
 import json
 import sys
+import itertools
 import pandas as pd 
 sys.path.append(os.pardir)
 sys.path.append(os.path.join( os.pardir))
 import utils.plotting as plotting
 from utils.BeneficiaryProfile import Beneficiary
-from utils.utils_dash import load_job_dict, _load_target_job_options, create_adult, create_kid, list_ordinals
+from utils.data_registry import get_cube, get_results_store, get_figure_cache, dataset_path, dataset_version
+from utils.figure_cache import figure_key
+from utils.utils_dash import load_job_dict, _load_target_job_options, create_adult, create_kid, list_ordinals, show_trace_group, extract_ben_dict
+from utils.calculator_jobs import get_calculator_jobs, format_status
+from utils.calculator_pool import CalculatorError
+from utils.calculator_batch import run_batch
+from utils.precompute import request_precompute
 
 
 
@@ -26,14 +33,21 @@ dash.register_page(__name__, name=PAGE_NAME, path=page_path)
 # PAGE_NUMBER = list(dash.page_registry.keys()).index(page_registry_name) 
 TEST_MODE = True
 if TEST_MODE:  
-    example_data_fp = os.path.join('example_data', 'all-counties_three-profile_example.csv')
-    df_example = pd.read_csv(example_data_fp)
+    example_data_fp = dataset_path('all_counties')
+    example_cube = get_cube('all_counties') # memory-mapped, shared by all workers
+    select_results = example_cube.select
+    results_version = lambda: dataset_version('all_counties')
     TEST_MODE_DIV = f'TEST_MODE: Using example data file {example_data_fp}: '
-    for profile in df_example['BeneficiaryProfile'].unique(): 
+    for profile in example_cube.profiles.values(): 
         TEST_MODE_DIV += f'\n({profile})'
 else: 
     TEST_MODE_DIV = ''
-    df_global = pd.DataFrame()
+    results_store = get_results_store() # SQLite, filled by calculator runs 
+    select_results = results_store.query
+    results_version = results_store.version
+    calculator_jobs = get_calculator_jobs() # calculator runs for submitted profiles, see run_on_submit 
+
+figure_cache = get_figure_cache() # figures already built for a location
 
 register_page(__name__, name = PAGE_NAME, path="/multi-profile-single-county")
 
@@ -47,9 +61,7 @@ us_state_options.insert(8, {'label':'District of Columbia', 'value':'DC'})
 
 default_state_value = 'DE'
 
-# County
-with open('counties.json', 'r') as file: 
-    counties_dict = json.load(file)
+# County (options filled in the browser from the counties-store, see update_county_options)
 default_counties = ['New Castle County', 'Kent County', 'Sussex County']
 
 # Family parameters  
@@ -71,6 +83,7 @@ layout = html.Div([
     dcc.Store(id={'type':'beneficiary-store', 'index':1}, data = {}),
     dcc.Store(id={'type':'beneficiary-store', 'index':2}, data = {}),
     dcc.Store(id={'type':'beneficiary-store', 'index':3}, data = {}),
+    dcc.Store(id={'type':'trace-group-store', 'index':PAGE_NUMBER}), # trace indices of each single view tab 
 
     html.Div(TEST_MODE_DIV), 
 
@@ -124,6 +137,8 @@ layout = html.Div([
                                     html.Br(),
                                     html.Button(id={'type':'submit-button', 'index':PAGE_NUMBER}, 
                                                 n_clicks=0,children='Submit'),
+                                    html.Div(id=f'calculator-progress-{PAGE_NUMBER}'), 
+                                    dcc.Store(id=f'calculator-job-store-{PAGE_NUMBER}'), # submitted profiles and state of their calculator runs (not used in TEST_MODE)
                                     html.Br(),
                                     html.Br(),
                                     html.Div(id='toggle-view-div', hidden=True, 
@@ -178,20 +193,13 @@ layout = html.Div([
 
  ## ---- CALLBACKS ---- ##
 
-## County Dropdown
-@callback(
+## County Dropdown (clientside, counties-store is in app.py)
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='update_county_options'),
     Output(f'county-dropdown-{PAGE_NUMBER}', 'options'), 
-    [Input(f'state-dropdown-{PAGE_NUMBER}', 'value')]
+    [Input(f'state-dropdown-{PAGE_NUMBER}', 'value')], 
+    [State('counties-store', 'data')]
 )
-def update_county_options(chosen_state_value): 
-    
-    global counties_dict
-
-    if chosen_state_value is None: 
-        return []
-    
-    counties_in_state = counties_dict[chosen_state_value]
-    return [{'label':county, 'value':county} for county in counties_in_state]
 
 
 ## Adult Dropdown Content
@@ -240,55 +248,28 @@ def add_kids(n:int):
 
 ## PLOTS 
 
-# Reveal View Toggle 
-@callback(
+# Reveal View Toggle (clientside, see assets/clientside.js)
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='reveal_view_toggle'),
     Output('toggle-view-div', 'style'),
     [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks')],
-    
 )
-def reveal_view_toggle(n_clicks ): 
-    if n_clicks > 0: 
-        return {'display':'block'}
-    else:
-        return  {'display':'none'}
 
-# Toggle View Options    
-@callback(
+# Toggle View Options (clientside)
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='toggle_multi_view'),
     Output({'type':'plot-multi-view-div', 'index':PAGE_NUMBER}, 'style'),
     [Input("view-toggle", "value")] 
 )
-def toggle_multi_view(value): 
-    """Change plot view from radio button."""
 
-    if value == 'All Profiles':
-        return {'display':'block'}
-    else: 
-        return {'display':'none'} 
-    
-@callback(
+clientside_callback(
+    ClientsideFunction(namespace='clientside', function_name='toggle_single_view'),
     Output({'type':'plot-single-view-div', 'index':PAGE_NUMBER}, 'style'),
     [Input("view-toggle", "value")] 
 )
-def toggle_single_view(value):
-    """Change plot view from radio button."""
-
-    if value == 'Single Profile':
-        return {'display':'block'}
-    else: 
-        return {'display':'none'}
-
-@callback(
-    
-    [Output({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure'),
-     Output({'type':'plot-single-view', 'index':PAGE_NUMBER}, 'figure')],
-
-    [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks')],
-    
-    [   ### State and County States
-        State('county-preload-checklist', 'value'),
-        State(f'state-dropdown-{PAGE_NUMBER}', 'value'), 
-        State(f'county-dropdown-{PAGE_NUMBER}', 'value'), 
 
+# Profile form (past beneficiaries and the current one), read with callback_context.states_list (see extract_ben_dict)
+profile_states = [
         ### Past Beneficiary States     
         State({'type':'beneficiary-store', 'index':ALL}, 'data'), 
 
@@ -306,72 +287,143 @@ def toggle_single_view(value):
         # (WIP) Program/Benefits selections
         State({'type':'anyone-SSI', 'index':ALL}, 'value'),
         State({'type':'disab-work-expenses', 'index':ALL}, 'value'),
+]
+
+## Calculator runs (not in TEST_MODE, the example cube has the results)
+# Background callback: the batch runs in its own process and reports progress to the page, so calculator runs don't 
+# hold a server worker. Plots update when the job store says the results are in the results store (see update_plots).
+if not TEST_MODE: 
+    @callback(
+        Output(f'calculator-job-store-{PAGE_NUMBER}', 'data'), 
+        [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks')],
+        [State('county-preload-checklist', 'value'),
+         State(f'state-dropdown-{PAGE_NUMBER}', 'value'), 
+         State(f'county-dropdown-{PAGE_NUMBER}', 'value')] + profile_states, 
+        background=True, 
+        progress=[Output(f'calculator-progress-{PAGE_NUMBER}', 'children')], 
+        prevent_initial_call=True
+    )
+    def run_on_submit(set_progress, n_clicks, preload, state, county, past_profiles, *values): 
+        """Run the calculator for the submitted profiles at the selected county. run_batch only runs it for households 
+        without results there, once per household (repeated/equivalent profiles share a run)."""
+        if not n_clicks: 
+            return dash.no_update
+        location = county + ", " + state # state_county
+
+        # TO-DO: Write the current profile to the next beneficiary store
+        ben_dict = extract_ben_dict([states for states in callback_context.states_list if isinstance(states, list)])
+        profiles = [data for data in past_profiles if data] + [ben_dict]
+        beneficiaries = [Beneficiary(f'county-view-{n}', **dict(profile, locations=[location])) for n, profile in enumerate(profiles, start=1)]
+        job = {'location':location, 'profile_keys':list(dict.fromkeys(ben.profile_key for ben in beneficiaries))} # tab order
+
+        # Every county is too much for a callback: queue the profiles for precompute_counties.py --queue, 
+        # which fills the results store in the background
+        if preload: # 'Pre-load for all counties'
+            for profile in profiles: 
+                request_precompute(Beneficiary('precompute', **profile))
+
+        try: 
+            run_batch([(ben, None) for ben in beneficiaries], jobs=calculator_jobs, progress=lambda status: set_progress(format_status(status)))
+        except CalculatorError as e: 
+            set_progress(f'Calculator failed: {e}')
+            return dict(job, state='failed', message=str(e))
+        return dict(job, state='done')
 
-        ### Current Figures 
-        ## We need to return these if the figures don't need to change 
-        State({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure'),
-        State({'type':'plot-single-view', 'index':PAGE_NUMBER}, 'figure')
+
+@callback(
+    
+    [Output({'type':'plot-multi-view', 'index':PAGE_NUMBER}, 'figure'),
+     Output({'type':'plot-single-view', 'index':PAGE_NUMBER}, 'figure'), 
+     Output({'type':'trace-group-store', 'index':PAGE_NUMBER}, 'data')],
+
+    [Input({'type':'submit-button', 'index':PAGE_NUMBER}, 'n_clicks'), 
+     Input(f'calculator-job-store-{PAGE_NUMBER}', 'data')],
+    
+    [   ### State and County States
+        State(f'state-dropdown-{PAGE_NUMBER}', 'value'), 
+        State(f'county-dropdown-{PAGE_NUMBER}', 'value'), 
+
+        # Current figures aren't passed in as State (the whole figure JSON would be sent back with every submit): 
+        # return dash.no_update for a figure that doesn't need to change
   ], 
   prevent_initial_call=True 
 )
-def rerun_calc(n_clicks, *values):  
-    """Check for changes in beneficiary profiles; re-run script for those which changed; update temporary db table."""
+def update_plots(n_clicks, job, state, county):  
+    """Plot the submitted profiles at the selected county once run_on_submit has their results (every example profile in TEST_MODE)"""
     
-    if n_clicks > 0: 
-        if TEST_MODE:
-            
-
-            multi_view_fig, single_view_fig = go.Figure(), go.Figure()
-
-            global df_example 
-            df = df_example.copy()
-            df = df[(df['stateAbbrev'] == values[1]) & (df['countyortownName'] == values[2])]
-
-
-            color_map = dict(zip((df['BeneficiaryProfile'].unique()), plotting.general_color_palette))
-
-            multi_view_fig = plotting.plot_multi(
+    if n_clicks > 0:
+        if TEST_MODE: 
+            location, profile_keys = county + ", " + state, None
+        elif callback_context.triggered_id == f'calculator-job-store-{PAGE_NUMBER}' and job and job['state'] == 'done': 
+            location, profile_keys = job['location'], job['profile_keys']
+        else: # submitted, wait for the calculator 
+            return dash.no_update, dash.no_update, dash.no_update
+
+        title = f'Net Resources in ' + location
+
+        # The profiles are part of the key in tab order (which sets the tabs and colors)
+        multi_view_key = figure_key(results_version(), profile_keys, [location], 'income', 'NetResources', title, kind='multi')
+        single_view_key = figure_key(results_version(), profile_keys, [location], 'income', 'NetResources', '', kind='single-tabs')
+        multi_view_fig, single_view_fig = figure_cache.get(multi_view_key), figure_cache.get(single_view_key)
+        if multi_view_fig is not None and single_view_fig is not None: 
+            return multi_view_fig, single_view_fig, single_view_fig['layout']['meta']['trace_groups']
+
+        df = select_results(profile_keys=profile_keys, locations=[location]) # example cube in TEST_MODE, results store otherwise
+
+        if len(df) > 0: 
+
+            # Submitted profiles in tab order (BeneficiaryProfile of each ProfileKey), every profile of the example cube in TEST_MODE
+            if profile_keys is None: 
+                profiles = list(df['BeneficiaryProfile'].unique())
+            else: 
+                profile_names = df.drop_duplicates('ProfileKey').set_index('ProfileKey')['BeneficiaryProfile']
+                profiles = [profile_names[key] for key in profile_keys if key in profile_names.index]
+            color_map = dict(zip(profiles, itertools.cycle(plotting.general_color_palette)))
+
+            multi_view_fig = figure_cache.set(multi_view_key, plotting.plot_multi(
                 df=df, 
                 x_var='income', 
                 y_var='NetResources', 
                 group_var='BeneficiaryProfile', 
-                title=f'Net Resources in ' + values[2] +  ", " + values[1],
+                title=title,
                 color_map=color_map, 
-            )
-
-            # # TO-DO: Read state of first beneficiary store object  
-            chosen_prof = df['BeneficiaryProfile'].iloc[0]
+            ))
 
-            dff=df[df['BeneficiaryProfile'] == chosen_prof]
+            # One tab per profile ("Beneficiary #1", ...); every profile's traces are in the single view figure, 
+            # switching tabs only changes which are visible (see update_single_view_tabs)
+            tab_profiles = {f'Beneficiary #{n}':profile for n, profile in enumerate(profiles, start=1)}
 
-            single_view_fig = plotting.plot_single_profile( # Pre-loads figure of first beneficiary profile into the first tab  
-                df=dff, 
+            single_view_fig = figure_cache.set(single_view_key, plotting.plot_single_profile_tabs( # first beneficiary profile shown in the first tab  
+                dfs={tab:df[df['BeneficiaryProfile'] == profile] for tab, profile in tab_profiles.items()}, 
                 x_var='income', 
                 y_var='NetResources',
-                curve_color=plotting.general_color_palette[0], 
-                curve_name='Net Resources', 
+                curve_colors={tab:color_map[profile] for tab, profile in tab_profiles.items()}, 
+                curve_names={tab:'Net Resources' for tab in tab_profiles}, 
                 title='', 
-                ben_profile_text=None, 
+            ))
 
-            )
-
-            return multi_view_fig, single_view_fig
-        
-        else: 
+            return multi_view_fig, single_view_fig, single_view_fig['layout']['meta']['trace_groups']
+    
+    return None, None, None 
 
-            # Check stores for prev config of each beneficiary 
-            # Check current element states vs store to see which beneficiaries changed 
-            # Rerun script and re-load table for each changed profile  
 
-            return None, None
+# Show the selected profile's curve (partial update, the figure already has every profile's traces)
+@callback(
+    Output({'type':'plot-single-view', 'index':PAGE_NUMBER}, 'figure', allow_duplicate=True),
+    [Input('plot-single-view-tabs', 'value')],
+    [State({'type':'trace-group-store', 'index':PAGE_NUMBER}, 'data')], 
+    prevent_initial_call=True
+)
+def update_single_view_tabs(tab, trace_groups): 
+    if not trace_groups: 
+        return dash.no_update
     
-    return None, None 
+    return show_trace_group(trace_groups, tab)
 
 
 
 
 ## TO-DO:
-# Add callback to render and populate tabs
 # Pre-display tabs
 
 
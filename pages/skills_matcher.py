@@ -4,7 +4,6 @@ import os
 import random
 import pandas as pd 
 import numpy as np
-import requests
 import yaml 
 import sys
 from dash import dcc, html, Input, Output, State, ALL, callback_context, dash_table, register_page, callback
@@ -12,9 +11,8 @@ from dash import dcc, html, Input, Output, State, ALL, callback_context, dash_ta
 # sys.path.append(os.path.join( os.pardir))
 import utils.plotting as plotting
 from utils.utils_dash import load_job_dict, _load_target_job_options, create_adult, create_kid, list_ordinals
-from utils.AzureStorageManager import AzureBlobStorageManager
-from utils.load_creds import load_creds
-from io import StringIO
+from utils.data_registry import get_index, dataset_path
+from utils.skills_matcher_client import get_client, SkillsMatcherError
 
 
 PAGE_NAME = 'Skills Matcher'
@@ -22,32 +20,21 @@ PAGE_NUMBER = 5
 
 register_page(__name__, path='/skills-matcher', name=PAGE_NAME)
 
-TEST_FILE = os.path.join('example_data', 'DASH_exports_combined_New-Castle-County_30-adult_5-child_2-child_EDU+CODES.csv')
-creds = load_creds()
-azure_manager = AzureBlobStorageManager(connection_str=creds['azure']['conn-str'],
-                                        container_name=creds['azure']['container-name-1'])
-if not os.path.isfile(TEST_FILE): 
-    downloaded_blob = azure_manager.container_client.download_blob(os.path.basename(TEST_FILE), encoding='utf-8')
-    df = StringIO(downloaded_blob.readall(), low_memory=False)
-else: 
-    df = pd.read_csv(TEST_FILE)
+TEST_FILE = dataset_path('dash_exports')
+data_index = get_index('dash_exports') # (OCC_CODE, CareerPath) -> rows, downloaded from azure if not in example_data/
+baseline_occ_codes = {occ_code for occ_code, _ in data_index.group_keys()} # jobs with projections in the example data
 
 RAND_TEST = True # print the random state to show
 RAND_RIG = True # rig randomness to pre-approved state
 approved_seeds = [580319, 151581, 869597, -181500, 940268, 11260, -211808, -355837]
 
 
-save_request, save_response = False, False
+# Saved example request/response, warm the client's response cache 
 example_sm_request = os.path.join('example_data', 'SubmitSkills_example_request.json')
 example_sm_response = os.path.join('example_data', 'SubmitSkills_example_response.json')
-if not os.path.isfile(example_sm_request): 
-    save_request = True
-if not os.path.isfile(example_sm_response): 
-    save_response = True
 
-## Load api credentials  
-with open(os.path.join( 'creds', 'api_info.yaml'), 'r') as file: 
-    CREDS = yaml.safe_load(file)
+## API client (pooled session, timeouts, retries, responses cached by answers; credentials from creds/api_info.yaml)
+skills_matcher = get_client(seed=(example_sm_request, example_sm_response))
 
 ### Dynamically create HTML divs with questions from question-answer key:  
 fp_skill_list = os.path.join('example_data','GetSkills_Response.json')
@@ -150,12 +137,16 @@ def change_answers(n_clicks_rand, n_clicks_max, *values):
 
 
 ### JSON API request but send to datatable 
+# Background callback (manager in app.py): a slow Skills Matcher response doesn't hold a server worker
 @callback(
     Output('recommended-jobs-table-div', 'children'),
     [Input('submit-button-skills', 'n_clicks')],
     # submit_state_storage
     [State({'type':'question', 'index':ALL}, 'value'), 
-     State('max-jobs-display', 'value')]
+     State('max-jobs-display', 'value')], 
+    background=True, 
+    running=[(Output('submit-button-skills', 'disabled'), True, False)], 
+    prevent_initial_call=True
 )
 def send_get_request(n_clicks, *values):
     if n_clicks > 0:
@@ -165,73 +156,44 @@ def send_get_request(n_clicks, *values):
             for qa_dict, answer in zip(skill_list['Skills'], values[0]): 
                 answers.append({"ElementId":qa_dict['ElementId'], "DataValue":answer})
 
-            request_body = {'SKAValueList':answers} # request body to Skills Matcher
-
-            if save_request:
-               with open(example_sm_request, 'w') as file: 
-                   json.dump(request_body, file, indent=4)
-                   print('Saved request as example')
-
-            # Make request 
-            user_id = CREDS['career-onestop']['user-id']
-            api_token = CREDS['career-onestop']['token-key']
-            headers = CREDS['career-onestop']['headers']
-            url = f"https://api.careeronestop.org/v1/skillsmatcher/{user_id}"           
-            params = {
-                'API Token':api_token, 
-                'userId':user_id, 
-                'body':request_body, 
-                # sortColumn
-                # sortOrder
-                # eduFilterValue -- will use this in final app
-                }
-            
-            response = requests.post(url=url,params=params,headers=headers, json=request_body) 
-            if response.status_code == 200: 
-                response_json = response.json()
-                if save_response: 
-                    with open(example_sm_response, 'w') as file: 
-                        json.dump(response_json, file, indent=4)
-                        print("Saved example response")
-
-                recommended_job_dicts = response_json['SKARankList']
-
-                df = pd.DataFrame(recommended_job_dicts,columns=['OnetCode','Rank', 'OccupationTitle', 'TypicalEducation', 'AnnualWages','Outlook'] )\
-                        .rename({'OnetCode':'OCC_CODE', 
-                        'OccupationTitle':'Occupation Title',
-                        'Rank':'Match Rank','TypicalEducation':"Typical Education", "AnnualWages":"Annual Wages"}, axis=1)
-                df.to_csv(os.path.join('example_data', 'skills-matcher-results-latest.csv'), index=False)
-
-                fp = os.path.join('example_data', 'DASH_exports_combined_New-Castle-County_30-adult_5-child_2-child_EDU+CODES.csv')
-                df_DE_baseline_jobs = pd.read_csv(fp)
-                df_DE_baseline_jobs = df_DE_baseline_jobs['OCC_CODE'].unique()
-
-                dff = df[df['OCC_CODE'].isin(df_DE_baseline_jobs)].reset_index(drop=True)
-                print('Recommended Jobs with matches in DE example data: ')
-                print(dff.shape)
-                print('Warning: changing Rank vs Skills Matcher Original:')
-                dff['Match Rank'] = dff.index + 1
-
-                max_jobs = values[1] 
-                if max_jobs != 'No Limit':
-                    dff = dff[dff['Match Rank'] <= max_jobs
+            # Make request (body: {'SKAValueList':answers}), or read the cached response to the same answers
+            try: 
+                response_json = skills_matcher.submit_skills(answers)
+            except SkillsMatcherError as e: 
+                print(e)
+                return json.dumps(str(e))
+
+            recommended_job_dicts = response_json['SKARankList']
+
+            df = pd.DataFrame(recommended_job_dicts,columns=['OnetCode','Rank', 'OccupationTitle', 'TypicalEducation', 'AnnualWages','Outlook'] )\
+                    .rename({'OnetCode':'OCC_CODE', 
+                    'OccupationTitle':'Occupation Title',
+                    'Rank':'Match Rank','TypicalEducation':"Typical Education", "AnnualWages":"Annual Wages"}, axis=1)
+
+            dff = df[df['OCC_CODE'].isin(baseline_occ_codes)].reset_index(drop=True)
+            print('Recommended Jobs with matches in DE example data: ')
+            print(dff.shape)
+            print('Warning: changing Rank vs Skills Matcher Original:')
+            dff['Match Rank'] = dff.index + 1
+
+            max_jobs = values[1] 
+            if max_jobs != 'No Limit':
+                dff = dff[dff['Match Rank'] <= max_jobs
 ]
-                data_table = dash_table.DataTable(
-                                id='recommended-jobs-table',
-                                data=dff.to_dict('records'), 
-                                row_selectable='multi', 
-                                hidden_columns=['OCC_CODE'], 
-                                sort_action='native', 
-                                sort_mode='multi', 
-                                style_cell={'whiteSpace': 'normal','textOverflow': 'ellipsis', 'width':'20%'}, 
-                                css=[{"selector": ".show-hide", "rule": "display: none"}]
-                                # style_cell_conditional=[
-                                #     {'if':{'column_id':'Occupation Title'}, 
-                                #      'width':'10%'}]
-                    )
-                return data_table
-            else: 
-                return json.dumps(f"Non-200 status code: {response.status_code}")
+            data_table = dash_table.DataTable(
+                            id='recommended-jobs-table',
+                            data=dff.to_dict('records'), 
+                            row_selectable='multi', 
+                            hidden_columns=['OCC_CODE'], 
+                            sort_action='native', 
+                            sort_mode='multi', 
+                            style_cell={'whiteSpace': 'normal','textOverflow': 'ellipsis', 'width':'20%'}, 
+                            css=[{"selector": ".show-hide", "rule": "display: none"}]
+                            # style_cell_conditional=[
+                            #     {'if':{'column_id':'Occupation Title'}, 
+                            #      'width':'10%'}]
+                )
+            return data_table
         else: 
             return "Please answer all questions before hitting submit."
 
@@ -249,7 +211,7 @@ def retrieve_selected_row(rows, selected_rows):
 
         selected_careers = [rows[i]['OCC_CODE'] for i in selected_rows]
         # print(selected_careers)
-        data_selected = df[df['OCC_CODE'].isin(selected_careers)]
+        data_selected = data_index.select(OCC_CODE=selected_careers)
         # print(data_selected)
         print(data_selected.shape)
 
@@ -0,0 +1,43 @@
+## Precompute a profile's results for every county (what 'Pre-load for all counties' on the county page needs), or for
+# the profiles the pages queued. Resumable: run the same command again after an interruption. See utils/precompute.py.
+#
+#   python precompute_counties.py --profile projects/my_profile.yaml [--states DE,MD] [--workers 2] [--chunk-size 50]
+#   python precompute_counties.py --queue                  (profiles queued by the pages)
+#   python precompute_counties.py --queue --worker stub    (pure-Python stand-in calculator, for testing)
+# --worker defaults to the CALCULATOR_WORKER setting (see utils/calculator_pool.py).
+import os
+import sys
+import argparse
+from utils.BeneficiaryProfile import Beneficiary
+from utils.calculator_pool import WORKER_COMMAND, STUB_WORKER_COMMAND
+from utils.precompute import precompute_counties, precompute_queue, all_locations, WORKERS, CHUNK_SIZE, NICE, PAUSE
+
+
+parser = argparse.ArgumentParser(description='Precompute calculator results for every county in counties.json')
+source = parser.add_mutually_exclusive_group(required=True)
+source.add_argument('--profile', help='project YAML of the profile (see Beneficiary.save_project)')
+source.add_argument('--queue', action='store_true', help='precompute the profiles queued by the pages')
+parser.add_argument('--states', help='comma separated state abbreviations (default: all)')
+parser.add_argument('--workers', type=int, default=WORKERS, help='calculators running at once')
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='counties per calculator run')
+parser.add_argument('--nice', type=int, default=NICE, help='CPU niceness added to the workers')
+parser.add_argument('--pause', type=float, default=PAUSE, help='seconds each worker waits between chunks')
+parser.add_argument('--retry-failed', action='store_true', help='retry locations that failed in an earlier run')
+parser.add_argument('--worker', choices=['rscript', 'pool', 'stub'], default=os.environ.get('CALCULATOR_WORKER', 'rscript'),
+                    help='rscript: applyBenefitsCalculator.R per chunk, pool: a warm calculatorWorker.R per worker process, '
+                         'stub: pure-Python stand-in calculator worker (default: CALCULATOR_WORKER or rscript)')
+args = parser.parse_args()
+
+locations = all_locations(states=args.states.split(',')) if args.states else None
+kwargs = dict(workers=args.workers, chunk_size=args.chunk_size, nice=args.nice, pause=args.pause, retry_failed=args.retry_failed,
+              pool_command={'rscript':None, 'pool':WORKER_COMMAND, 'stub':STUB_WORKER_COMMAND}[args.worker])
+
+try:
+    if args.queue:
+        n_profiles = precompute_queue(locations=locations, **kwargs)
+        print(f'Precomputed {n_profiles} queued profiles')
+    else:
+        checkpoint = precompute_counties(Beneficiary.from_yaml(args.profile), locations=locations, **kwargs)
+        print(f"Done: {len(checkpoint['done'])}/{checkpoint['total']} locations, {len(checkpoint['failed'])} failed")
+except KeyboardInterrupt: # finished chunks are saved, the same command resumes
+    sys.exit(130)
@@ -54,8 +54,8 @@ class AzureBlobStorageManager:
 
         return os.path.basename(file_name) in self.list_blobs(name_only=True)
     
-    def get_blob_last_modified(self, blob_name:str):
-        """Get the last modified date of a blob in the storage container"""
+    def get_blob_last_modified(self, blob_name:str, date_only=True):
+        """Get the last modified date (or full timestamp if date_only is False) of a blob in the storage container"""
         # Create a blob client
         blob_client =self.container_client.get_blob_client(blob_name)
        
@@ -64,7 +64,7 @@ class AzureBlobStorageManager:
             blob_properties = blob_client.get_blob_properties()
             # Retrieve and print last modified date
             last_modified = blob_properties['last_modified']
-            return last_modified.date()
+            return last_modified.date() if date_only else last_modified
            
         except Exception as e: # Do something with this exception block (e.g. add logging)
             print(f"An error occurred: {str(e)}")
@@ -1,6 +1,8 @@
 ## Simple class for storing information related to a beneficiary profile, i.e. someone on benefits)
 # (basically sets a long JSON schema with some accessor functions and a connector to a yaml file)
 import os 
+import json
+import hashlib
 import yaml 
 import subprocess
 
@@ -94,47 +96,51 @@ class Beneficiary:
     # For identifying keys associated with the family members                
     _PERSON_TERMS = ('agePerson', 'disability', 'blind', 'ssdiPIA') # don't change the order of these from ('agePerson', 'disability', 'blind', 'ssdiPIA')
 
+    # Profiles are built in bulk (precompute, batch runs), so instances are kept small: no __dict__, only the
+    # non-default config is stored and the full Profile dict / profile_key are built on first use (see the
+    # precompiled schema tables below the class)
+    __slots__ = ('project_name', 'config', 'locations', 'married', '_profile', '_profile_key')
+
     @classmethod
     def validate_arguments(cls, **config):
 
-        ## Check key names and value types
-        for key in config.keys():
-        
-            # Check if recognized key 
-            if key not in cls.default_schema.keys():
+        ## Check key names and value types (precompiled from default_schema: type, list content type, agePerson key)
+        for key, value in config.items():
+            checks = _KEY_CHECKS.get(key)
+            if checks is None:
                 raise ValueError(f"Invalid keyword argument '{key}'")
-            
-            # Check if the value is of correct type
-            default_key_type = type(cls.default_schema[key])
-            if not isinstance(config[key], default_key_type):
-                raise TypeError(f"'{key}' must be {default_key_type}")
-            elif default_key_type is list: 
-                if not isinstance(config[key][0], type(cls.default_schema[key][0])):
-                    if 'agePerson' in key: # here the value type can also be int 
-                        if isinstance(config[key][0], int): 
-                            continue
-                        else: 
-                            raise TypeError(f"'{key}' content must be {type(cls.default_schema[key][0])}")
-                
+            key_type, content_type, is_age = checks
+
+            if not isinstance(value, key_type):
+                raise TypeError(f"'{key}' must be {key_type}")
+            elif content_type is not None:
+                if not isinstance(value[0], content_type) and is_age: # here the value type can also be int
+                    if not isinstance(value[0], int):
+                        raise TypeError(f"'{key}' content must be {content_type}")
+
         # Check family parameters: 
-        for i in range(1,13):
-            if f'agePerson{i}' not in config.keys(): 
+        for age_key, i, other_keys, adult_keys in _FAMILY_CHECKS:
+            if age_key not in config:
                 continue
 
             # If a family member at a given n doesn't exist, but one of the other parameters exists and isn't default
-            elif config[f'agePerson{i}'] == ['NA']: 
-                for term in Beneficiary._PERSON_TERMS[1:]: 
-                    if term + str(i) in config.keys(): 
-                        if config[term + str(i)] != [0]:
-                            raise Exception(f"Invalid family member configuration ('{term}{i}' without matching 'agePerson{i}')")
-            
+            elif config[age_key] == ['NA']:
+                for term, key in other_keys:
+                    if key in config and config[key] != [0]:
+                        raise Exception(f"Invalid family member configuration ('{term}{i}' without matching 'agePerson{i}')")
+
             # If a family member at a given n is less than 18, but is listed as blind or SSDI 
             # blind children are obviously possible but just not counted in the calculator
-            elif config[f'agePerson{i}'][0] < 18: 
-                for term in Beneficiary._PERSON_TERMS[2:]: # blind, ssdi
-                    if term + str(i) in config.keys():
-                        if config[term + str(i)] != [0]:
-                            raise Exception(f"Invalid family member configuration ('{term}{i}' given but 'agePerson{i}' is < 18)")
+            elif config[age_key][0] < 18:
+                for term, key in adult_keys:
+                    if key in config and config[key] != [0]:
+                        raise Exception(f"Invalid family member configuration ('{term}{i}' given but 'agePerson{i}' is < 18)")
+
+    @classmethod
+    def from_dict(cls, project_name:str, data:dict):
+        """Beneficiary from a Profile or non_default() dict (e.g. a saved project YAML).
+        Values equal to the default are dropped, so config (and what gets validated) is only what differs."""
+        return cls(project_name, **{k:v for k,v in data.items() if v != _DEFAULTS.get(k, _MISSING)})
 
     @classmethod
     def from_yaml(cls, file_path):
@@ -143,7 +149,7 @@ class Beneficiary:
         with open(file_path, 'r') as file:
             config_data = yaml.safe_load(file)
 
-        return cls(project_name, **config_data)
+        return cls.from_dict(project_name, config_data)
 
 
 
@@ -153,19 +159,13 @@ class Beneficiary:
         self.validate_arguments(**config)
         self.config = config 
 
-        # Create Profile from Default Schema (Profile is set on init and should not be modified)
-        self._Profile = {}
-        for key in Beneficiary.default_schema.keys(): 
-            if key in config.keys(): 
-                self._Profile[key] = config[key]
-            else: 
-                self._Profile[key] = Beneficiary.default_schema[key]
+        # Profile is built from the default schema on first use (and should not be modified)
+        self._profile = None
+        self._profile_key = None
 
-        self.locations = self._Profile['locations']
-        self.married = self._Profile['married']
+        self.locations = config.get('locations', _DEFAULTS['locations'])
+        self.married = config.get('married', _DEFAULTS['married'])
         self.project_name = project_name
-        
-        self.output_path = os.path.join('output', 'results_' + self.project_name + '.csv')
 
         ## Methods
         # save/update yaml file 
@@ -173,17 +173,22 @@ class Beneficiary:
         # return dict summary of beneficiary profile 
         # Print non-default params 
      
+    @property
+    def output_path(self) -> str:
+        return os.path.join('output', 'results_' + self.project_name + '.csv')
+
     def get_family(self) -> dict: 
         """List the family member information"""   
 
+        profile = self.Profile
         family_data = {}
         adult_count = 0 
         child_count = 0
-        for i in range(1, 13): 
-            if self._Profile[f"agePerson{i}"] == ['NA']:
+        for age_key, disability_key, blind_key, ssdi_key in _PERSON_KEYS: 
+            if profile[age_key] == ['NA']:
                 continue 
             # Add member age 
-            age_status = 'Adult' if int(self._Profile[f"agePerson{i}"][0]) >= 18 else 'Child'
+            age_status = 'Adult' if int(profile[age_key][0]) >= 18 else 'Child'
             if age_status == 'Adult': 
                 adult_count += 1
                 age_status += str(adult_count)
@@ -191,33 +196,74 @@ class Beneficiary:
                 child_count += 1 
                 age_status += str(child_count)
 
-            family_data[age_status] = {'Age':self._Profile[f"agePerson{i}"][0]}
+            family_data[age_status] = {'Age':profile[age_key][0]}
 
             # Add if disabled 
-            family_data[age_status]['Disability'] = bool(self._Profile[f'disability{i}'][0])
+            family_data[age_status]['Disability'] = bool(profile[disability_key][0])
 
             # Add ssdi amount / blind 
             if 'Adult' in age_status: 
-                family_data[age_status]['Blind'] = bool(self._Profile[f'blind{i}'][0])                
-                family_data[age_status]['SSDI_Monthly'] = self._Profile[f'ssdiPIA{i}'][0]
+                family_data[age_status]['Blind'] = bool(profile[blind_key][0])                
+                family_data[age_status]['SSDI_Monthly'] = profile[ssdi_key][0]
 
         return family_data
     
     def get_benefits(self) -> list: 
         """Summarize the benefits programs applied""" 
         
+        profile = self.Profile
         benefits_programs = [
-            k.lstrip('APPLY_') for k,v in self._Profile.items()
-            if 'APPLY' in k and v != False
+            name for k,name in _BENEFIT_KEYS if profile[k] != False
         ] # TO-DO: Change benefits to explanations where needed (e.g. APPLY_TAXES)
 
         return benefits_programs
     
     def non_default(self): 
         """Get non-default parameters in the Profile"""
-        non_default = {k:v for k,v in self._Profile.items() if v != Beneficiary.default_schema[k]}
+        config = self.config
+        keys = sorted(config, key=_KEY_INDEX.__getitem__) if len(config) > 1 else config # in schema order, like the Profile
+        non_default = {k:config[k] for k in keys if config[k] != _DEFAULTS[k]}
         return non_default
 
+    def canonical_profile(self, include_defaults=False) -> dict: 
+        """Non-default parameters (minus locations) in an order-independent form, for comparing households.
+        Family members become a list of (age, disability, blind, ssdiPIA) sorted oldest first, so the same
+        household gives the same result whichever person slots were used (e.g. children entered in another order).
+        include_defaults: all parameters instead, so the result changes if a default (e.g. ruleYear) does."""
+
+        config = self.config
+        family = []
+        for age_key, disability_key, blind_key, ssdi_key in _PERSON_KEYS: 
+            age = config.get(age_key, _NA)[0]
+            if age == 'NA': 
+                continue
+            person = [int(age), 
+                      int(config.get(disability_key, _ZERO)[0]), 
+                      int(config.get(blind_key, _ZERO)[0]), # blind/ssdiPIA only exist for persons 1 to 6
+                      float(config.get(ssdi_key, _ZERO)[0])]
+            family.append(person)
+        family.sort(reverse=True)
+
+        params = self.Profile if include_defaults else self.non_default()
+        other = {k:v for k,v in params.items() if k not in _OTHER_EXCLUDED}
+
+        return {'family':family, 'other':other}
+
+    @property
+    def profile_key(self) -> int: 
+        """Stable 64-bit integer key of the canonical profile (see canonical_profile()), e.g. for the ProfileKey column.
+        Equivalent households get the same key; locations aren't part of it."""
+        if self._profile_key is None:
+            profile_str = json.dumps(self.canonical_profile(), sort_keys=True)
+            digest = hashlib.blake2b(profile_str.encode(), digest_size=8).digest()
+            self._profile_key = int.from_bytes(digest, 'big', signed=True) # fits in an int64 column
+        return self._profile_key
+
+    @classmethod
+    def key_from_profile_str(cls, profile_str:str) -> int: 
+        """profile_key of a BeneficiaryProfile column value (json.dumps of non_default() without locations)"""
+        return cls('profile', **json.loads(profile_str)).profile_key
+
     def save_project(self, outdir='projects', overwrite=False):
         if not os.path.exists(outdir): 
             raise Exception(f'Check that {outdir} is in current directory.')
@@ -238,13 +284,32 @@ class Beneficiary:
 
     @property
     def Profile(self):
-        return self._Profile
-
-
+        """Full parameter dict (defaults plus config, in schema order), built on first use"""
+        if self._profile is None:
+            self._profile = dict(_DEFAULTS)
+            self._profile.update(self.config) # config keys are all in the schema, so the order stays the schema's
+        return self._profile
 
 
+### --- PRECOMPILED SCHEMA --- ###
+# Lookup tables built once from default_schema, used by validation and the accessors above
 
+_DEFAULTS = Beneficiary.default_schema
+_KEY_INDEX = {k:i for i,k in enumerate(_DEFAULTS)}
+_MISSING = object()
+_NA, _ZERO = ['NA'], [0]
 
+# key: (value type, type of the list content or None, is an agePerson key)
+_KEY_CHECKS = {k:(type(v), type(v[0]) if isinstance(v, list) else None, 'agePerson' in k) for k,v in _DEFAULTS.items()}
 
+# Person slots 1 to 12: (agePerson, disability, blind, ssdiPIA) keys
+_PERSON_KEYS = tuple(tuple(f'{term}{i}' for term in Beneficiary._PERSON_TERMS) for i in range(1, 13))
 
+# (agePerson key, slot, [(term, key)] checked without a member, [(term, key)] checked for a child)
+_FAMILY_CHECKS = tuple((f'agePerson{i}', i, 
+                        tuple((term, term + str(i)) for term in Beneficiary._PERSON_TERMS[1:]), 
+                        tuple((term, term + str(i)) for term in Beneficiary._PERSON_TERMS[2:])) # blind, ssdi
+                       for i in range(1, 13))
 
+_OTHER_EXCLUDED = frozenset(key for keys in _PERSON_KEYS for key in keys) | {'locations'}
+_BENEFIT_KEYS = tuple((k, k.lstrip('APPLY_')) for k in _DEFAULTS if 'APPLY' in k)
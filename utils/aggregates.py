@@ -0,0 +1,379 @@
+## National and state aggregates of a profile's results across counties ("national averages" on the county page):
+# mean, median and percentile bands of NetResources and each value.* benefit at every income point.
+#
+# A profile's results are held as dense float32 arrays of location x income x column per state (NaN where a location
+# has no result), so every statistic is a reduction over the location axis: of one state's array, or of all of them
+# for the nation (NATIONAL). Aggregates are kept up to date as counties land (see add()): means from running sums and
+# counts per state and for the nation, percentiles recomputed only for the states the new counties are in. National
+# percentiles need every county's values, so they're recomputed once a batch of updates is done (update_national()).
+# Reading an aggregate is then a lookup of precomputed arrays instead of a groupby over every county's rows.
+#
+# AggregateStore keeps a directory per profile: a summary file (sums, counts and stats per scope, bounded by the number
+# of states) and one values file per state, all written atomically and readable by any worker. update() adds the
+# locations the ResultsStore has and the aggregates don't yet, loading and rewriting only the states they're in, so
+# an update after each precompute chunk costs about the chunk, not everything calculated so far.
+import os
+import io
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+NATIONAL = 'US'
+PERCENTILES = (10, 25, 50, 75, 90)
+STAT_NAMES = ('mean', 'p10', 'p25', 'median', 'p75', 'p90') # mean, then the PERCENTILES
+AGGREGATES_DIR = os.path.join('output', 'aggregates')
+SUMMARY_FILE = 'summary.npz' # in a profile's directory, next to one {state}.npz of values per state
+
+
+def aggregate_columns(df) -> list:
+    """Columns aggregated: NetResources and the value.* benefits"""
+    return [col for col in df.columns if col == 'NetResources' or col.startswith('value.')]
+
+
+def location_state(location:str) -> str:
+    """'Kent County, DE' -> 'DE'"""
+    return location.rpartition(', ')[2]
+
+
+def nan_percentiles(values:np.ndarray, percentiles=PERCENTILES) -> np.ndarray:
+    """np.nanpercentile(values, percentiles, axis=0) (linear interpolation), vectorized: sorting puts NaNs last, so each
+    column's percentiles interpolate between its first count non-NaN values. np.nanpercentile loops over columns
+    when there are NaNs."""
+    ordered = np.sort(values, axis=0)
+    counts = (~np.isnan(values)).sum(axis=0)
+    result = np.full((len(percentiles),) + values.shape[1:], np.nan, dtype=np.float64)
+    if len(values) == 0:
+        return result
+    for n, q in enumerate(percentiles):
+        position = (counts - 1).clip(min=0) * (q / 100)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, (counts - 1).clip(min=0))
+        low = np.take_along_axis(ordered, lower[np.newaxis], axis=0)[0]
+        high = np.take_along_axis(ordered, upper[np.newaxis], axis=0)[0]
+        result[n] = np.where(counts > 0, low + (high - low) * (position - lower), np.nan)
+    return result
+
+
+def _regrid(array, income_axis:int, old_income, new_income, old_columns:list, new_columns:list, fill) -> np.ndarray:
+    """Move an array with an income axis and a last column axis onto a grid with more incomes/columns (fill elsewhere)"""
+    if old_columns == new_columns and np.array_equal(old_income, new_income):
+        return array
+    shape = list(array.shape)
+    shape[income_axis], shape[-1] = len(new_income), len(new_columns)
+    regridded = np.full(shape, fill, dtype=array.dtype)
+    index = [slice(None)] * array.ndim
+    index[income_axis] = np.searchsorted(new_income, old_income)[:, np.newaxis]
+    index[-1] = np.array([new_columns.index(col) for col in old_columns], dtype=np.intp)[np.newaxis, :]
+    regridded[tuple(index)] = array
+    return regridded
+
+
+def _write_npz(fp:str, **arrays) -> None:
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    tmp_fp = f'{fp}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_fp, 'wb') as file:
+        file.write(buffer.getvalue())
+    os.replace(tmp_fp, fp)
+
+
+class Aggregates:
+
+    def __init__(self, columns:list, income=None):
+        """Empty aggregates of the given columns (see add() and from_frame())"""
+        self.columns = list(columns)
+        self.income = np.asarray(income if income is not None else [], dtype=np.float64)
+        self.scopes = [NATIONAL]
+        self._scope_index = {NATIONAL:0}
+        self.scope_locations = [[]] # locations of each scope (states; none listed for NATIONAL)
+        self._location_index = {} # location: (scope, row in the scope's values)
+
+        n_incomes, n_columns = len(self.income), len(self.columns)
+        self.values = {} # scope: location x income x column, for the states loaded (see load())
+        self.sums = np.zeros((1, n_incomes, n_columns), dtype=np.float64) # scope x income x column
+        self.counts = np.zeros((1, n_incomes, n_columns), dtype=np.int32)
+        self.stats = np.full((1, len(STAT_NAMES), n_incomes, n_columns), np.nan, dtype=np.float32) # scope x stat x income x column
+        self.national_stale = False # national percentiles not updated since the last add()
+        self._dirty = set() # scopes whose values changed since the last save()
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """Aggregates of a long-format results table (one profile: state_county, income and the columns)"""
+        aggregates = cls(columns if columns is not None else aggregate_columns(df))
+        aggregates.add(df)
+        aggregates.update_national()
+        return aggregates
+
+    @property
+    def locations(self) -> list:
+        return [location for locations in self.scope_locations for location in locations]
+
+    @property
+    def all_loaded(self) -> bool:
+        """Whether the values of every state are in memory (needed for the national percentiles)"""
+        return len(self.values) == len(self.scopes) - 1
+
+    ### --- UPDATING --- ###
+
+    def _add_scope(self, scope:str) -> int:
+        self._scope_index[scope] = len(self.scopes)
+        self.scopes.append(scope)
+        self.scope_locations.append([])
+        shape = (1,) + self.sums.shape[1:]
+        self.sums = np.concatenate([self.sums, np.zeros(shape, dtype=self.sums.dtype)])
+        self.counts = np.concatenate([self.counts, np.zeros(shape, dtype=self.counts.dtype)])
+        self.stats = np.concatenate([self.stats, np.full((1,) + self.stats.shape[1:], np.nan, dtype=self.stats.dtype)])
+        self.values[self._scope_index[scope]] = np.empty((0,) + shape[1:], dtype=np.float32)
+        return self._scope_index[scope]
+
+    def _regrid(self, income:np.ndarray, columns:list) -> None:
+        """Widen every array to more income points / columns (NaN for the locations that don't have them)"""
+        old_income, old_columns = self.income, self.columns
+        for scope, values in self.values.items():
+            self.values[scope] = _regrid(values, 1, old_income, income, old_columns, columns, np.nan)
+        self.sums = _regrid(self.sums, 1, old_income, income, old_columns, columns, 0)
+        self.counts = _regrid(self.counts, 1, old_income, income, old_columns, columns, 0)
+        self.stats = _regrid(self.stats, 2, old_income, income, old_columns, columns, np.nan)
+        self.income, self.columns = income, columns
+
+    def add(self, df) -> list:
+        """Add (or replace) the results of some locations and update the aggregates of their states, and the national
+        means. National percentiles are left to update_national() (they need every state's values).
+
+        Args:
+
+        df (DataFrame): long-format results of one profile with state_county, income and the columns. Missing columns
+        count as no result (e.g. a benefit that's NaN everywhere in a ResultsStore query), aggregate_columns() not in
+        self.columns yet are added.
+
+        Returns:
+
+        scopes (list): scopes whose aggregates changed
+
+        """
+        if len(df) == 0:
+            return []
+        income = df['income'].to_numpy(dtype=np.float64)
+        self._regrid(np.union1d(self.income, income), self.columns + [col for col in aggregate_columns(df) if col not in self.columns])
+
+        # Dense block of the new rows: location x income x column
+        location_codes, new_locations = pd.factorize(df['state_county'], sort=False)
+        new_locations = [str(location) for location in new_locations]
+        block = np.full((len(new_locations), len(self.income), len(self.columns)), np.nan, dtype=np.float32)
+        block[location_codes, np.searchsorted(self.income, income)] = df.reindex(columns=self.columns).to_numpy(dtype=np.float32)
+
+        # Rows of the block's locations in their state's values (replaced results are taken out of the sums first)
+        block_rows = {} # scope: ([rows in block], [rows in values])
+        for n, location in enumerate(new_locations):
+            state = location_state(location)
+            scope = self._scope_index.get(state)
+            if scope is None:
+                scope = self._add_scope(state)
+            elif scope not in self.values:
+                raise ValueError(f"Values of {state} aren't loaded (see Aggregates.load_values)")
+            known = self._location_index.get(location)
+            if known is not None:
+                row = known[1]
+                old = self.values[scope][row]
+                for s in (0, scope):
+                    self.sums[s] -= np.nan_to_num(old)
+                    self.counts[s] -= ~np.isnan(old)
+            else:
+                row = len(self.scope_locations[scope])
+                self._location_index[location] = (scope, row)
+                self.scope_locations[scope].append(location)
+            block_rows.setdefault(scope, ([], []))
+            block_rows[scope][0].append(n)
+            block_rows[scope][1].append(row)
+
+        for scope, (rows, value_rows) in block_rows.items():
+            values = self.values[scope]
+            n_new = len(self.scope_locations[scope]) - len(values)
+            if n_new:
+                values = np.concatenate([values, np.full((n_new,) + values.shape[1:], np.nan, dtype=np.float32)])
+            scope_block = block[rows]
+            values[value_rows] = scope_block
+            self.values[scope] = values
+            self.sums[scope] += np.nan_to_num(scope_block).sum(axis=0)
+            self.counts[scope] += (~np.isnan(scope_block)).sum(axis=0, dtype=np.int32)
+            self._update_stats(scope)
+            self._dirty.add(scope)
+
+        self.sums[0] += np.nan_to_num(block).sum(axis=0)
+        self.counts[0] += (~np.isnan(block)).sum(axis=0, dtype=np.int32)
+        self._update_mean(0)
+        self.national_stale = True
+        return [NATIONAL] + [self.scopes[scope] for scope in sorted(block_rows)]
+
+    def _update_mean(self, scope:int) -> None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.stats[scope, 0] = np.where(self.counts[scope] > 0, self.sums[scope] / self.counts[scope], np.nan)
+
+    def _update_stats(self, scope:int) -> None:
+        self._update_mean(scope)
+        self.stats[scope, 1:] = nan_percentiles(self.values[scope])
+
+    def update_national(self) -> None:
+        """Recompute the national percentiles from every state's values (all loaded, see load_values())"""
+        if not self.all_loaded:
+            raise ValueError('National percentiles need the values of every state loaded')
+        self._update_mean(0)
+        values = [self.values[scope] for scope in range(1, len(self.scopes))]
+        self.stats[0, 1:] = nan_percentiles(np.concatenate(values) if values else np.empty((0,) + self.sums.shape[1:], dtype=np.float32))
+        self.national_stale = False
+
+    ### --- READING --- ###
+
+    def get(self, scope=NATIONAL, column='NetResources') -> pd.DataFrame:
+        """Aggregates of one column in one scope: income, n_locations and one column per STAT_NAMES"""
+        if scope == NATIONAL and self.national_stale and self.all_loaded:
+            self.update_national()
+        return _stats_frame(self.stats, self.counts, self.income, self.scopes, self.columns, scope, column)
+
+    ### --- FILES --- ###
+
+    def save(self, directory:str) -> None:
+        """Write the values of the states changed since the last save, then the summary (each file atomically)"""
+        os.makedirs(directory, exist_ok=True)
+        for scope in sorted(self._dirty):
+            _write_npz(os.path.join(directory, f'{self.scopes[scope]}.npz'), values=self.values[scope], income=self.income,
+                       axes=np.array(json.dumps({'columns':self.columns, 'locations':self.scope_locations[scope]})))
+        _write_npz(os.path.join(directory, SUMMARY_FILE), sums=self.sums, counts=self.counts, stats=self.stats, income=self.income,
+                   axes=np.array(json.dumps({'columns':self.columns, 'scopes':self.scopes, 'scope_locations':self.scope_locations,
+                                             'national_stale':self.national_stale})))
+        self._dirty.clear()
+
+    @classmethod
+    def load(cls, directory:str, scopes=None):
+        """Aggregates saved in directory, with the values of the given states (None for all) to add() to
+
+        Args:
+
+        directory (str): see save()
+
+        scopes (list): state abbreviations whose values to load (add() needs those of the states it adds locations to)
+
+        """
+        with np.load(os.path.join(directory, SUMMARY_FILE)) as data:
+            axes = json.loads(str(data['axes']))
+            aggregates = cls(axes['columns'], income=data['income'])
+            aggregates.scopes = axes['scopes']
+            aggregates._scope_index = {scope:n for n, scope in enumerate(aggregates.scopes)}
+            aggregates.scope_locations = axes['scope_locations']
+            aggregates._location_index = {location:(scope, row) for scope, locations in enumerate(aggregates.scope_locations)
+                                          for row, location in enumerate(locations)}
+            for name in ('sums', 'counts', 'stats'):
+                setattr(aggregates, name, data[name])
+            aggregates.national_stale = axes['national_stale']
+        aggregates.load_values(directory, scopes)
+        return aggregates
+
+    def load_values(self, directory:str, scopes=None) -> None:
+        """Load the values of some states (None for all) not loaded yet"""
+        for state in (self.scopes[1:] if scopes is None else scopes):
+            scope = self._scope_index.get(state)
+            if scope is None or scope == 0 or scope in self.values:
+                continue
+            with np.load(os.path.join(directory, f'{state}.npz')) as data:
+                axes = json.loads(str(data['axes']))
+                values = _regrid(data['values'], 1, data['income'], self.income, axes['columns'], self.columns, np.nan)
+            if axes['locations'] != self.scope_locations[scope]: # written by an update whose summary never was
+                file_rows = {location:row for row, location in enumerate(axes['locations'])}
+                values = values[[file_rows[location] for location in self.scope_locations[scope]]]
+            self.values[scope] = values
+
+
+def _stats_frame(stats, counts, income, scopes, columns, scope, column) -> pd.DataFrame:
+    if scope not in scopes:
+        raise KeyError(f'No aggregates for {scope}')
+    s, c = scopes.index(scope), columns.index(column)
+    df = pd.DataFrame(stats[s, :, :, c].T, columns=STAT_NAMES)
+    df.insert(0, 'n_locations', counts[s, :, c])
+    df.insert(0, 'income', income)
+    return df
+
+
+class AggregateStore:
+
+    def __init__(self, aggregates_dir=AGGREGATES_DIR):
+        """One aggregates directory per profile key in aggregates_dir"""
+        self.aggregates_dir = aggregates_dir
+        if not os.path.exists(aggregates_dir):
+            os.makedirs(aggregates_dir, exist_ok=True)
+        self._read_cache = {} # profile_key: (mtime, stats arrays), for read()
+        self._lock = threading.Lock()
+
+    def path(self, profile_key:int) -> str:
+        return os.path.join(self.aggregates_dir, str(profile_key))
+
+    def load(self, profile_key:int, scopes=None) -> Aggregates:
+        """Aggregates of a profile with the values of the given states (None for all, see Aggregates.load), or None"""
+        directory = self.path(profile_key)
+        return Aggregates.load(directory, scopes) if os.path.isfile(os.path.join(directory, SUMMARY_FILE)) else None
+
+    def update(self, profile_key:int, results_store, rebuild=False, national=True) -> int:
+        """Add the profile's locations that the ResultsStore has and the aggregates don't yet. Only the states they're in
+        are loaded and rewritten. Call from one process at a time per profile (e.g. the precompute driver).
+
+        Args:
+
+        profile_key (int): Beneficiary.profile_key
+
+        results_store (ResultsStore): where the results are read from
+
+        rebuild (bool): start over from everything in the results store
+
+        national (bool): also bring the national percentiles up to date, which reads every state's values (pass False
+        for the updates in between, e.g. after each chunk of a precompute, and True for the last one)
+
+        Returns:
+
+        n_locations (int): number of locations added
+
+        """
+        directory = self.path(profile_key)
+        aggregates = None if rebuild else self.load(profile_key, scopes=[])
+        known = set(aggregates.locations) if aggregates is not None else set()
+        new_locations = [location for location in results_store.locations(profile_key) if location not in known]
+
+        if new_locations:
+            df = results_store.query(profile_keys=[profile_key], locations=new_locations)
+            if aggregates is None:
+                aggregates = Aggregates(aggregate_columns(df))
+            aggregates.load_values(directory, {location_state(location) for location in new_locations})
+            aggregates.add(df)
+        elif aggregates is None or not (national and aggregates.national_stale):
+            return 0
+
+        if national and aggregates.national_stale:
+            aggregates.load_values(directory)
+            aggregates.update_national()
+        aggregates.save(directory)
+        return len(new_locations)
+
+    def read(self, profile_key:int, scope=NATIONAL, column='NetResources') -> pd.DataFrame:
+        """Aggregates of a profile (see Aggregates.get), or None if there are none. Only the summary (precomputed stats)
+        is read, once per version of it."""
+        fp = os.path.join(self.path(profile_key), SUMMARY_FILE)
+        try:
+            mtime = os.stat(fp).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._read_cache.get(profile_key)
+        if cached is None or cached[0] != mtime:
+            with np.load(fp) as data:
+                axes = json.loads(str(data['axes']))
+                cached = (mtime, data['stats'], data['counts'], data['income'], axes['scopes'], axes['columns'])
+            with self._lock:
+                self._read_cache[profile_key] = cached
+        return _stats_frame(*cached[1:], scope, column)
+
+    def scopes(self, profile_key:int) -> list:
+        """Scopes (NATIONAL and state abbreviations) with aggregates for a profile"""
+        fp = os.path.join(self.path(profile_key), SUMMARY_FILE)
+        if not os.path.isfile(fp):
+            return []
+        with np.load(fp) as data:
+            return json.loads(str(data['axes']))['scopes']
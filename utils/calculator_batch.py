@@ -0,0 +1,98 @@
+## Batched calculator runs: many (profile, locations) requests -> as few calculator runs as possible.
+# Requests for the same household (same Beneficiary.profile_key, e.g. the same profile on two pages, or the same
+# family entered in another person order) are merged into one run over the union of their locations, and
+# profile/location pairs already in the ResultsStore aren't calculated again. The calculator is run once per
+# distinct household (applyBenefitsCalculator.R and the pool workers take one profile with any number of locations),
+# through CalculatorJobs, so runs share its slots and job tracking. The results are then read back from the store
+# with one query and split per request.
+import pandas as pd
+from utils.BeneficiaryProfile import Beneficiary
+from utils.calculator_jobs import get_calculator_jobs
+from utils.calculator_pool import CalculatorError
+
+
+def plan_batch(requests:list, stored_locations=None) -> dict:
+    """Merge requests by household.
+
+    Args:
+
+    requests (list): (Beneficiary, locations) pairs, locations None for the beneficiary's own locations
+
+    stored_locations: called with a profile_key, returns the locations already calculated for it (None to calculate all)
+
+    Returns:
+
+    plan (dict): {profile_key: {'beneficiary': first Beneficiary of the household, 'locations': union of the requested
+    locations (in request order), 'missing': the ones to calculate, 'requests': indices of the requests}}
+
+    """
+    plan = {}
+    for n, (beneficiary, locations) in enumerate(requests):
+        key = beneficiary.profile_key
+        entry = plan.setdefault(key, {'beneficiary':beneficiary, 'locations':{}, 'requests':[]})
+        entry['locations'].update(dict.fromkeys(locations if locations is not None else beneficiary.locations)) # ordered set
+        entry['requests'].append(n)
+
+    for key, entry in plan.items():
+        entry['locations'] = list(entry['locations'])
+        stored = set(stored_locations(key)) if stored_locations is not None else set()
+        entry['missing'] = [location for location in entry['locations'] if location not in stored]
+    return plan
+
+
+def run_batch(requests:list, jobs=None, progress=None) -> list:
+    """Calculate results for many (profile, locations) requests, running the calculator once per household that has
+    uncalculated locations, and return each request's results.
+
+    Args:
+
+    requests (list): (Beneficiary, locations) pairs, locations None for the beneficiary's own locations
+
+    jobs (CalculatorJobs): runs the calculator and inserts into its results_store (default: get_calculator_jobs())
+
+    progress: passed on to CalculatorJobs.run, called with each job's status
+
+    Returns:
+
+    results (list): one DataFrame per request (results store columns, only that request's locations), in request order
+
+    """
+    jobs = jobs if jobs is not None else get_calculator_jobs()
+    store = jobs.results_store
+    if store is None:
+        raise ValueError('run_batch needs CalculatorJobs with a results_store to read the results from')
+
+    plan = plan_batch(requests, stored_locations=store.locations)
+    runs = []
+    for key, entry in plan.items():
+        if entry['missing']:
+            beneficiary = entry['beneficiary']
+            batch_profile = Beneficiary(beneficiary.project_name, **dict(beneficiary.config, locations=entry['missing']))
+            runs.append(jobs.submit(batch_profile, progress=progress))
+    n_pairs = sum(len(locations if locations is not None else beneficiary.locations) for beneficiary, locations in requests)
+    print(f"Calculator batch: {len(requests)} requests ({n_pairs} profile/location pairs) -> {len(plan)} households, "
+          f"{len(runs)} calculator runs for {sum(len(entry['missing']) for entry in plan.values())} locations")
+
+    failed = []
+    for job_id, future in runs: # wait for all of them, then report every failure
+        try:
+            status = future.result()
+        except Exception as e:
+            failed.append(f'{job_id} failed: {type(e).__name__}: {e}')
+            continue
+        if status['state'] != 'done':
+            failed.append(f"{job_id} {status['state']}: {status.get('message') or ''}")
+    if failed:
+        raise CalculatorError(f'{len(failed)} of {len(runs)} calculator runs failed: ' + '; '.join(failed))
+
+    all_locations = list(dict.fromkeys(location for entry in plan.values() for location in entry['locations']))
+    df = store.query(profile_keys=list(plan.keys()), locations=all_locations)
+
+    results = [None] * len(requests)
+    for key, entry in plan.items():
+        profile_df = df[df['ProfileKey'] == key]
+        for n in entry['requests']:
+            beneficiary, locations = requests[n]
+            locations = locations if locations is not None else beneficiary.locations
+            results[n] = profile_df[profile_df['state_county'].isin(locations)].reset_index(drop=True)
+    return results
@@ -0,0 +1,312 @@
+## Calculator runs (applyBenefitsCalculator.R) as tracked jobs, so a run doesn't hold an HTTP worker for tens of seconds.
+# A job saves the profile's project YAML (Beneficiary.save_project), runs the R script with Popen, streams its output
+# into the job's state (progress and last message), inserts the output CSV into the ResultsStore and notifies listeners.
+#
+# The pages run jobs from background callbacks (see app.py), i.e. in a separate process per run: job state is kept in
+# one small JSON file per job (JOBS_DIR) so any process can read it, and at most MAX_RUNNING calculators run at once
+# across processes (slot lock files, see utils/slot_semaphore.py). Resubmitting terminates the previous background
+# callback process and the calculator with it (the job then reads as 'cancelled'); cancel() does the same by job id.
+# Scripts can use submit() instead, which runs jobs on a thread pool of this process.
+#
+# With a CalculatorPool (utils/calculator_pool.py), jobs go to its long-lived workers instead of starting Rscript
+# (and loading the rules database) per run; the results table comes back over the worker's pipe, no project files.
+# With a ResultsCache (utils/results_cache.py), locations already calculated for the same profile by any process are
+# read from it instead of being calculated again.
+import os
+import re
+import json
+import time
+import uuid
+import signal
+import threading
+import subprocess
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from utils.BeneficiaryProfile import Beneficiary
+from utils.ingest import ingest_csv
+from utils.slot_semaphore import shared_semaphore
+from utils.calculator_pool import get_calculator_pool, configured_worker_command
+from utils.data_registry import get_results_store, get_results_cache
+
+JOBS_DIR = os.path.join('output', 'calculator_jobs')
+PROJECTS_DIR = 'projects' # project YAMLs read by applyBenefitsCalculator.R
+MAX_RUNNING = 2 # calculator processes at once (each is CPU and memory heavy)
+CALCULATOR_COMMAND = ['Rscript', 'applyBenefitsCalculator.R'] # + project name
+PROGRESS_WRITE_INTERVAL = 0.5 # seconds between state file updates while the calculator prints output
+
+ACTIVE_STATES = ('queued', 'running', 'inserting')
+PROGRESS_PATTERN = re.compile(r'(\d+)\s*(?:/|of)\s*(\d+)') # e.g. "3/10 locations" or "3 of 10" in the calculator output
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def _pid_alive(pid) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # exists, owned by someone else
+        return True
+    return True
+
+
+def format_status(status:dict) -> str:
+    """One line for the page, e.g. 'Running calculator (40%): Processing 4/10 ...'"""
+    if status is None:
+        return ''
+    state = status['state']
+    if state == 'queued':
+        return 'Waiting for a free calculator...'
+    if state == 'running':
+        progress = f" ({status['progress']:.0%})" if status.get('progress') is not None else ''
+        return f"Running calculator{progress}: {status.get('message') or ''}"
+    if state == 'inserting':
+        return 'Saving results...'
+    if state == 'done':
+        return f"Done in {status['finished'] - status['started']:.0f}s" if status.get('started') else 'Done'
+    return f"Calculator {state}: {status.get('message') or ''}"
+
+
+class CalculatorJobs:
+
+    def __init__(self, jobs_dir=JOBS_DIR, projects_dir=PROJECTS_DIR, max_running=MAX_RUNNING, command=CALCULATOR_COMMAND,
+                 results_store=None, timeout=None, max_workers=None, pool=None, results_cache=None):
+        """
+        Args:
+
+        jobs_dir (str): directory of the job state files (and the slot locks), shared by the processes running jobs
+
+        projects_dir (str): where the project YAMLs are saved for the calculator
+
+        max_running (int): calculators running at once, across processes
+
+        command (list): calculator command, the project name is appended
+
+        results_store (ResultsStore): where the output CSVs are inserted (None to leave them in output/)
+
+        timeout (float): seconds before a calculator run is killed (None for no limit)
+
+        max_workers (int): threads of submit()'s pool (default: max_running)
+
+        pool (CalculatorPool): run profiles on its workers instead of one calculator process per run. Or a function 
+        returning one (e.g. get_calculator_pool), called at the first run, so the workers start in the process running jobs.
+
+        results_cache (ResultsCache): results by profile + location, read before and written after each calculator run
+
+        """
+        self.jobs_dir = jobs_dir
+        self.projects_dir = projects_dir
+        self.command = list(command)
+        self.results_store = results_store
+        self.timeout = timeout
+        self.pool = pool
+        self.results_cache = results_cache
+        for directory in (jobs_dir, projects_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+
+        self.slots = shared_semaphore(os.path.join(jobs_dir, 'slots'), max_running)
+        self.max_workers = max_workers or max_running
+        self._executor = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    ### --- STATE --- ###
+
+    def _path(self, job_id:str) -> str:
+        return os.path.join(self.jobs_dir, job_id + '.json')
+
+    def _write(self, status:dict) -> None:
+        fp = self._path(status['job_id'])
+        tmp_fp = fp + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_fp, 'w') as file:
+            json.dump(status, file)
+        os.replace(tmp_fp, fp)
+
+    def _update(self, status:dict, **changes) -> dict:
+        status.update(changes, updated=time.time())
+        self._write(status)
+        return status
+
+    def status(self, job_id:str) -> dict:
+        """State of a job: {'job_id', 'profile_key', 'state', 'progress', 'message', 'started', 'finished', 'n_rows', ...}, or None.
+        A job whose process is gone before it finished reads as 'cancelled'."""
+        try:
+            with open(self._path(job_id), 'r') as file:
+                status = json.load(file)
+        except FileNotFoundError:
+            return None
+        if status['state'] in ACTIVE_STATES and not _pid_alive(status.get('pid')):
+            status['state'] = 'cancelled'
+        return status
+
+    def new_job(self, beneficiary:Beneficiary) -> str:
+        """Register a queued job for a profile, returns its job_id"""
+        job_id = f'{beneficiary.profile_key & 0xFFFFFFFFFFFFFFFF:016x}-{uuid.uuid4().hex[:8]}'
+        self._write({'job_id':job_id, 'profile_key':beneficiary.profile_key, 'locations':beneficiary.locations, 'state':'queued',
+                     'progress':None, 'message':None, 'pid':os.getpid(), 'calculator_pid':None, 'created':time.time(),
+                     'started':None, 'finished':None, 'updated':time.time(), 'returncode':None, 'n_rows':None})
+        return job_id
+
+    def on_complete(self, listener) -> None:
+        """Call listener(status) when a job of this process finishes (done, failed or cancelled)"""
+        self._listeners.append(listener)
+
+    def _notify(self, status:dict) -> None:
+        print(f"Calculator job {status['job_id']} {status['state']}: {format_status(status)}")
+        for listener in self._listeners:
+            try:
+                listener(status)
+            except Exception as e: # a listener shouldn't fail the job
+                print(f"Calculator job listener failed: {e}")
+
+    ### --- RUNNING --- ###
+
+    def run(self, beneficiary:Beneficiary, job_id=None, progress=None) -> dict:
+        """Run the calculator for a profile in this thread (e.g. inside a background callback) and return the final status.
+        Locations in the results cache aren't calculated again; if all of them are, no calculator is run.
+        Errors don't propagate: the job is 'failed' with the error as its message.
+
+        Args:
+
+        beneficiary (Beneficiary): profile to calculate, for its locations
+
+        job_id (str): job from new_job() (a new one if None)
+
+        progress: called with the status dict whenever it changes (e.g. to set_progress of a background callback)
+
+        """
+        job_id = job_id or self.new_job(beneficiary)
+        status = self.status(job_id)
+        report = progress if progress is not None else (lambda status: None)
+        report(self._update(status, state='queued', pid=os.getpid()))
+
+        holds_slot = False
+        try:
+            cached, missing = None, list(beneficiary.locations)
+            if self.results_cache is not None:
+                cached, missing = self.results_cache.get_many(beneficiary)
+
+            df = None
+            if missing:
+                self.slots.acquire()
+                holds_slot = True
+                if self.status(job_id)['state'] == 'cancelled': # cancel() while queued
+                    status = self.status(job_id)
+                    return status
+
+                # Project named after the job, so concurrent runs of the same profile don't overwrite each other's files
+                project = Beneficiary(job_id, **dict(beneficiary.config, locations=missing))
+                if callable(self.pool): # started on first use
+                    self.pool = self.pool()
+                df = self._run_on_pool(project, status, report) if self.pool is not None else self._run_process(project, status, report)
+                if df is None: # failed, cancelled or timed out (see status)
+                    return status
+                if self.results_cache is not None:
+                    self.results_cache.set_frame(beneficiary, df)
+            else:
+                status['started'] = time.time()
+
+            if cached is not None:
+                df = cached if df is None else pd.concat([cached, df], ignore_index=True)
+            n_rows = len(df)
+            if self.results_store is not None:
+                report(self._update(status, state='inserting', progress=1.0))
+                n_rows = self.results_store.insert_frame(df, beneficiary=beneficiary)
+            message = f'{len(beneficiary.locations) - len(missing)} of {len(beneficiary.locations)} locations from the results cache' if cached is not None else status['message']
+            self._update(status, state='done', progress=1.0, returncode=0, n_rows=n_rows, finished=time.time(), message=message)
+
+        except Exception as e: # e.g. no Rscript, unreadable output, CalculatorError from the pool: a failed job, not an error
+            self._update(status, state='failed', message=f'{type(e).__name__}: {e}'[:200], finished=time.time())
+        finally:
+            if holds_slot:
+                self.slots.release()
+            report(status)
+            self._notify(status)
+
+        return status
+
+    def _run_process(self, project:Beneficiary, status:dict, report) -> pd.DataFrame:
+        """Calculator process for a saved project (called holding a slot). Returns its output, or None if it didn't succeed."""
+        project.save_project(outdir=self.projects_dir, overwrite=True)
+
+        process = subprocess.Popen(self.command + [project.project_name], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True, bufsize=1, start_new_session=True) # own process group, see cancel()
+        report(self._update(status, state='running', started=time.time(), calculator_pid=process.pid, progress=0.0))
+
+        timed_out = threading.Event()
+        def kill_on_timeout():
+            timed_out.set()
+            os.killpg(process.pid, signal.SIGKILL)
+        watchdog = threading.Timer(self.timeout, kill_on_timeout) if self.timeout is not None else None
+        if watchdog is not None:
+            watchdog.daemon = True
+            watchdog.start()
+
+        last_write = 0
+        for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            match = PROGRESS_PATTERN.search(line)
+            if match and int(match.group(2)) > 0:
+                status['progress'] = min(int(match.group(1)) / int(match.group(2)), 1.0)
+            status['message'] = line[:200]
+            if time.monotonic() - last_write > PROGRESS_WRITE_INTERVAL:
+                report(self._update(status))
+                last_write = time.monotonic()
+        returncode = process.wait()
+        if watchdog is not None:
+            watchdog.cancel()
+
+        if timed_out.is_set():
+            self._update(status, state='failed', returncode=returncode, finished=time.time(), message=f'Timed out after {self.timeout}s')
+            return None
+        elif returncode != 0:
+            self._update(status, state='failed' if returncode > 0 else 'cancelled', returncode=returncode, finished=time.time())
+            return None
+        return ingest_csv(project.output_path)
+
+    def _run_on_pool(self, project:Beneficiary, status:dict, report) -> pd.DataFrame:
+        """Run a profile on a worker of self.pool (called holding a slot). Progress is per profile, the workers don't stream any."""
+        report(self._update(status, state='running', started=time.time(), progress=0.0, message='Running on a calculator worker'))
+        return self.pool.run(project) # CalculatorError (failed, timed out or crashed worker) fails the job
+
+    def submit(self, beneficiary:Beneficiary, progress=None):
+        """Queue a calculator run on this process's thread pool. Returns (job_id, Future of the final status)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='calculator')
+        job_id = self.new_job(beneficiary)
+        return job_id, self._executor.submit(self.run, beneficiary, job_id, progress)
+
+    def cancel(self, job_id:str) -> bool:
+        """Kill a job's calculator (if it's running) and mark the job cancelled. Returns whether it was still active."""
+        status = self.status(job_id)
+        if status is None or status['state'] not in ACTIVE_STATES:
+            return False
+        if status.get('calculator_pid') is not None:
+            try:
+                os.killpg(status['calculator_pid'], signal.SIGKILL) # calculator and anything it started
+            except (ProcessLookupError, PermissionError):
+                pass
+        self._update(status, state='cancelled', finished=time.time())
+        return True
+
+    def shutdown(self, wait=True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+def get_calculator_jobs() -> CalculatorJobs:
+    """Process-wide CalculatorJobs, inserting results into the registry's ResultsStore (and its ResultsCache). Runs go to
+    the warm workers of get_calculator_pool() if the CALCULATOR_WORKER setting is 'pool' or 'stub'."""
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            pool = get_calculator_pool if configured_worker_command() is not None else None
+            _jobs = CalculatorJobs(results_store=get_results_store(), results_cache=get_results_cache(), pool=pool)
+        return _jobs
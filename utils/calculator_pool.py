@@ -0,0 +1,314 @@
+## Pool of long-lived calculator worker processes, so the Policy Rules Database is loaded once per worker instead of
+# once per profile (as with one `Rscript applyBenefitsCalculator.R <project>` per run, see utils/calculator_jobs.py).
+#
+# Protocol: one JSON object per line over the worker's stdin/stdout.
+#   worker -> pool, once loaded:   {"type": "ready"}
+#   pool -> worker:                {"id": 1, "type": "run", "profile": <Beneficiary.Profile>, "locations": ["Kent County, DE", ...]}
+#   worker -> pool:                {"id": 1, "ok": true, "columns": {"income": [...], "NetResources": [...], ...}}
+#                                  {"id": 1, "ok": false, "error": "..."}
+#   health check:                  {"id": 2, "type": "ping"}  ->  {"id": 2, "ok": true, "type": "pong"}
+#   stop:                          {"type": "shutdown"}
+# Anything else a worker prints to stdout (e.g. R messages) is ignored; stderr goes to the server log.
+#
+# Workers are recycled after max_jobs_per_worker runs (bounds memory growth), and replaced if they die, time out or
+# fail a health check. utils/calculator_worker_stub.py is a pure-Python worker speaking the same protocol.
+#
+# The CALCULATOR_WORKER setting (environment variable) picks how the app and precompute_counties.py run the calculator:
+# 'rscript' (default) one applyBenefitsCalculator.R process per run, 'pool' calculatorWorker.R workers, 'stub' the stand-in.
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import threading
+import subprocess
+import pandas as pd
+from utils.BeneficiaryProfile import Beneficiary
+from utils.ingest import compact_dtypes
+
+WORKER_COMMAND = ['Rscript', 'calculatorWorker.R'] # R side of the protocol, next to applyBenefitsCalculator.R
+STUB_WORKER_COMMAND = [sys.executable, '-m', 'utils.calculator_worker_stub']
+POOL_SIZE = 2
+MAX_JOBS_PER_WORKER = 100
+STARTUP_TIMEOUT = 120 # seconds for a worker to load (the rules database) and say it's ready
+RUN_TIMEOUT = 300 # seconds for one profile
+PING_TIMEOUT = 5
+ACQUIRE_TIMEOUT = RUN_TIMEOUT # seconds to wait for a free worker
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+class CalculatorError(Exception):
+    """A calculator worker failed a run (error response, timeout or crash)"""
+
+
+class CalculatorWorker:
+    """One worker process. Not thread-safe: the pool hands each worker to one thread at a time."""
+
+    def __init__(self, command:list, startup_timeout=STARTUP_TIMEOUT):
+        self.command = list(command)
+        self.jobs_done = 0
+        self._next_id = 0
+        self._lines = queue.Queue() # stdout lines, read by a thread so reads can time out
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+                                        start_new_session=True)
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        try:
+            self._receive(lambda message: message.get('type') == 'ready', startup_timeout)
+        except BaseException: # not ready: don't leave it (or anything it started) running
+            self.kill()
+            raise
+
+    def _read_stdout(self) -> None:
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None) # EOF: the worker exited
+
+    def _send(self, message:dict) -> None:
+        try:
+            self.process.stdin.write(json.dumps(message) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise CalculatorError(f'calculator worker {self.process.pid} is gone: {e}') from e
+
+    def _receive(self, is_reply, timeout:float) -> dict:
+        """Next message for which is_reply(message) is true, skipping other output"""
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                raise CalculatorError(f'calculator worker {self.process.pid} timed out after {timeout}s')
+            if line is None:
+                try:
+                    returncode = self.process.wait(1) # stdout closes just before the process ends
+                except subprocess.TimeoutExpired:
+                    returncode = None
+                raise CalculatorError(f'calculator worker {self.process.pid} exited (code {returncode})')
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError: # other output of the calculator
+                continue
+            if isinstance(message, dict) and is_reply(message):
+                return message
+
+    def request(self, message:dict, timeout:float) -> dict:
+        self._next_id += 1
+        request_id = self._next_id
+        self._send(dict(message, id=request_id))
+        return self._receive(lambda reply: reply.get('id') == request_id, timeout)
+
+    def run(self, profile:dict, locations:list, timeout=RUN_TIMEOUT) -> pd.DataFrame:
+        reply = self.request({'type':'run', 'profile':profile, 'locations':locations}, timeout)
+        if not reply.get('ok'):
+            raise CalculatorError(reply.get('error', 'calculator error'))
+        self.jobs_done += 1
+        return pd.DataFrame(reply['columns'])
+
+    def ping(self, timeout=PING_TIMEOUT) -> bool:
+        try:
+            return self.alive() and bool(self.request({'type':'ping'}, timeout).get('ok'))
+        except CalculatorError:
+            return False
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self, timeout=5) -> None:
+        if self.alive():
+            try:
+                self._send({'type':'shutdown'})
+                self.process.wait(timeout)
+            except (CalculatorError, subprocess.TimeoutExpired):
+                self.kill()
+
+    def kill(self) -> None:
+        """Kill the worker's process group (its own session, so R and anything it started)"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+
+
+class CalculatorPool:
+
+    def __init__(self, size=POOL_SIZE, command=WORKER_COMMAND, max_jobs_per_worker=MAX_JOBS_PER_WORKER,
+                 startup_timeout=STARTUP_TIMEOUT, run_timeout=RUN_TIMEOUT, acquire_timeout=ACQUIRE_TIMEOUT):
+        """Start `size` workers (each loads the calculator once).
+
+        Args:
+
+        size (int): worker processes
+
+        command (list): worker command (STUB_WORKER_COMMAND for the pure-Python stand-in)
+
+        max_jobs_per_worker (int): runs after which a worker is replaced by a fresh one
+
+        startup_timeout, run_timeout (float): seconds to wait for a worker to be ready / to return one profile
+
+        acquire_timeout (float): seconds run() waits for a free worker before raising CalculatorError
+
+        """
+        self.size = size
+        self.command = list(command)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.startup_timeout = startup_timeout
+        self.run_timeout = run_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.runs = 0
+        self.failures = 0
+        self.recycled = 0
+        self.replaced = 0
+
+        try:
+            for _ in range(size):
+                self._add_worker()
+        except BaseException: # stop the ones already started
+            self.close()
+            raise
+
+    def _add_worker(self) -> None:
+        worker = CalculatorWorker(self.command, startup_timeout=self.startup_timeout)
+        with self._lock:
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker:CalculatorWorker, replace=True) -> bool:
+        """Stop a worker and start a new one in its place. Returns False if the new one didn't start (the pool is one
+        worker short until health_check() tops it up)."""
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop()
+        if replace and not self._closed:
+            try:
+                self._add_worker()
+            except (CalculatorError, OSError) as e:
+                print(f'Calculator worker failed to start: {e}')
+                with self._lock:
+                    self.failures += 1
+                return False
+        return True
+
+    def _acquire(self) -> CalculatorWorker:
+        """Next idle worker, waiting up to acquire_timeout"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._lock:
+                n_workers = len(self._workers)
+            if n_workers == 0:
+                raise CalculatorError('calculator pool has no workers (replacements failed to start)')
+            try:
+                return self._idle.get(timeout=min(1.0, max(deadline - time.monotonic(), 0))) # checks for workers every second
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    raise CalculatorError(f'no free calculator worker after {self.acquire_timeout}s')
+
+    def run(self, beneficiary:Beneficiary, locations=None) -> pd.DataFrame:
+        """Results table of a profile (calculator output columns, ingested dtypes), from the next free worker.
+
+        Args:
+
+        beneficiary (Beneficiary): profile to calculate
+
+        locations (list): 'County, ST' locations (default: beneficiary.locations)
+
+        """
+        if self._closed:
+            raise CalculatorError('calculator pool is closed')
+        worker = self._acquire()
+        try:
+            df = worker.run(beneficiary.Profile, list(locations or beneficiary.locations), timeout=self.run_timeout)
+        except CalculatorError:
+            with self._lock:
+                self.failures += 1
+            replaced = self._retire(worker) # may be stuck mid-run or dead; a failed replacement doesn't hide this error
+            with self._lock:
+                self.replaced += replaced
+            raise
+        except BaseException:
+            self._idle.put(worker)
+            raise
+
+        with self._lock:
+            self.runs += 1
+        if worker.jobs_done >= self.max_jobs_per_worker:
+            with self._lock:
+                self.recycled += 1
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+        return compact_dtypes(df)
+
+    def health_check(self) -> int:
+        """Ping the idle workers and replace those that don't answer, then start workers missing from `size` (e.g.
+        replacements that failed to start). Returns the number replaced or started."""
+        n_replaced = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker.ping():
+                self._idle.put(worker)
+            else:
+                n_replaced += self._retire(worker)
+        with self._lock:
+            n_missing = 0 if self._closed else self.size - len(self._workers)
+        for _ in range(n_missing):
+            try:
+                self._add_worker()
+                n_replaced += 1
+            except (CalculatorError, OSError) as e:
+                print(f'Calculator worker failed to start: {e}')
+                with self._lock:
+                    self.failures += 1
+        with self._lock:
+            self.replaced += n_replaced
+        return n_replaced
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'workers':len(self._workers), 'idle':self._idle.qsize(), 'runs':self.runs, 'failures':self.failures,
+                    'recycled':self.recycled, 'replaced':self.replaced}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def configured_worker_command():
+    """Worker command of the CALCULATOR_WORKER setting ('pool' or 'stub'), None for one calculator process per run ('rscript')"""
+    setting = os.environ.get('CALCULATOR_WORKER', 'rscript')
+    commands = {'rscript':None, 'pool':WORKER_COMMAND, 'stub':STUB_WORKER_COMMAND}
+    if setting not in commands:
+        raise ValueError(f"CALCULATOR_WORKER must be one of {list(commands)}, not '{setting}'")
+    return commands[setting]
+
+
+def get_calculator_pool(size=POOL_SIZE, command=None) -> CalculatorPool:
+    """Process-wide pool, started on first use in each process (a forked process, e.g. a background callback, starts its
+    own: the parent's reader threads don't survive the fork). command defaults to the CALCULATOR_WORKER setting's."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            command = command or configured_worker_command() or WORKER_COMMAND
+            _pool, _pool_pid = CalculatorPool(size=size, command=command), os.getpid()
+        return _pool
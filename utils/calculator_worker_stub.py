@@ -0,0 +1,95 @@
+## Pure-Python stand-in for a calculator worker (see utils/calculator_pool.py for the protocol), for tests and benchmarks.
+# Speaks the same line-delimited JSON protocol over stdin/stdout as the R worker, and returns a results table with the
+# calculator's columns (income, value.*, NetResources, location columns) from made-up but deterministic benefit rules:
+# benefits phase out or drop to 0 at income thresholds that depend on household size and location, so the curves have cliffs.
+#
+#   python -m utils.calculator_worker_stub [--startup-delay 2]   (delay: stands in for loading the Policy Rules Database)
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+
+
+def _location_factor(location:str) -> float:
+    """Cost of living/benefit level multiplier of a location (0.8 to 1.2), stable across runs"""
+    digest = hashlib.blake2b(location.encode(), digest_size=2).digest()
+    return 0.8 + 0.4 * int.from_bytes(digest, 'big') / 0xFFFF
+
+
+def calculate(profile:dict, locations:list) -> dict:
+    """Results table of a profile (Beneficiary.Profile) for each location, as {column: [values]}"""
+    ages = [profile[f'agePerson{i}'][0] for i in range(1, 13) if profile.get(f'agePerson{i}', ['NA'])[0] != 'NA']
+    n_adults = sum(1 for age in ages if int(age) >= 18)
+    n_kids = len(ages) - n_adults
+    n_young = sum(1 for age in ages if int(age) < 6)
+    household = max(len(ages), 1)
+
+    income = np.arange(profile['income_start'], profile['income_end'] + 1, profile['income_increase_by'], dtype=np.float64)
+    columns = {}
+    for location in locations:
+        factor = _location_factor(location)
+        county, _, state = location.rpartition(', ')
+
+        benefits = {
+            'value.snap': np.where(income <= (20000 + 6000 * household) * factor, np.maximum(1500 + 900 * household - 0.1 * income, 0), 0),
+            'value.section8': np.where(income <= (30000 + 4000 * household) * factor, 6000 * factor, 0),
+            'value.medicaid.adult': np.where(income <= 18000 * factor * n_adults, 5500 * n_adults, 0),
+            'value.medicaid.child': np.where(income <= 50000 * factor, 2500 * n_kids, 0),
+            'value.CCDF': np.where(income <= 45000 * factor, 5000 * n_young * factor, 0),
+            'value.eitc': np.clip(np.minimum(0.34 * income, 3600 + 1400 * min(n_kids, 3)) - np.maximum(income - 22000, 0) * 0.16, 0, None),
+            'value.ctc': np.where(income > 2500, 2000 * n_kids, 0),
+        }
+        taxes = 0.12 * income + np.maximum(income - 45000, 0) * 0.1
+        expenses = (24000 + 9000 * (household - 1)) * factor
+        net_resources = income - taxes - expenses + sum(benefits.values())
+
+        table = {'income':income, **benefits, 'NetResources':net_resources}
+        table = {col:np.round(values, 2).tolist() for col, values in table.items()}
+        table.update({'countyortownName':[county] * len(income), 'stateAbbrev':[state] * len(income),
+                      'state_county':[location] * len(income), 'Year':[profile['Year'][0]] * len(income)})
+        for col, values in table.items():
+            columns.setdefault(col, []).extend(values)
+    return columns
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, startup_delay=0.0) -> None:
+    """Answer requests from stdin until 'shutdown' or EOF"""
+    time.sleep(startup_delay)
+    jobs_done = 0
+
+    def send(message:dict):
+        stdout.write(json.dumps(message) + '\n')
+        stdout.flush()
+
+    send({'type':'ready', 'worker':'python-stub'})
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({'id':None, 'ok':False, 'error':f'invalid JSON: {e}'})
+            continue
+
+        if request.get('type') == 'ping':
+            send({'id':request.get('id'), 'ok':True, 'type':'pong', 'jobs_done':jobs_done})
+        elif request.get('type') == 'shutdown':
+            break
+        elif request.get('type') == 'run':
+            try:
+                columns = calculate(request['profile'], request['locations'])
+            except Exception as e:
+                send({'id':request.get('id'), 'ok':False, 'error':f'{type(e).__name__}: {e}'})
+                continue
+            jobs_done += 1
+            send({'id':request.get('id'), 'ok':True, 'columns':columns})
+        else:
+            send({'id':request.get('id'), 'ok':False, 'error':f"unknown request type {request.get('type')}"})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pure-Python stand-in calculator worker')
+    parser.add_argument('--startup-delay', type=float, default=0.0, help='seconds before the worker is ready')
+    serve(startup_delay=parser.parse_args().startup_delay)
@@ -0,0 +1,389 @@
+## Process-wide registry for the example datasets used by the pages.
+# Each dataset is read from disk once per process (i.e. once per gunicorn worker) and every page gets a
+# read-only view of the same frame, instead of each page module calling pd.read_csv at import.
+#
+# CSVs are parsed at most once per version: the first load writes a typed Parquet cache next to the CSV
+# (e.g. example_data/all-counties_three-profile_example.parquet) and later loads read that instead. The cache
+# is rebuilt when the CSV's mtime/size or the azure blob's last-modified timestamp (recorded by download_data.py)
+# no longer match the ones stamped into the cache.
+#
+# Each dataset is kept sorted by its grouping columns with a GroupIndex over them (see utils/group_index.py), so
+# callbacks look up a profile/location/career as a contiguous slice instead of masking the whole table.
+#
+# Results tables (profile x location x income) can also be served from a memory-mapped ResultsCube shared by
+# all workers (see utils/results_cube.py); get_cube() builds it from the dataset when it's missing or stale.
+# New calculator output goes to the SQLite ResultsStore (see utils/results_store.py), see get_results_store().
+#
+# Built figures are cached by get_figure_cache() (see utils/figure_cache.py), keyed on dataset_version().
+# Calculator results are cached by content (profile + location) by get_results_cache() (see utils/results_cache.py).
+# National/state aggregates of a profile across counties are kept by get_aggregate_store() (see utils/aggregates.py).
+import os
+import json
+import threading
+import pandas as pd
+from utils.group_index import GroupIndex
+from utils.results_cube import ResultsCube, build_cube, is_fresh
+from utils.results_store import ResultsStore, DEFAULT_DB_PATH
+from utils.figure_cache import FigureCache
+from utils.disk_cache import DiskCache
+from utils.results_cache import ResultsCache
+from utils.aggregates import AggregateStore, AGGREGATES_DIR
+from utils.BeneficiaryProfile import Beneficiary
+from utils.ingest import ingest_csv, add_cliff_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # the columnar cache is optional, we fall back to parsing the CSVs
+    pa = pq = None
+
+DATA_DIR = 'example_data'
+BLOB_VERSIONS_FILE = os.path.join(DATA_DIR, 'blob_versions.json') # {blob_name: last-modified timestamp}
+CACHE_FORMAT = '4' # bump when the columns derived in _read_csv() change, to rebuild existing caches
+
+FIGURE_CACHE_BYTES = 64 * 2**20 # figure JSON held by each worker
+FIGURE_CACHE_DIR = os.path.join('output', 'figure_cache') # disk tier shared by the workers (None to disable)
+FIGURE_DISK_CACHE_BYTES = 512 * 2**20
+RESULTS_CACHE_DIR = os.path.join('output', 'results_cache') # calculator results by profile + location (None to disable)
+RESULTS_CACHE_BYTES = 2 * 2**30
+
+DATASETS = {
+    # name: {'file': <file name in DATA_DIR / azure blob name>, 'read_csv': <kwargs for pd.read_csv>, 
+    #        'index': <grouping columns for the GroupIndex, outermost first>, 'cube': <served as a ResultsCube>, 
+    #        'series': <columns identifying one plotted curve>, 'x_var': <x-axis of the curves>}
+    'dash_exports': {
+        'file': 'DASH_exports_combined_New-Castle-County_30-adult_5-child_2-child_EDU+CODES.csv',
+        'read_csv': {},
+        'index': ('OCC_CODE', 'CareerPath'), # OCC_CODE -> careers for the skills matcher, CareerPath is one curve
+        'cube': False,
+        'series': ('CareerPath',),
+        'x_var': 'Year'
+    },
+    'all_counties': {
+        'file': 'all-counties_three-profile_example.csv',
+        'read_csv': {'low_memory': False},
+        'index': ('ProfileKey', 'state_county'),
+        'cube': True,
+        'series': ('ProfileKey', 'state_county'),
+        'x_var': 'income'
+    },
+}
+
+_frames = {} # name: loaded DataFrame, sorted by its index keys (never handed out directly)
+_indexes = {} # name: GroupIndex over _frames[name]
+_cubes = {} # name: ResultsCube
+_stores = {} # db_path: ResultsStore
+_versions = {} # name: version stamp of the loaded frame
+_figure_cache = None
+_results_cache = None
+_aggregate_store = None
+_lock = threading.Lock()
+
+# Views handed out by get_dataset() share memory with the registry frame, so writes to a view must not leak back
+# into it. Copy-on-Write guarantees that (always on from pandas 3.0, opt-in from 2.0).
+if int(pd.__version__.split('.')[0]) < 3:
+    try:
+        pd.set_option('mode.copy_on_write', True)
+    except (KeyError, pd.errors.OptionError):
+        pass # pandas < 2.0: views are still shallow, just don't write to them
+
+
+def dataset_path(name:str) -> str:
+    """Local path of a registered dataset"""
+    if name not in DATASETS:
+        raise KeyError(f"Unknown dataset '{name}' (registered: {list(DATASETS.keys())})")
+    return os.path.join(DATA_DIR, DATASETS[name]['file'])
+
+
+def cache_path(name:str) -> str:
+    """Path of the Parquet cache of a registered dataset"""
+    return os.path.splitext(dataset_path(name))[0] + '.parquet'
+
+
+def cube_path(name:str) -> str:
+    """Directory of the ResultsCube of a registered dataset"""
+    return os.path.splitext(dataset_path(name))[0] + '.cube'
+
+
+### ------------------------------------------------------------------------------ ###
+### --- SOURCE VERSIONS --- ###
+
+def read_blob_versions() -> dict:
+    """Last-modified timestamps of the blobs downloaded to DATA_DIR, as recorded at download time"""
+    if not os.path.isfile(BLOB_VERSIONS_FILE):
+        return {}
+    with open(BLOB_VERSIONS_FILE, 'r') as file:
+        return json.load(file)
+
+
+def record_blob_version(blob_name:str, last_modified) -> None:
+    """Record the last-modified timestamp of a downloaded blob (invalidates the caches built from it)"""
+    versions = read_blob_versions()
+    versions[blob_name] = None if last_modified is None else str(last_modified)
+    tmp_fp = BLOB_VERSIONS_FILE + '.tmp'
+    with open(tmp_fp, 'w') as file:
+        json.dump(versions, file, indent=4)
+    os.replace(tmp_fp, BLOB_VERSIONS_FILE)
+
+
+def source_version(name:str) -> dict:
+    """Version stamp of a dataset's CSV: local mtime/size plus the blob's last-modified timestamp if known"""
+    fp = dataset_path(name)
+    stat = os.stat(fp)
+    return {'source_mtime': str(stat.st_mtime_ns),
+            'source_size': str(stat.st_size),
+            'blob_last_modified': str(read_blob_versions().get(DATASETS[name]['file']))}
+
+
+def _download(name:str) -> None:
+    """Download a dataset missing from DATA_DIR from the azure container (same container as download_data.py)"""
+    from utils.load_creds import load_creds
+    from utils.AzureStorageManager import AzureBlobStorageManager
+
+    creds = load_creds()
+    azure_manager = AzureBlobStorageManager(connection_str=creds['azure']['conn-str'],
+                                            container_name=creds['azure']['container-name-2'],
+                                            download_dir=DATA_DIR)
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    blob_name = DATASETS[name]['file']
+    azure_manager.download_blob(blob_name)
+    record_blob_version(blob_name, azure_manager.get_blob_last_modified(blob_name, date_only=False))
+    print(f'Downloaded {blob_name} from azure')
+
+
+### ------------------------------------------------------------------------------ ###
+### --- COLUMNAR CACHE --- ###
+
+def add_profile_keys(df) -> pd.DataFrame: 
+    """Add an int64 ProfileKey column (Beneficiary.profile_key) computed from the BeneficiaryProfile json strings"""
+    profile_keys = {profile_str:Beneficiary.key_from_profile_str(profile_str) for profile_str in df['BeneficiaryProfile'].unique()}
+    df['ProfileKey'] = df['BeneficiaryProfile'].map(profile_keys).astype('int64')
+    return df
+
+
+def _read_csv(name:str, report=False) -> pd.DataFrame:
+    # Only the columns the pages use, with compact dtypes (see utils/ingest.py)
+    df = ingest_csv(dataset_path(name), report=report, **DATASETS[name]['read_csv'])
+    if 'BeneficiaryProfile' in df.columns: 
+        df = add_profile_keys(df)
+    # Derivative, cliffs and "Lost Benefits" labels of each curve, so plotting doesn't recompute them per callback
+    return add_cliff_columns(df, DATASETS[name]['series'], DATASETS[name]['x_var'])
+
+
+def _cache_stamp(name:str) -> dict: 
+    return {**source_version(name), 'cache_format':CACHE_FORMAT}
+
+
+def cache_is_fresh(name:str) -> bool:
+    """Whether the Parquet cache exists and was built from the current version of the CSV"""
+    if pq is None or not os.path.isfile(cache_path(name)):
+        return False
+    metadata = pq.read_schema(cache_path(name)).metadata or {}
+    expected = _cache_stamp(name)
+    stamp = {k.decode():v.decode() for k,v in metadata.items() if k.decode() in expected.keys()}
+    return stamp == expected
+
+
+def build_cache(name:str, df=None, report=False) -> str:
+    """Write the Parquet cache of a dataset, stamped with the version of the CSV it was built from.
+
+    Args:
+
+    name (str): key in DATASETS
+
+    df (DataFrame): already parsed CSV (parsed here if None)
+
+    report (bool): print memory before/after ingestion when parsing the CSV here
+
+    Returns:
+
+    fp (str): path of the cache file
+
+    """
+    if pq is None:
+        raise ImportError('pyarrow is required to build the columnar cache')
+
+    if df is None:
+        df = _read_csv(name, report=report)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({k.encode():v.encode() for k,v in _cache_stamp(name).items()})
+
+    fp = cache_path(name)
+    tmp_fp = fp + f'.{os.getpid()}.tmp' # workers may rebuild concurrently; os.replace keeps readers safe
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_fp)
+    os.replace(tmp_fp, fp)
+    return fp
+
+
+def read_dataset(name:str, columns=None) -> pd.DataFrame:
+    """Read a dataset from disk (not shared), preferring the columnar cache.
+
+    Args:
+
+    name (str): key in DATASETS
+
+    columns (list): columns to read (None for all). Only these are read from the cache; the CSV has to be parsed whole.
+
+    Returns:
+
+    df (DataFrame)
+
+    """
+    if not os.path.isfile(dataset_path(name)):
+        _download(name)
+
+    if cache_is_fresh(name):
+        return pd.read_parquet(cache_path(name), columns=columns)
+
+    df = _read_csv(name)
+    if pq is not None:
+        try:
+            build_cache(name, df)
+            print(f"Built columnar cache {cache_path(name)}")
+        except OSError as e: # e.g. read-only example_data/, just keep parsing the CSV
+            print(f"Could not write columnar cache for '{name}': {e}")
+
+    return df if columns is None else df[columns]
+
+
+### ------------------------------------------------------------------------------ ###
+### --- SHARED FRAMES --- ###
+
+def get_dataset(name:str, columns=None) -> pd.DataFrame:
+    """Get a read-only view of a registered dataset, loading it on first use.
+
+    Args:
+
+    name (str): key in DATASETS
+
+    columns (list): subset of columns to return (None for all)
+
+    Returns:
+
+    df (DataFrame): shallow view of the shared frame. Filter/assign freely, but treat the values as read-only.
+
+    """
+    if name not in _frames:
+        with _lock:
+            if name not in _frames: # another thread may have loaded it while we waited
+                index = GroupIndex(read_dataset(name), DATASETS[name]['index'])
+                _versions[name] = _cache_stamp(name)
+                _indexes[name] = index
+                _frames[name] = index.df
+                print(f"Loaded dataset '{name}' ({memory_usage(name) / 2**20:.1f} MB)")
+
+    df = _frames[name]
+    return df.copy(deep=False) if columns is None else df[columns]
+
+
+def get_index(name:str) -> GroupIndex:
+    """Get the GroupIndex of a registered dataset (keys in DATASETS[name]['index']), loading the dataset on first use.
+    Slices it returns are views of the shared frame: treat them as read-only too."""
+    if name not in _indexes:
+        get_dataset(name)
+    return _indexes[name]
+
+
+def get_cube(name:str) -> ResultsCube:
+    """Get the memory-mapped ResultsCube of a results dataset (with ProfileKey, state_county and income columns).
+    If the cube on disk is missing or was built from another version of the CSV, it's rebuilt from the dataset first,
+    otherwise the dataset itself is never loaded into this process."""
+    if name not in _cubes:
+        with _lock:
+            if name not in _cubes:
+                if not os.path.isfile(dataset_path(name)):
+                    _download(name)
+                if not is_fresh(cube_path(name), _cache_stamp(name)):
+                    print(f"Building results cube {cube_path(name)}")
+                    build_cube(read_dataset(name), cube_path(name), stamp=_cache_stamp(name))
+                _cubes[name] = ResultsCube(cube_path(name))
+                print(f"Mapped results cube '{name}' ({_cubes[name].nbytes / 2**20:.1f} MB on disk)")
+    return _cubes[name]
+
+
+def get_results_store(db_path=None) -> ResultsStore:
+    """Get the process-wide ResultsStore (SQLite database at db_path, default output/results.sqlite)"""
+    db_path = db_path or DEFAULT_DB_PATH
+    if db_path not in _stores:
+        with _lock:
+            if db_path not in _stores:
+                _stores[db_path] = ResultsStore(db_path)
+    return _stores[db_path]
+
+
+def load_into_store(name:str, store=None) -> bool:
+    """Bulk insert a results dataset into the ResultsStore, unless this version of it is already there.
+    Returns True if it was inserted."""
+    store = store or get_results_store()
+    if not os.path.isfile(dataset_path(name)):
+        _download(name)
+    if store.has_source(name, _cache_stamp(name)):
+        return False
+    store.insert_csv(dataset_path(name), source_name=name, stamp=_cache_stamp(name))
+    return True
+
+
+def dataset_version(name:str) -> str:
+    """Version of a dataset as served by this process (stamp of the loaded frame or cube), e.g. for cache keys"""
+    if name in _cubes:
+        stamp = _cubes[name].stamp
+    elif name in _versions:
+        stamp = _versions[name]
+    else:
+        stamp = _cache_stamp(name)
+    return json.dumps(stamp, sort_keys=True)
+
+
+def get_figure_cache() -> FigureCache:
+    """Get the process-wide FigureCache (with a disk tier in FIGURE_CACHE_DIR shared by the workers)"""
+    global _figure_cache
+    if _figure_cache is None:
+        with _lock:
+            if _figure_cache is None:
+                disk_cache = None
+                if FIGURE_CACHE_DIR is not None:
+                    try:
+                        disk_cache = DiskCache(FIGURE_CACHE_DIR, max_bytes=FIGURE_DISK_CACHE_BYTES)
+                    except OSError as e: # e.g. read-only deployment, keep the in-process tier only
+                        print(f"Could not open figure disk cache {FIGURE_CACHE_DIR}: {e}")
+                _figure_cache = FigureCache(max_bytes=FIGURE_CACHE_BYTES, disk_cache=disk_cache)
+    return _figure_cache
+
+
+def get_results_cache() -> ResultsCache:
+    """Get the process-wide ResultsCache in RESULTS_CACHE_DIR (shared by the workers), or None if it can't be used"""
+    global _results_cache
+    if _results_cache is None and RESULTS_CACHE_DIR is not None:
+        with _lock:
+            if _results_cache is None:
+                try:
+                    _results_cache = ResultsCache(DiskCache(RESULTS_CACHE_DIR, max_bytes=RESULTS_CACHE_BYTES))
+                except (ImportError, OSError) as e: # no pyarrow, or e.g. read-only deployment: always run the calculator
+                    print(f"Could not open results cache {RESULTS_CACHE_DIR}: {e}")
+    return _results_cache
+
+
+def get_aggregate_store() -> AggregateStore:
+    """Get the process-wide AggregateStore (one directory per profile in output/aggregates/)"""
+    global _aggregate_store
+    if _aggregate_store is None:
+        with _lock:
+            if _aggregate_store is None:
+                _aggregate_store = AggregateStore(AGGREGATES_DIR)
+    return _aggregate_store
+
+
+def memory_usage(name:str) -> int:
+    """Bytes held by a loaded dataset (0 if not loaded)"""
+    if name not in _frames:
+        return 0
+    return int(_frames[name].memory_usage(index=True, deep=True).sum())
+
+
+def memory_report() -> dict:
+    """Memory (MB) held by each registered dataset in this process, e.g. {'dash_exports': 12.3, 'all_counties': None}
+    None means the dataset hasn't been loaded in this process."""
+    return {name:(round(memory_usage(name) / 2**20, 2) if name in _frames else None) for name in DATASETS.keys()}
@@ -0,0 +1,198 @@
+## Small on-disk key/value cache shared by the worker processes (figures, skills matcher responses, calculator results).
+# One file per entry, named by a hash of the key. Writes go to a temp file and are moved into place with os.replace,
+# so a reader in another worker never sees half a file. The cache is bounded by total size: when it grows past
+# max_bytes the least recently used entries are deleted (reads touch the file's mtime), down to LOW_WATER of max_bytes
+# so the directory scan this takes happens once per that much written rather than on every write. Entries can also
+# expire after ttl seconds from when they were written. The scan also deletes temp files left by crashed writers.
+#
+# Entry file: 8 byte big-endian float (time written) followed by the value bytes.
+import os
+import time
+import struct
+import hashlib
+import threading
+
+HEADER = struct.Struct('>d')
+SUFFIX = '.entry'
+TMP_SUFFIX = '.tmp'
+LOW_WATER = 0.9 # evict down to this fraction of max_bytes
+STALE_TMP_AGE = 600 # seconds after which a temp file is taken as left by a crashed writer
+
+
+class DiskCache:
+
+    def __init__(self, cache_dir:str, max_bytes=None, ttl=None):
+        """Open (and create if needed) a cache directory.
+
+        Args:
+
+        cache_dir (str): directory holding the entries (can be shared by several processes)
+
+        max_bytes (int): evict least recently used entries beyond this total size (None for unbounded)
+
+        ttl (float): seconds after which an entry expires (None to keep entries until evicted)
+
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = self._scan_size() # approximate, other processes write too; rescanned before evicting
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + SUFFIX)
+
+    def _entries(self, remove_stale_tmp=False) -> list:
+        """[(path, size, mtime)] of all entries (deleting temp files older than STALE_TMP_AGE if remove_stale_tmp)"""
+        entries = []
+        now = time.time()
+        for file_name in os.listdir(self.cache_dir):
+            is_entry = file_name.endswith(SUFFIX)
+            if not is_entry and not (remove_stale_tmp and file_name.endswith(TMP_SUFFIX)):
+                continue
+            fp = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(fp)
+                if not is_entry:
+                    if now - stat.st_mtime > STALE_TMP_AGE:
+                        os.remove(fp)
+                    continue
+            except FileNotFoundError: # evicted by another process, or the temp file was moved into place
+                continue
+            entries.append((fp, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _file_size(self, fp:str) -> int:
+        try:
+            return os.stat(fp).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    ### --- READING --- ###
+
+    def get(self, key:str, default=None):
+        """Value bytes stored under key, or default if missing/expired"""
+        fp = self._path(key)
+        try:
+            with open(fp, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return default
+
+        written, = HEADER.unpack_from(data)
+        if self.ttl is not None and time.time() - written > self.ttl:
+            self.delete(key)
+            with self._lock:
+                self.misses += 1
+            return default
+
+        try:
+            os.utime(fp) # most recently used
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data[HEADER.size:]
+
+    def __contains__(self, key:str) -> bool:
+        fp = self._path(key)
+        if not os.path.isfile(fp):
+            return False
+        if self.ttl is None:
+            return True
+        with open(fp, 'rb') as file:
+            written, = HEADER.unpack(file.read(HEADER.size))
+        return time.time() - written <= self.ttl
+
+    ### --- WRITING --- ###
+
+    def set(self, key:str, value:bytes) -> None:
+        """Store value bytes under key (atomically replacing any previous value)"""
+        fp = self._path(key)
+        tmp_fp = fp + f'.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}'
+        with open(tmp_fp, 'wb') as file:
+            file.write(HEADER.pack(time.time()))
+            file.write(value)
+        replaced_size = self._file_size(fp) # an overwrite only adds the difference
+        os.replace(tmp_fp, fp)
+
+        with self._lock:
+            self._size += HEADER.size + len(value) - replaced_size
+            over_limit = self.max_bytes is not None and self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def delete(self, key:str) -> None:
+        fp = self._path(key)
+        size = self._file_size(fp)
+        try:
+            os.remove(fp)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def evict(self) -> int:
+        """Delete expired entries, then least recently used ones until the cache is down to LOW_WATER of max_bytes
+        (and stale temp files). Returns the number of entries deleted."""
+        entries = sorted(self._entries(remove_stale_tmp=True), key=lambda entry: entry[2]) # least recently used first
+        total = sum(size for _, size, _ in entries)
+        target = None if self.max_bytes is None else self.max_bytes * LOW_WATER
+        now = time.time()
+        n_deleted = 0
+        for fp, size, mtime in entries:
+            expired = False
+            if self.ttl is not None:
+                try:
+                    with open(fp, 'rb') as file:
+                        written, = HEADER.unpack(file.read(HEADER.size))
+                    expired = now - written > self.ttl
+                except (FileNotFoundError, struct.error):
+                    expired = True
+            if not expired and (target is None or total <= target):
+                continue
+            try:
+                os.remove(fp)
+                n_deleted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._size = total
+            self.evictions += n_deleted
+        return n_deleted
+
+    def clear(self) -> None:
+        for fp, _, _ in self._entries(remove_stale_tmp=True):
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    ### --- STATS --- ###
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this process and current size of the cache"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'hit_rate':round(self.hits / lookups, 3) if lookups else None,
+                'evictions':self.evictions,
+                'entries':len(entries),
+                'bytes':sum(size for _, size, _ in entries),
+                'max_bytes':self.max_bytes}
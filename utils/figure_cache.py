@@ -0,0 +1,122 @@
+## Bounded LRU cache of built figures, so switching tabs or re-submitting the same selection doesn't rebuild the figure.
+# Figures are stored as serialized plotly JSON, keyed on everything that determines them (dataset version, profile key,
+# group selection, x_var, y_var, title, ...), and handed back as plain dicts (which dcc.Graph accepts).
+# The in-process tier is bounded by the bytes of JSON it holds. An optional DiskCache tier (see utils/disk_cache.py)
+# lets the gunicorn workers share warm entries.
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import plotly.io as pio
+
+
+def figure_key(dataset_version, profile_key, groups, x_var:str, y_var:str, title:str, **extra) -> str:
+    """Cache key of a figure.
+
+    Args:
+
+    dataset_version: version of the data the figure is built from (e.g. data_registry.dataset_version())
+
+    profile_key (int): Beneficiary.profile_key of the plotted profile (None if the figure isn't for one profile)
+
+    groups (list): plotted groups (careers, locations, ...) in plotting order, which sets their colors
+
+    x_var, y_var, title (str): plot parameters
+
+    extra: anything else the figure depends on (e.g. kind='single', curve_color=...)
+
+    """
+    parts = [dataset_version, profile_key, list(groups) if groups is not None else None, x_var, y_var, title, extra]
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class FigureCache:
+
+    def __init__(self, max_bytes=64 * 2**20, disk_cache=None):
+        """
+        Args:
+
+        max_bytes (int): bound on the figure JSON held in this process; least recently used figures are dropped beyond it
+
+        disk_cache (DiskCache): optional second tier shared between processes
+
+        """
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self._figures = OrderedDict() # key: figure JSON, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _put(self, key:str, fig_json:str) -> None:
+        size = len(fig_json)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._figures:
+                self._bytes -= len(self._figures.pop(key))
+            self._figures[key] = fig_json
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._figures.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get(self, key:str):
+        """Cached figure as a dict, or None"""
+        with self._lock:
+            fig_json = self._figures.get(key)
+            if fig_json is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return json.loads(fig_json)
+
+        if self.disk_cache is not None:
+            data = self.disk_cache.get(key)
+            if data is not None:
+                fig_json = data.decode()
+                self._put(key, fig_json)
+                with self._lock:
+                    self.disk_hits += 1
+                return json.loads(fig_json)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key:str, fig) -> dict:
+        """Cache a figure (go.Figure or figure dict). Returns it as a dict, like get()."""
+        fig_json = pio.to_json(fig, validate=False)
+        self._put(key, fig_json)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, fig_json.encode())
+        return json.loads(fig_json)
+
+    def get_or_build(self, key:str, build):
+        """Cached figure for key, or build() it (a function returning a go.Figure or figure dict) and cache it"""
+        fig = self.get(key)
+        if fig is None:
+            fig = self.set(key, build())
+        return fig
+
+    def clear(self) -> None:
+        with self._lock:
+            self._figures.clear()
+            self._bytes = 0
+        if self.disk_cache is not None:
+            self.disk_cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits':self.hits,
+                'disk_hits':self.disk_hits,
+                'misses':self.misses,
+                'hit_rate':round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+                'evictions':self.evictions,
+                'figures':len(self._figures),
+                'bytes':self._bytes,
+                'max_bytes':self.max_bytes}
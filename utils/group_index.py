@@ -0,0 +1,128 @@
+## Pre-built index for looking up rows of a results table by its grouping columns
+# (e.g. BeneficiaryProfile, state_county, CareerPath) without scanning the whole table on every callback.
+# The table is sorted once so every key combination is one contiguous block of rows, and lookups return
+# zero-copy slices of that block instead of boolean-mask copies. select() finds the matching groups through a
+# value -> groups mapping per key column, so it doesn't loop over every group either.
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+
+    def __init__(self, df, keys):
+        """Sort df by the key columns and record where each key combination starts and stops.
+        Groups keep the order in which they first appear in df, and rows keep their order within a group.
+
+        Args:
+
+        df (DataFrame): long-format table
+
+        keys (tuple): grouping columns, outermost first. Any leading subset of keys (a prefix) is also one contiguous block.
+
+        """
+        self.keys = tuple(keys)
+
+        codes = [pd.factorize(df[key], sort=False)[0] for key in self.keys] # codes in order of first appearance
+        order = np.lexsort(codes[::-1]) # stable, so rows stay in their original order within a group
+        self.df = df.iloc[order].reset_index(drop=True)
+
+        n = len(self.df)
+        sorted_codes = np.stack([c[order] for c in codes]) if n > 0 else np.empty((len(self.keys), 0), dtype=int)
+        is_new_group = np.any(sorted_codes[:, 1:] != sorted_codes[:, :-1], axis=0)
+        starts = np.concatenate([[0], np.flatnonzero(is_new_group) + 1]) if n > 0 else np.array([], dtype=int)
+        stops = np.concatenate([starts[1:], [n]]) if n > 0 else np.array([], dtype=int)
+
+        key_values = [self.df[key].to_numpy()[starts].tolist() for key in self.keys]
+
+        # {full key tuple: (start, stop)}, in row order
+        self._slices = {key:(int(start), int(stop)) for key, start, stop in zip(zip(*key_values), starts, stops)}
+
+        # {prefix tuple: (start, stop)} for each shorter prefix of the keys
+        self._prefix_slices = {}
+        for key, (start, stop) in self._slices.items():
+            for level in range(1, len(self.keys)):
+                prefix = key[:level]
+                if prefix in self._prefix_slices:
+                    self._prefix_slices[prefix] = (self._prefix_slices[prefix][0], stop)
+                else:
+                    self._prefix_slices[prefix] = (start, stop)
+
+        # For select(): (start, stop) of each group in row order, and {value: [group numbers]} per key column
+        self._group_slices = list(self._slices.values())
+        self._groups_by_value = [{} for _ in self.keys]
+        for n, key in enumerate(self._slices):
+            for level, value in enumerate(key):
+                self._groups_by_value[level].setdefault(value, []).append(n)
+
+    def __len__(self):
+        return len(self._slices)
+
+    def __contains__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        return key in self._slices or key in self._prefix_slices
+
+    def group_keys(self) -> list:
+        """All full key combinations, in row order"""
+        return list(self._slices.keys())
+
+    def get(self, *key) -> pd.DataFrame:
+        """Rows of one key combination (or of a prefix of the keys) as a zero-copy slice.
+        Returns an empty frame if the key doesn't exist.
+
+        e.g. index.get(profile, 'Kent County, DE') or index.get(profile) for (BeneficiaryProfile, state_county)
+        """
+        if len(key) == len(self.keys):
+            start, stop = self._slices.get(key, (0, 0))
+        else:
+            start, stop = self._prefix_slices.get(key, (0, 0))
+        return self.df.iloc[start:stop]
+
+    def select(self, **criteria) -> pd.DataFrame:
+        """Rows matching any combination of key columns, e.g. index.select(state_county=['Kent County, DE', 'Sussex County, DE']).
+
+        Args:
+
+        criteria: key column name = value, or list of values (like isin)
+
+        Returns:
+
+        df (DataFrame): matching rows, in index order. A zero-copy slice if they are one contiguous block.
+
+        """
+        unknown = [col for col in criteria.keys() if col not in self.keys]
+        if unknown:
+            raise KeyError(f"{unknown} not in index keys {self.keys}")
+
+        wanted = {}
+        for key, values in criteria.items():
+            wanted[key] = set(values) if isinstance(values, (list, tuple, set, np.ndarray, pd.Series, pd.Index)) else {values}
+
+        if not wanted:
+            slices = [(0, len(self.df))]
+        elif list(wanted) == [self.keys[0]]: # values of the outermost key: one block each
+            prefix_slices = self._slices if len(self.keys) == 1 else self._prefix_slices
+            slices = sorted(prefix_slices[(value,)] for value in wanted[self.keys[0]] if (value,) in prefix_slices)
+        else: # groups having one of the values of every criterion
+            groups = None
+            for level, key in enumerate(self.keys):
+                if key in wanted:
+                    matching = {n for value in wanted[key] for n in self._groups_by_value[level].get(value, ())}
+                    groups = matching if groups is None else groups & matching
+            slices = [self._group_slices[n] for n in sorted(groups)]
+
+        # Merge matching groups which are next to each other into one slice
+        ranges = []
+        for start, stop in slices:
+            if stop == start:
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+
+        if len(ranges) == 0:
+            return self.df.iloc[0:0]
+        elif len(ranges) == 1:
+            return self.df.iloc[ranges[0][0]:ranges[0][1]]
+        else:
+            return self.df.iloc[np.concatenate([np.arange(start, stop) for start, stop in ranges])] # one take, not a concat of slices
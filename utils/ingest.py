@@ -0,0 +1,119 @@
+## Projected, dtype-mapped ingestion of calculator output (applyBenefitsCalculator.R / DASH exports).
+# The callbacks only ever read a handful of columns, so we parse just those and store them compactly:
+# grouping columns as categoricals, money as float32, income/Year as small ints.
+#
+# The output is static once produced, so what plotting derives from each curve (derivative, benefits cliffs and the
+# "Lost Benefits" hover labels) is also computed here once, see add_cliff_columns().
+import pandas as pd
+import numpy as np
+import utils.utils as utils
+from utils.plotting import ben_display_map
+
+GROUP_COLUMNS = ('state_county', 'countyortownName', 'stateAbbrev', 'CareerPath', 'OCC_CODE', 'BeneficiaryProfile')
+MONEY_COLUMNS = ('NetResources',) + tuple(ben_display_map.keys()) # value.* columns known to filter_benefits/plotting
+RESULT_COLUMNS = ('income', 'Year') + GROUP_COLUMNS + MONEY_COLUMNS
+CLIFF_COLUMNS = ('derivative', 'cliffs', 'lost_benefits') # added by add_cliff_columns()
+
+
+def result_dtypes(columns) -> dict:
+    """dtype of each ingested column (income and Year are downcast after parsing, see compact_dtypes())"""
+    dtypes = {}
+    for col in columns:
+        if col in GROUP_COLUMNS or col in ('cliffs', 'lost_benefits'):
+            dtypes[col] = 'category'
+        elif col in MONEY_COLUMNS or col == 'derivative':
+            dtypes[col] = np.float32
+    return dtypes
+
+
+def _downcast_int(s:pd.Series) -> pd.Series:
+    """Downcast a numeric column to the smallest int type if it holds whole numbers only"""
+    if s.isna().any() or not np.all(s == np.round(s)):
+        return s.astype(np.float32)
+    return pd.to_numeric(s.astype(np.int64), downcast='integer')
+
+
+def compact_dtypes(df) -> pd.DataFrame:
+    """Convert a results table to the ingested dtypes (e.g. after reading it back from a database)"""
+    df = df.astype(result_dtypes(df.columns))
+    for col in ('income', 'Year'):
+        if col in df.columns:
+            df[col] = _downcast_int(df[col])
+    return df
+
+
+def ingest_csv(fp:str, report=False, **read_csv_kwargs) -> pd.DataFrame:
+    """Read a results CSV keeping only RESULT_COLUMNS, with compact dtypes.
+
+    Args:
+
+    fp (str): path to the CSV
+
+    report (bool): also parse the CSV with default settings and print memory before/after (slower, for download_data.py)
+
+    read_csv_kwargs: passed on to pd.read_csv
+
+    Returns:
+
+    df (DataFrame)
+
+    """
+    header = pd.read_csv(fp, nrows=0).columns
+    columns = [col for col in header if col in RESULT_COLUMNS]
+
+    df = compact_dtypes(pd.read_csv(fp, usecols=columns, dtype=result_dtypes(columns), **read_csv_kwargs))
+
+    if report:
+        before = pd.read_csv(fp, **read_csv_kwargs).memory_usage(index=True, deep=True).sum()
+        after = df.memory_usage(index=True, deep=True).sum()
+        print(f"Ingested {fp}: {len(header)} -> {len(columns)} columns, "
+              f"{before / 2**20:.1f} MB -> {after / 2**20:.1f} MB ({after / before:.0%})")
+
+    return df
+
+
+def add_cliff_columns(df, series, x_var, y_var='NetResources') -> pd.DataFrame:
+    """Add the CLIFF_COLUMNS plotting.plot_single_profile would otherwise compute for each curve on every render:
+
+    derivative: derivative of y_var over x_var (utils.find_derivative())
+
+    cliffs: benefits columns with a cliff peak at this row, comma separated (missing if none), see utils.find_benefits_cliffs()
+
+    lost_benefits: display names of those benefits, i.e. the "Lost Benefits" hover label
+
+    Args:
+
+    df (DataFrame): results table
+
+    series (tuple): columns identifying one curve, e.g. ('ProfileKey', 'state_county') or ('CareerPath',)
+
+    x_var (str): x-axis column of the curves ('income' or 'Year')
+
+    Returns:
+
+    df (DataFrame)
+
+    """
+    series_codes = df.groupby(list(series), sort=False, observed=True, dropna=False).ngroup().to_numpy()
+    group_cliffs = utils.find_group_cliffs(df.assign(_series=series_codes, _row=np.arange(len(df))),
+                                           x_var=x_var, y_var=y_var, group_var='_series', mode='peak')
+    rows, offsets = group_cliffs['df']['_row'].to_numpy(), group_cliffs['offsets']
+
+    derivative = np.empty(len(df), dtype=group_cliffs['derivative'].dtype)
+    derivative[rows] = group_cliffs['derivative']
+
+    row_cliffs = {} # {row: [benefits columns]}, in column order
+    for n, cliffs in enumerate(group_cliffs['cliffs']):
+        for col, cliff_indices in cliffs.items():
+            for cliff_idx in cliff_indices:
+                row_cliffs.setdefault(int(rows[offsets[n] + cliff_idx]), []).append(col)
+
+    cliff_col, lost_benefits = np.full(len(df), None, dtype=object), np.full(len(df), None, dtype=object)
+    for row, cols in row_cliffs.items():
+        cliff_col[row] = ','.join(cols)
+        lost_benefits[row] = ', '.join(ben_display_map.get(col, (col,))[0] for col in cols)
+
+    df['derivative'] = derivative
+    df['cliffs'] = pd.Categorical(cliff_col)
+    df['lost_benefits'] = pd.Categorical(lost_benefits)
+    return df
@@ -1,5 +1,13 @@
+import functools 
+import json 
 import plotly.express as px 
 import plotly.graph_objects as go 
+import plotly.io as pio 
+from plotly.utils import PlotlyJSONEncoder 
+try: 
+    from _plotly_utils.utils import to_typed_array_spec # what go.Figure's validators do with numpy arrays (plotly >= 6)
+except ImportError: 
+    to_typed_array_spec = lambda v: v 
 from utils.BeneficiaryProfile import Beneficiary
 import utils.utils as utils 
 import numpy as np 
@@ -67,11 +75,34 @@ def create_custom_ticks_labels() -> tuple:
 ### ------------------------------------------------------------------------------ ###
 ### --- PLOTLY TEMPLATES & HELPERS --- ###
 
+def lost_benefit_labels(df, cliffs:dict) -> dict: 
+    """Names of the benefits lost at each cliff peak of a curve, {row position: 'SNAP, Section 8'}, for the hover text.
+    Read from the lost_benefits column if it was precomputed at ingest (see utils/ingest.py), else built from cliffs."""
+    if 'lost_benefits' in df.columns: 
+        positions = np.flatnonzero(df['lost_benefits'].notna().to_numpy())
+        return dict(zip(positions.tolist(), df['lost_benefits'].iloc[positions].astype(str)))
+
+    ben_cliff_peaks = {}
+    for ben_col, cliff_indices in cliffs.items(): 
+        for cliff_idx in cliff_indices: 
+            ben_cliff_peaks.setdefault(cliff_idx, []).append(ben_display_map[ben_col][0])
+    return {cliff_idx:', '.join(ben_list) for cliff_idx, ben_list in ben_cliff_peaks.items()}
+
+
 ## Generalized single curve plotting 
-def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  title=None, ben_profile_text=None, plot_derivative=False): 
+def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  title=None, ben_profile_text=None, plot_derivative=False, precomputed=None, fast=True): 
     """Plot single curve (either net resources per year for one job in tab1/tab2, or net resources vs income bracket in tab3) for one beneficiary profile.
     For multiple curves on one figure, this function is iterated over the same "fig" object and certain options are omitted. 
+
+    precomputed (tuple): (derivative, cliffs) of df's curve, e.g. from utils.find_group_cliffs(), so they aren't recomputed. 
+    If df has the columns precomputed at ingest (see utils/ingest.py add_cliff_columns()), those are used.
+
+    fast (bool): build the figure dict directly (see FAST FIGURE BUILDER below) instead of through go.Figure methods. 
+    Returns a dict instead of a go.Figure. Only for a new figure (fig=None).
     """
+    if fast and fig is None: 
+        return _build_single_profile(df, x_var, y_var, curve_color, curve_name, title=title, ben_profile_text=ben_profile_text, 
+                                     plot_derivative=plot_derivative, precomputed=precomputed)
 
     if title is None: 
         title = 'Net Resources for Chosen Beneficiary Profile'
@@ -114,7 +145,13 @@ def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  ti
         plot_benefits = False 
         
     ## Main curve     
-    derivative, derivative_rel_minima = utils.find_derivative(x,y)
+    if precomputed is None and 'cliffs' in df.columns: # precomputed at ingest 
+        precomputed = (df['derivative'].to_numpy(), utils.cliffs_from_column(df))
+
+    if precomputed is None: 
+        derivative, derivative_rel_minima = utils.find_derivative(x,y)
+    else: 
+        derivative, cliffs = precomputed
     if plot_derivative: 
         derivative_scale = 10000
         fig.add_trace(go.Scatter(x=x, y=derivative * derivative_scale, 
@@ -122,11 +159,12 @@ def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  ti
                                  name=f'1st Derivative (* {derivative_scale})'))
 
     ## Benefits
-    df_benefits = utils.filter_benefits(df, include_eitc=False, include_ctc=False)
-    cliffs = utils.find_benefits_cliffs(df_benefits, derivative_rel_minima, mode='peak')
+    if precomputed is None or plot_benefits: 
+        df_benefits = utils.filter_benefits(df, include_eitc=False, include_ctc=False)
+    if precomputed is None: 
+        cliffs = utils.find_benefits_cliffs(df_benefits, derivative_rel_minima, mode='peak')
 
     # Add annotations at cliff peaks 
-    ben_cliff_peaks = np.empty(shape=df.shape[0], dtype=np.object_) # for storing where peaks are for hover text
     for ben_col, cliff_indices  in cliffs.items():
         for cliff_idx in cliff_indices: 
             x_label = x.iloc[cliff_idx]
@@ -145,22 +183,11 @@ def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  ti
                 bgcolor=curve_color,
                 opacity=0.8
                 )
-            
-            # Store name of the benefit lost at the given index
-            if ben_cliff_peaks[cliff_idx] is None:
-                ben_cliff_peaks[cliff_idx] = [ben_display_map[ben_col][0]]
-            else: 
-                ben_cliff_peaks[cliff_idx].append(ben_display_map[ben_col][0])
 
     # Create text array for hover text 
     # Need to combine income with the benefit that was lost, if any, to pass in as "text" parameter
         # Income is accessible in hovertemplate as 'x' if it's the x variable, but not if x == "Year"  
-    text_list = []
-    for income, ben_list in zip(df['income'], ben_cliff_peaks): 
-        text = utils.format_int_dollars(income)
-        if ben_list is not None: 
-            text += f"<br>Lost Benefits: " + ', '.join(ben_list)
-        text_list.append(text)
+    text_list = utils.hover_text(df['income'].to_numpy(), lost_benefit_labels(df, cliffs))
     hover_template = 'Net Resources: %{y:$,.0f}<br>Income: %{text}  <extra></extra>'
     if x_var == "Year": 
         hover_template = "Year: %{x}<br>" + hover_template
@@ -208,8 +235,11 @@ def plot_single_profile(df, x_var, y_var, curve_color, curve_name, fig=None,  ti
     return fig 
 
 ## Generalized multi curve plot
-def plot_multi(df, x_var, y_var, group_var, color_map=None, title=None): 
-    """Plot net resources over (income or time) for multiple (jobs, counties, or beneficiary profiles)"""
+def plot_multi(df, x_var, y_var, group_var, color_map=None, title=None, fast=True): 
+    """Plot net resources over (income or time) for multiple (jobs, counties, or beneficiary profiles)
+
+    fast (bool): build the figure dict directly (see FAST FIGURE BUILDER below), returns a dict instead of a go.Figure
+    """
 
     if color_map is None: 
         color_map = dict(zip(df[group_var].unique(), general_color_palette))
@@ -217,19 +247,34 @@ def plot_multi(df, x_var, y_var, group_var, color_map=None, title=None):
     known_group_cols = ("countyortownName","CareerPath","BeneficiaryProfile", "state_county")
     if group_var not in known_group_cols: # TO-DO: BeneficiaryProrfile is created column from combining dataframes
         raise Warning(f"{group_var} not in known grouping columns ({known_group_cols})")
+
+    if fast: 
+        return _build_multi(df, x_var, y_var, group_var, color_map=color_map, title=title)
     
     fig = go.Figure()
 
-    for group in df[group_var].unique():
+    # Groups are contiguous blocks of rows in the sorted df. Unless they were precomputed at ingest (then plot_single_profile 
+    # reads them from df), derivatives and cliffs of every group are computed in one pass 
+    if 'cliffs' in df.columns: 
+        group_cliffs = None 
+        df_sorted, groups, offsets = utils.group_offsets(df, group_var)
+    else: 
+        group_cliffs = utils.find_group_cliffs(df, x_var=x_var, y_var=y_var, group_var=group_var, mode='peak')
+        df_sorted, groups, offsets = group_cliffs['df'], group_cliffs['groups'], group_cliffs['offsets']
+
+    for n, group in enumerate(groups):
          
-        dff = df[df[group_var] == group] 
+        start, stop = offsets[n], offsets[n+1]
+        dff = df_sorted.iloc[start:stop]
 
         fig = plot_single_profile(dff, 
                                   x_var=x_var, 
                                   y_var=y_var,
                                   curve_color=color_map[group],
                                   curve_name=group, 
-                                  fig=fig)
+                                  fig=fig, 
+                                  precomputed=None if group_cliffs is None else (group_cliffs['derivative'][start:stop], group_cliffs['cliffs'][n]), 
+                                  fast=False)
 
     ## -- Add baseline (break-even) -- ## 
     fig.add_shape(type="line",
@@ -243,7 +288,183 @@ def plot_multi(df, x_var, y_var, group_var, color_map=None, title=None):
     ## --- Add title --- ## 
     fig.update_layout(title=title, legend=dict(x=.02, y=.98))
 
-    return fig 
+    return fig
+
+## Single curve plots of several tabs in one figure
+def plot_single_profile_tabs(dfs:dict, x_var, y_var, curve_colors:dict, curve_names:dict, selected=None, title=None):
+    """Single view plots (plot_single_profile) of every tab stacked into one figure dict, with only the selected tab's
+    traces visible. Switching tabs then only needs the traces' visibility changed (utils_dash.show_trace_group) instead
+    of sending a new figure.
+
+    Args:
+
+    dfs (dict): tab value: df of the tab's curve (e.g. location: results of that county), in tab order
+
+    curve_colors, curve_names (dict): tab value: curve_color/curve_name (see plot_single_profile)
+
+    selected: tab shown first (default the first tab)
+
+    Returns:
+
+    figure dict, with layout.meta['trace_groups'] = {'tabs':{tab value: [trace indices]}, 'visible':[visibility of each trace when its tab is shown]}
+    """
+    if selected is None:
+        selected = next(iter(dfs))
+
+    traces, tabs, shown_visible = [], {}, []
+    for tab, df in dfs.items():
+        tab_traces = _build_single_profile(df, x_var, y_var, curve_colors[tab], curve_names[tab], title=title)['data']
+        tabs[tab] = list(range(len(traces), len(traces) + len(tab_traces)))
+        for trace in tab_traces:
+            shown_visible.append(trace.get('visible', True))
+            if tab != selected:
+                trace['visible'] = False
+        traces += tab_traces
+
+    layout = _layout(x_var, title='Net Resources for Chosen Beneficiary Profile' if title is None else title)
+    if len(dfs) > 0:
+        layout['shapes'] = [_break_even_line(np.concatenate([df[x_var].to_numpy() for df in dfs.values()]))]
+    layout['meta'] = {'trace_groups':{'tabs':tabs, 'visible':shown_visible}}
+
+    return dict(data=traces, layout=layout) 
+
+### ------------------------------------------------------------------------------ ###
+### --- FAST FIGURE BUILDER --- ###
+# plot_single_profile/plot_multi (fast=True) emit the figure dict in one go instead of going through plotly's property 
+# validation on every add_trace/add_annotation/update_* call. Same figures as the go.Figure path (fast=False), except 
+# cliff peaks are drawn as one marker trace instead of one annotation per cliff.
+
+Y_AXIS_TITLE = "$ (Net Resources OR Benefits)"
+INCOME_LABEL_ALIAS = {f"{n}k":f"${n},000 <br>(${(n * 1000) / (52 * 40):.2f}/h)" for n in range(10, 110, 10)} # annual & hourly wage 
+CLIFF_MARKER = dict(symbol='square', size=12, opacity=0.8, line=dict(color='black', width=2)) # looks like the old annotation boxes
+MIN_CURVE_NAME_LEN = 38 # legend box padding, see plot_single_profile
+
+
+@functools.lru_cache(maxsize=None)
+def _template_json() -> str: 
+    """Default template (what go.Figure() puts in layout.template) as JSON, converted once. Cached as a string so no
+    figure can change the cached value."""
+    return json.dumps(pio.templates[pio.templates.default].to_plotly_json(), cls=PlotlyJSONEncoder)
+
+
+def _template() -> dict: 
+    """A fresh copy of the default template for one figure's layout (parsing the JSON is faster than a deepcopy)"""
+    return json.loads(_template_json())
+
+
+def _array(values) -> dict: 
+    """numpy array as a plotly.js typed array spec (compact base64 JSON), like go.Figure would store it"""
+    return to_typed_array_spec(np.asarray(values))
+
+
+def _break_even_line(x) -> dict: 
+    return dict(type="line", x0=x.min(), y0=0, x1=x.max(), y1=0, line=dict(color="red", width=4, dash="dash"))
+
+
+def _layout(x_var:str, title=None) -> dict: 
+    layout = dict(template=_template(), autosize=True, minreducedwidth=20, height=800, width=1300, 
+                  xaxis=dict(title=dict(text=x_var.title()), labelalias=INCOME_LABEL_ALIAS), 
+                  yaxis=dict(title=dict(text=Y_AXIS_TITLE)))
+    layout['title'] = dict(text=title) if title is not None else {}
+    return layout
+
+
+def _curve_traces(df, x_var, y_var, curve_color, curve_name, plot_derivative=False, precomputed=None) -> tuple: 
+    """Traces of one curve (derivative if plot_derivative, then the main curve) and its cliffs.
+
+    Returns 
+
+    traces (list), cliffs (dict), cliff_positions (np.ndarray): rows of df with a cliff peak
+    """
+    x, y = df[x_var].to_numpy(), df[y_var].to_numpy()
+    curve_name += " " * max(0, MIN_CURVE_NAME_LEN - len(curve_name))
+
+    if precomputed is None and 'cliffs' in df.columns: # precomputed at ingest 
+        precomputed = (df['derivative'].to_numpy(), utils.cliffs_from_column(df))
+    if precomputed is None: 
+        derivative, derivative_rel_minima = utils.find_derivative(x, y)
+        cliffs = utils.find_benefits_cliffs(utils.filter_benefits(df, include_eitc=False, include_ctc=False), derivative_rel_minima, mode='peak')
+    else: 
+        derivative, cliffs = precomputed
+
+    # Hover text: income and the benefits lost at a cliff, if any
+    text_list = utils.hover_text(df['income'].to_numpy(), lost_benefit_labels(df, cliffs))
+    hover_template = 'Net Resources: %{y:$,.0f}<br>Income: %{text}  <extra></extra>'
+    if x_var == "Year": 
+        hover_template = "Year: %{x}<br>" + hover_template
+
+    traces = []
+    if plot_derivative: 
+        derivative_scale = 10000
+        traces.append(dict(type='scatter', x=_array(x), y=_array(np.asarray(derivative) * derivative_scale), mode='markers+lines', 
+                           line=dict(color="grey"), name=f'1st Derivative (* {derivative_scale})', hovertemplate=hover_template))
+    traces.append(dict(type='scatter', x=_array(x), y=_array(y), text=text_list, mode='markers+lines', name=curve_name, 
+                       line=dict(color=curve_color), hovertemplate=hover_template))
+
+    cliff_positions = np.unique(np.array([idx for cliff_indices in cliffs.values() for idx in cliff_indices], dtype=np.int64))
+    return traces, cliffs, cliff_positions
+
+
+def _cliff_marker_trace(x, y, colors) -> dict: 
+    """One marker trace for the cliff peaks of all curves"""
+    return dict(type='scatter', x=_array(x), y=_array(y), mode='markers', marker=dict(CLIFF_MARKER, color=colors), hoverinfo='skip', showlegend=False)
+
+
+def _build_single_profile(df, x_var, y_var, curve_color, curve_name, title=None, ben_profile_text=None, plot_derivative=False, precomputed=None) -> dict: 
+    """plot_single_profile() for a new figure, as a figure dict"""
+    if title is None: 
+        title = 'Net Resources for Chosen Beneficiary Profile'
+
+    traces, cliffs, cliff_positions = _curve_traces(df, x_var, y_var, curve_color, curve_name, plot_derivative=plot_derivative, precomputed=precomputed)
+    if len(cliff_positions) > 0: 
+        traces.append(_cliff_marker_trace(df[x_var].to_numpy()[cliff_positions], df[y_var].to_numpy()[cliff_positions], curve_color))
+
+    # Benefits: first plot cols w/ cliffs so legend label order is correct 
+    df_benefits = utils.filter_benefits(df, include_eitc=False, include_ctc=False)
+    ben_cols_ordered = list(cliffs.keys()) + [col for col in df_benefits.columns if col not in cliffs.keys()]
+    for col in ben_cols_ordered: 
+        traces.append(dict(type='scatter', x=_array(df[x_var]), y=_array(df[col]), mode='markers+lines', hovertemplate='%{y:$,.0f}', 
+                           line=dict(color=ben_display_map[col][1]), name=ben_display_map[col][0], 
+                           visible=True if col in cliffs.keys() else 'legendonly'))
+
+    layout = _layout(x_var, title=title)
+    layout['shapes'] = [_break_even_line(df[x_var])]
+    if ben_profile_text is not None: # annotation box for beneficiary profile
+        layout['annotations'] = [dict(text=ben_profile_text, align='left', showarrow=False, xref='paper', yref='paper', x=1.02, 
+                                      xanchor='left', y=.5, bordercolor='black', borderwidth=1, bgcolor='white')]
+
+    return dict(data=traces, layout=layout)
+
+
+def _build_multi(df, x_var, y_var, group_var, color_map, title=None) -> dict: 
+    """plot_multi() as a figure dict"""
+    if 'cliffs' in df.columns: # precomputed at ingest, read per curve 
+        group_cliffs = None 
+        df_sorted, groups, offsets = utils.group_offsets(df, group_var)
+    else: 
+        group_cliffs = utils.find_group_cliffs(df, x_var=x_var, y_var=y_var, group_var=group_var, mode='peak')
+        df_sorted, groups, offsets = group_cliffs['df'], group_cliffs['groups'], group_cliffs['offsets']
+
+    traces, cliff_x, cliff_y, cliff_colors = [], [], [], []
+    for n, group in enumerate(groups): 
+        start, stop = offsets[n], offsets[n+1]
+        dff = df_sorted.iloc[start:stop]
+        curve_traces, _, cliff_positions = _curve_traces(dff, x_var, y_var, color_map[group], group, 
+                                                         precomputed=None if group_cliffs is None else (group_cliffs['derivative'][start:stop], group_cliffs['cliffs'][n]))
+        traces += curve_traces
+        cliff_x.append(dff[x_var].to_numpy()[cliff_positions])
+        cliff_y.append(dff[y_var].to_numpy()[cliff_positions])
+        cliff_colors += [color_map[group]] * len(cliff_positions)
+
+    if len(cliff_colors) > 0: 
+        traces.append(_cliff_marker_trace(np.concatenate(cliff_x), np.concatenate(cliff_y), cliff_colors))
+
+    layout = _layout(x_var, title=title)
+    layout['shapes'] = [_break_even_line(df[x_var])]
+    layout['legend'] = dict(x=.02, y=.98)
+
+    return dict(data=traces, layout=layout)
+
 
 # Legend for Beneficiary Profile
 def create_profile_legend_text(family_data:dict, color:str, ben_list=[]): 
@@ -0,0 +1,222 @@
+## Precompute a profile's results for every county in counties.json ("Pre-load for all counties"), outside the app.
+# Thousands of counties can't be calculated inside a callback, so the pages only read what's in the ResultsStore and
+# queue profiles here (request_precompute); precompute_counties.py runs the queue or a given profile.
+#
+# Counties are split in chunks (one calculator run per chunk, so the rules database is loaded once per chunk) and
+# the chunks run on a process pool. Each worker process has its own CalculatorJobs writing to the shared ResultsStore
+# (SQLite in WAL mode, one transaction per chunk) and ResultsCache.
+#   - Resumable: locations already in the store are skipped, and a checkpoint file per profile (CHECKPOINT_DIR)
+#     records finished and failed locations after every chunk, so an interrupted run picks up where it stopped.
+#   - Throttled: at most `workers` calculators run at once, workers run at lower CPU priority (nice), and each
+#     worker can pause between chunks, so a precompute can run next to the app without starving it.
+# After each chunk the driver adds the new counties to the profile's state aggregates (utils/aggregates.py), and the
+# national percentiles are brought up to date when the run ends.
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from utils.BeneficiaryProfile import Beneficiary
+from utils.calculator_jobs import CalculatorJobs, CALCULATOR_COMMAND
+from utils.data_registry import get_results_store, get_results_cache, get_aggregate_store
+from utils.results_store import DEFAULT_DB_PATH
+
+COUNTIES_FILE = 'counties.json' # {state abbreviation: [county names]}
+PRECOMPUTE_DIR = os.path.join('output', 'precompute')
+CHECKPOINT_DIR = os.path.join(PRECOMPUTE_DIR, 'checkpoints') # {profile_key}.json
+QUEUE_DIR = os.path.join(PRECOMPUTE_DIR, 'queue') # profiles requested by the pages, {profile_key}.json
+JOBS_DIR = os.path.join(PRECOMPUTE_DIR, 'jobs') # own job files and calculator slots, the app's slots stay free
+WORKERS = 2
+CHUNK_SIZE = 50 # counties per calculator run
+NICE = 10 # added to the workers' CPU niceness
+PAUSE = 0.0 # seconds each worker waits between chunks
+CHUNK_TIMEOUT = 3600 # seconds before a chunk's calculator is killed
+
+_worker_jobs = None # CalculatorJobs of a pool worker process
+
+
+def all_locations(counties_fp=COUNTIES_FILE, states=None) -> list:
+    """'County, ST' for every county in counties.json (of the given state abbreviations only, if given)"""
+    with open(counties_fp, 'r') as file:
+        counties = json.load(file)
+    return [f'{county}, {state}' for state, state_counties in counties.items()
+            if states is None or state in states for county in state_counties]
+
+
+def _write_json(fp:str, data:dict) -> None:
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    tmp_fp = f'{fp}.{os.getpid()}.tmp'
+    with open(tmp_fp, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_fp, fp)
+
+
+def _read_json(fp:str) -> dict:
+    try:
+        with open(fp, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def checkpoint_path(profile_key:int) -> str:
+    return os.path.join(CHECKPOINT_DIR, f'{profile_key}.json')
+
+
+def precompute_status(beneficiary:Beneficiary) -> dict:
+    """Checkpoint of a profile's precompute ({'total', 'done', 'failed', 'started', 'updated', 'finished'}), or None"""
+    return _read_json(checkpoint_path(beneficiary.profile_key))
+
+
+### --- QUEUE --- ###
+
+def request_precompute(beneficiary:Beneficiary) -> bool:
+    """Queue a profile for precompute_queue() (e.g. from a page). Returns False if it's already queued or finished."""
+    key = beneficiary.profile_key
+    checkpoint = _read_json(checkpoint_path(key))
+    queue_fp = os.path.join(QUEUE_DIR, f'{key}.json')
+    if os.path.isfile(queue_fp) or (checkpoint is not None and checkpoint.get('finished') and not checkpoint['failed']):
+        return False
+    _write_json(queue_fp, {'config':beneficiary.config, 'requested':time.time()})
+    return True
+
+
+def queued_profiles() -> list:
+    """[(queue file, Beneficiary)] oldest request first"""
+    if not os.path.isdir(QUEUE_DIR):
+        return []
+    queued = []
+    for file_name in os.listdir(QUEUE_DIR):
+        if file_name.endswith('.json'):
+            request = _read_json(os.path.join(QUEUE_DIR, file_name))
+            if request is not None:
+                queued.append((request['requested'], os.path.join(QUEUE_DIR, file_name), request['config']))
+    return [(fp, Beneficiary('precompute', **config)) for _, fp, config in sorted(queued)]
+
+
+### --- WORKERS --- ###
+
+def _init_worker(db_path:str, command:list, pool_command, workers:int, nice:int) -> None:
+    global _worker_jobs
+    if nice:
+        os.nice(nice)
+    pool = None
+    if pool_command is not None:
+        from utils.calculator_pool import CalculatorPool
+        pool = CalculatorPool(size=1, command=pool_command)
+    _worker_jobs = CalculatorJobs(jobs_dir=JOBS_DIR, max_running=workers, command=command, results_store=get_results_store(db_path),
+                                  results_cache=get_results_cache(), timeout=CHUNK_TIMEOUT, pool=pool)
+
+
+def _run_chunk(config:dict, locations:list, pause:float) -> tuple:
+    """Calculate one chunk of locations in a worker process. Returns (locations, state, n_rows, message)."""
+    try:
+        status = _worker_jobs.run(Beneficiary('precompute', **dict(config, locations=locations)))
+        result = (locations, status['state'], status['n_rows'], status['message'])
+    except Exception as e: # failed chunk, the others carry on
+        result = (locations, 'failed', None, f'{type(e).__name__}: {e}')
+    time.sleep(pause)
+    return result
+
+
+### --- PIPELINE --- ###
+
+def precompute_counties(beneficiary:Beneficiary, locations=None, workers=WORKERS, chunk_size=CHUNK_SIZE, nice=NICE, pause=PAUSE,
+                        db_path=DEFAULT_DB_PATH, command=CALCULATOR_COMMAND, pool_command=None, retry_failed=False) -> dict:
+    """Calculate a profile for every location missing from the results store, on a process pool.
+
+    Args:
+
+    beneficiary (Beneficiary): profile (its own locations are ignored)
+
+    locations (list): 'County, ST' locations (default: every county in counties.json)
+
+    workers (int): worker processes, i.e. calculators running at once
+
+    chunk_size (int): locations per calculator run
+
+    nice (int): CPU niceness added to the workers
+
+    pause (float): seconds each worker waits after a chunk
+
+    db_path (str): ResultsStore database
+
+    command (list): calculator command (see CalculatorJobs)
+
+    pool_command (list): run a calculator worker (utils/calculator_pool.py) with this command in each process instead
+
+    retry_failed (bool): also calculate locations that failed in a previous run (skipped otherwise)
+
+    Returns:
+
+    checkpoint (dict): {'total', 'done', 'failed', ...} as saved in checkpoint_path()
+
+    """
+    locations = list(dict.fromkeys(locations if locations is not None else all_locations()))
+    key = beneficiary.profile_key
+    fp = checkpoint_path(key)
+    checkpoint = _read_json(fp) or {'profile_key':key, 'config':beneficiary.config, 'done':[], 'failed':{}, 'started':time.time()}
+    checkpoint.update(total=len(locations), finished=None)
+    if retry_failed:
+        checkpoint['failed'] = {}
+
+    # The store is the source of truth for what's done (e.g. results from the pages or an earlier run)
+    store, aggregate_store = get_results_store(db_path), get_aggregate_store()
+    stored = set(store.locations(key))
+    checkpoint['done'] = [location for location in locations if location in stored]
+    todo = [location for location in locations if location not in stored and location not in checkpoint['failed']]
+    _write_json(fp, checkpoint)
+    print(f"Precompute {key}: {len(locations)} locations, {len(checkpoint['done'])} already stored, "
+          f"{len(checkpoint['failed'])} failed before, {len(todo)} to calculate on {workers} workers")
+    if not todo:
+        aggregate_store.update(key, store) # e.g. counties stored before the aggregates existed
+        checkpoint['finished'] = time.time()
+        _write_json(fp, checkpoint)
+        return checkpoint
+
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    start = time.monotonic()
+    n_calculated = 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(db_path, list(command), pool_command, workers, nice))
+    try:
+        pending = set()
+        while chunks or pending:
+            while chunks and len(pending) < workers: # a chunk per worker in flight, the rest wait here
+                pending.add(executor.submit(_run_chunk, beneficiary.config, chunks.pop(0), pause))
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk, state, n_rows, message = future.result()
+                if state == 'done':
+                    checkpoint['done'].extend(chunk)
+                    n_calculated += len(chunk)
+                    aggregate_store.update(key, store, national=False) # states of the chunk; national percentiles at the end
+                else:
+                    checkpoint['failed'].update(dict.fromkeys(chunk, f'{state}: {message or ""}'[:200]))
+                checkpoint['updated'] = time.time()
+                _write_json(fp, checkpoint)
+
+                elapsed = time.monotonic() - start
+                remaining = len(todo) - n_calculated - sum(1 for location in todo if location in checkpoint['failed'])
+                eta = f', ~{remaining * elapsed / n_calculated / 60:.0f} min left' if n_calculated else ''
+                print(f"  {len(checkpoint['done'])}/{len(locations)} done, {len(checkpoint['failed'])} failed "
+                      f"({n_calculated / elapsed * 60:.1f} locations/min{eta})")
+    except KeyboardInterrupt: # resumable: finished chunks are checkpointed and stored
+        print(f'Interrupted, run again to resume ({fp})')
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    aggregate_store.update(key, store)
+    checkpoint['finished'] = time.time()
+    _write_json(fp, checkpoint)
+    return checkpoint
+
+
+def precompute_queue(**kwargs) -> int:
+    """Precompute every queued profile (see request_precompute), oldest first. Returns the number of profiles processed."""
+    n_profiles = 0
+    for queue_fp, beneficiary in queued_profiles():
+        precompute_counties(beneficiary, **kwargs)
+        os.remove(queue_fp)
+        n_profiles += 1
+    return n_profiles
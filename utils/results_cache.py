@@ -0,0 +1,98 @@
+## Content-addressed cache of calculator results, so the same household at the same location is only ever calculated once
+# (e.g. the pages' default 1 adult/1 child profile, which most visitors submit unchanged).
+# The key is a hash of everything the calculator's output depends on: the full Profile (defaults included, so a new
+# ruleYear or income range/step is a new key), the location and CALCULATOR_VERSION. Equivalent households entered
+# in another person order share entries (see Beneficiary.canonical_profile). The value is that location's results
+# table as Parquet (columnar, compressed, keeps the ingested dtypes).
+# Entries live in a DiskCache (see utils/disk_cache.py): atomic writes, shared by the worker processes, bounded by
+# size with least recently used entries evicted first.
+import io
+import json
+import hashlib
+import pandas as pd
+from utils.BeneficiaryProfile import Beneficiary
+from utils.ingest import compact_dtypes
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+CALCULATOR_VERSION = '1' # bump when the calculator or the rules database changes, to stop serving older results
+PARQUET_COMPRESSION = 'zstd'
+
+
+def result_key(beneficiary:Beneficiary, location:str, calculator_version=CALCULATOR_VERSION) -> str:
+    """Cache key of a profile's results at one location ('County, ST')"""
+    content = [calculator_version, beneficiary.canonical_profile(include_defaults=True), location]
+    return 'res:' + hashlib.blake2b(json.dumps(content, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class ResultsCache:
+
+    def __init__(self, disk_cache, calculator_version=CALCULATOR_VERSION):
+        """
+        Args:
+
+        disk_cache (DiskCache): where the entries are kept (its max_bytes bounds the cache)
+
+        calculator_version (str): part of every key, see CALCULATOR_VERSION
+
+        """
+        if pq is None:
+            raise ImportError('pyarrow is required for the results cache')
+        self.disk_cache = disk_cache
+        self.calculator_version = calculator_version
+
+    def get(self, beneficiary:Beneficiary, location:str) -> pd.DataFrame:
+        """Cached results of a profile at one location, or None"""
+        data = self.disk_cache.get(result_key(beneficiary, location, self.calculator_version))
+        if data is None:
+            return None
+        return compact_dtypes(pd.read_parquet(io.BytesIO(data)))
+
+    def get_many(self, beneficiary:Beneficiary, locations=None) -> tuple:
+        """Cached results of a profile at several locations.
+
+        Args:
+
+        beneficiary (Beneficiary): profile
+
+        locations (list): 'County, ST' locations (default: beneficiary.locations)
+
+        Returns:
+
+        cached (DataFrame or None): results of the cached locations, concatenated in the order given
+
+        missing (list): locations to calculate
+
+        """
+        frames, missing = [], []
+        for location in (locations if locations is not None else beneficiary.locations):
+            df = self.get(beneficiary, location)
+            if df is None:
+                missing.append(location)
+            else:
+                frames.append(df)
+        cached = compact_dtypes(pd.concat(frames, ignore_index=True)) if frames else None
+        return cached, missing
+
+    def set(self, beneficiary:Beneficiary, location:str, df:pd.DataFrame) -> None:
+        """Cache a profile's results at one location"""
+        df = df.reset_index(drop=True)
+        for col in df.select_dtypes('category').columns: # a slice of a multi-location table keeps every location's category
+            df[col] = df[col].cat.remove_unused_categories()
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, compression=PARQUET_COMPRESSION, index=False)
+        self.disk_cache.set(result_key(beneficiary, location, self.calculator_version), buffer.getvalue())
+
+    def set_frame(self, beneficiary:Beneficiary, df:pd.DataFrame) -> int:
+        """Cache calculator output of a profile (any number of locations, by state_county). Returns the number of locations."""
+        n_locations = 0
+        for location, location_df in df.groupby('state_county', observed=True, sort=False):
+            self.set(beneficiary, str(location), location_df)
+            n_locations += 1
+        return n_locations
+
+    def stats(self) -> dict:
+        return self.disk_cache.stats()
@@ -0,0 +1,183 @@
+## Read-only, memory-mapped results cube: calculator output as one dense float32 array of
+# profile x location x income x metric, stored as a .npy file next to the source data.
+# Every worker maps the same file, so the OS page cache holds one copy of the results no matter how many
+# gunicorn workers are running, instead of each worker holding (and copy-on-write duplicating) its own frames.
+#
+# <name>.cube/
+#     values.npy   float32 array, shape (n_profiles, n_locations, n_incomes, n_metrics), NaN where there's no result
+#     cliffs.npy   small int array, shape (n_profiles, n_locations, n_incomes): 1 + position in axes.json cliff_labels, 0 where no cliff 
+#     axes.json    labels of each axis, the BeneficiaryProfile string of each profile key, the distinct 
+#                  (cliffs, lost_benefits) labels precomputed at ingest (see utils/ingest.py) and the source version
+import os
+import json
+import numpy as np
+import pandas as pd
+
+AXES_FILE = 'axes.json'
+VALUES_FILE = 'values.npy'
+CLIFFS_FILE = 'cliffs.npy'
+
+
+def cube_metrics(df) -> list:
+    """Metric columns stored in the cube: NetResources, the value.* benefit columns and the precomputed derivative"""
+    return [col for col in df.columns if col in ('NetResources', 'derivative') or col.startswith('value.')]
+
+
+def build_cube(df, cube_dir:str, stamp=None) -> str:
+    """Write a long-format results table (one row per profile, location and income) as a cube.
+
+    Args:
+
+    df (DataFrame): table with ProfileKey, BeneficiaryProfile, state_county, income and the metric columns
+
+    cube_dir (str): output directory
+
+    stamp (dict): version of the source data, stored in axes.json to check freshness later (see is_fresh())
+
+    Returns:
+
+    cube_dir (str)
+
+    """
+    if not os.path.exists(cube_dir):
+        os.makedirs(cube_dir)
+
+    metrics = cube_metrics(df)
+    profile_codes, profile_keys = pd.factorize(df['ProfileKey'], sort=False)
+    location_codes, locations = pd.factorize(df['state_county'], sort=False)
+    income_codes, incomes = pd.factorize(df['income'], sort=True)
+
+    profile_strs = df.drop_duplicates('ProfileKey').set_index('ProfileKey')['BeneficiaryProfile']
+    shape = (len(profile_keys), len(locations), len(incomes), len(metrics))
+
+    # Fill the array on disk rather than building it in memory first
+    tmp_values_fp = os.path.join(cube_dir, VALUES_FILE + f'.{os.getpid()}.tmp')
+    values = np.lib.format.open_memmap(tmp_values_fp, mode='w+', dtype=np.float32, shape=shape)
+    values[:] = np.nan
+    values[profile_codes, location_codes, income_codes, :] = df[metrics].to_numpy(dtype=np.float32)
+    values.flush()
+    del values
+
+    # Cliff labels as codes into the (few) distinct label pairs 
+    cliff_labels = None 
+    if 'cliffs' in df.columns: 
+        labels = df[['cliffs', 'lost_benefits']].astype(object)
+        has_cliff = labels['cliffs'].notna().to_numpy()
+        label_codes, unique_labels = pd.factorize(labels['cliffs'][has_cliff], sort=False)
+        lost_benefits = labels[has_cliff].drop_duplicates('cliffs').set_index('cliffs')['lost_benefits']
+        cliff_labels = [[str(label), str(lost_benefits[label])] for label in unique_labels]
+
+        tmp_cliffs_fp = os.path.join(cube_dir, CLIFFS_FILE + f'.{os.getpid()}.tmp')
+        cliffs = np.lib.format.open_memmap(tmp_cliffs_fp, mode='w+', dtype=np.min_scalar_type(len(cliff_labels)), shape=shape[:3])
+        cliffs[:] = 0
+        cliffs[profile_codes[has_cliff], location_codes[has_cliff], income_codes[has_cliff]] = label_codes + 1
+        cliffs.flush()
+        del cliffs
+
+    axes = {
+        'shape':list(shape),
+        'profiles':{str(int(k)):str(profile_strs[k]) for k in profile_keys}, # {ProfileKey: BeneficiaryProfile}
+        'locations':[str(loc) for loc in locations],
+        'incomes':[float(income) for income in incomes],
+        'metrics':metrics,
+        'cliff_labels':cliff_labels, # [[cliffs, lost_benefits], ...]
+        'stamp':stamp or {},
+    }
+
+    # axes.json is replaced last: a reader never sees new axes with old values
+    os.replace(tmp_values_fp, os.path.join(cube_dir, VALUES_FILE))
+    if cliff_labels is not None: 
+        os.replace(tmp_cliffs_fp, os.path.join(cube_dir, CLIFFS_FILE))
+    tmp_axes_fp = os.path.join(cube_dir, AXES_FILE + f'.{os.getpid()}.tmp')
+    with open(tmp_axes_fp, 'w') as file:
+        json.dump(axes, file)
+    os.replace(tmp_axes_fp, os.path.join(cube_dir, AXES_FILE))
+
+    return cube_dir
+
+
+def is_fresh(cube_dir:str, stamp:dict) -> bool:
+    """Whether a cube exists and was built from the source version in stamp"""
+    axes_fp = os.path.join(cube_dir, AXES_FILE)
+    if not os.path.isfile(axes_fp) or not os.path.isfile(os.path.join(cube_dir, VALUES_FILE)):
+        return False
+    with open(axes_fp, 'r') as file:
+        return json.load(file).get('stamp') == stamp
+
+
+class ResultsCube:
+
+    def __init__(self, cube_dir:str):
+        """Memory-map a cube written by build_cube() (read-only)"""
+        with open(os.path.join(cube_dir, AXES_FILE), 'r') as file:
+            axes = json.load(file)
+
+        self.cube_dir = cube_dir
+        self.values = np.load(os.path.join(cube_dir, VALUES_FILE), mmap_mode='r')
+        if list(self.values.shape) != axes['shape']:
+            raise ValueError(f'{cube_dir} is being rebuilt (values shape {self.values.shape} != {axes["shape"]}), try again')
+
+        self.profiles = {int(k):v for k,v in axes['profiles'].items()} # {ProfileKey: BeneficiaryProfile}
+        self.profile_keys = list(self.profiles.keys())
+        self.locations = axes['locations']
+        self.metrics = axes['metrics']
+        self.stamp = axes['stamp']
+
+        self.cliff_labels = axes.get('cliff_labels')
+        self.cliffs = None if self.cliff_labels is None else np.load(os.path.join(cube_dir, CLIFFS_FILE), mmap_mode='r')
+
+        incomes = np.array(axes['incomes'])
+        self.incomes = incomes.astype(np.int64) if np.all(incomes == np.round(incomes)) else incomes
+
+        self._profile_pos = {k:n for n,k in enumerate(self.profile_keys)}
+        self._location_pos = {loc:n for n,loc in enumerate(self.locations)}
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.values.nbytes)
+
+    def select(self, profile_keys=None, locations=None) -> pd.DataFrame:
+        """Results for some profiles and locations as a long-format table, like the rows of the source CSV.
+
+        Args:
+
+        profile_keys (list): ProfileKey values (None for all). Unknown keys are skipped.
+
+        locations (list): state_county values (None for all). Unknown locations are skipped.
+
+        Returns:
+
+        df (DataFrame): ProfileKey, BeneficiaryProfile, state_county, countyortownName, stateAbbrev, income and metric
+        columns, ordered by profile, then location (in the order given), then income
+
+        """
+        profile_keys = self.profile_keys if profile_keys is None else [k for k in profile_keys if k in self._profile_pos]
+        locations = self.locations if locations is None else [loc for loc in locations if loc in self._location_pos]
+
+        p_idx = [self._profile_pos[k] for k in profile_keys]
+        l_idx = [self._location_pos[loc] for loc in locations]
+        n_incomes = len(self.incomes)
+
+        block = self.values[np.ix_(p_idx, l_idx)] # only the selected pages are read from disk
+        df = pd.DataFrame(block.reshape(-1, len(self.metrics)), columns=self.metrics)
+
+        def location_column(labels):
+            return np.tile(np.repeat(np.array(labels, dtype=object), n_incomes), len(p_idx))
+
+        profile_col = np.repeat(np.array(profile_keys, dtype=np.int64), len(l_idx) * n_incomes)
+        df.insert(0, 'income', np.tile(self.incomes, len(p_idx) * len(l_idx)))
+        df.insert(0, 'stateAbbrev', location_column([loc.rsplit(', ', 1)[-1] for loc in locations]))
+        df.insert(0, 'countyortownName', location_column([loc.rsplit(', ', 1)[0] for loc in locations]))
+        df.insert(0, 'state_county', location_column(locations))
+        df.insert(0, 'BeneficiaryProfile', np.array([self.profiles[k] for k in profile_keys], dtype=object).repeat(len(l_idx) * n_incomes))
+        df.insert(0, 'ProfileKey', profile_col)
+
+        if self.cliffs is not None: # precomputed cliffs and "Lost Benefits" labels (see utils/ingest.py)
+            codes = self.cliffs[np.ix_(p_idx, l_idx)].reshape(-1).astype(np.int64)
+            cliff_labels = np.array([None] + [label for label, _ in self.cliff_labels], dtype=object)
+            lost_benefits = np.array([None] + [lost for _, lost in self.cliff_labels], dtype=object)
+            df['cliffs'] = pd.Categorical(cliff_labels[codes])
+            df['lost_benefits'] = pd.Categorical(lost_benefits[codes])
+
+        # Drop income points with no result (e.g. profile not run for that location)
+        return df[df['NetResources'].notna()].reset_index(drop=True)
@@ -0,0 +1,191 @@
+## Local SQLite store for calculator results (the "temporary database table" the county pages were waiting for).
+# Runs without a database server, holds far more than the example CSVs without loading them into memory, and
+# is indexed for the lookups the pages make: by profile key, location and income.
+import os
+import json
+import sqlite3
+import threading
+import pandas as pd
+from utils.BeneficiaryProfile import Beneficiary
+from utils.ingest import ingest_csv, compact_dtypes, add_cliff_columns, GROUP_COLUMNS, MONEY_COLUMNS, CLIFF_COLUMNS
+
+DEFAULT_DB_PATH = os.path.join('output', 'results.sqlite')
+
+# results table columns: ProfileKey, then the ingested calculator output columns and the precomputed cliff columns (see utils/ingest.py)
+STORE_COLUMNS = ('ProfileKey', 'income', 'Year') + tuple(col for col in GROUP_COLUMNS if col != 'BeneficiaryProfile') + MONEY_COLUMNS + CLIFF_COLUMNS
+
+
+def _quote(col:str) -> str:
+    return '"' + col.replace('"', '""') + '"' # value.* columns have dots in them
+
+
+def _column_type(col:str) -> str:
+    if col in ('ProfileKey', 'Year'):
+        return 'INTEGER'
+    elif col in GROUP_COLUMNS or col in ('cliffs', 'lost_benefits'):
+        return 'TEXT'
+    return 'REAL'
+
+
+class ResultsStore:
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        """Open (and create if needed) the results database at db_path"""
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._local = threading.local() # sqlite connections can't be shared between threads
+        self._create_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and per process (a connection opened before gunicorn forks can't be reused)
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL') # readers in other workers aren't blocked by a writer
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def _create_schema(self) -> None:
+        columns = ', '.join(f'{_quote(col)} {_column_type(col)}' for col in STORE_COLUMNS)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS profiles (ProfileKey INTEGER PRIMARY KEY, BeneficiaryProfile TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, stamp TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+            connection.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)") # bumped by every insert, see version()
+            connection.execute(f'CREATE TABLE IF NOT EXISTS results ({columns})')
+            existing = {row[1] for row in connection.execute('PRAGMA table_info(results)')}
+            for col in STORE_COLUMNS: # databases created before a column was added
+                if col not in existing:
+                    connection.execute(f'ALTER TABLE results ADD COLUMN {_quote(col)} {_column_type(col)}')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_profile_location_income ON results (ProfileKey, state_county, income)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_location_profile ON results (state_county, ProfileKey)')
+
+    ### --- WRITING --- ###
+
+    def insert_frame(self, df, beneficiary=None) -> int:
+        """Bulk insert calculator output. Results already stored for the same profile and location are replaced.
+
+        Args:
+
+        df (DataFrame): results with a state_county column and either ProfileKey/BeneficiaryProfile columns
+        (like the example CSVs) or one beneficiary's output (then pass beneficiary)
+
+        beneficiary (Beneficiary): profile the results belong to, if df has no BeneficiaryProfile column
+
+        Returns:
+
+        n_rows (int): number of rows inserted
+
+        """
+        df = df.copy(deep=False)
+        if beneficiary is not None:
+            profile = beneficiary.non_default().copy()
+            profile.pop('locations', None)
+            df['BeneficiaryProfile'] = json.dumps(profile)
+            df['ProfileKey'] = beneficiary.profile_key
+        elif 'ProfileKey' not in df.columns:
+            profile_keys = {s:Beneficiary.key_from_profile_str(s) for s in df['BeneficiaryProfile'].unique()}
+            df['ProfileKey'] = df['BeneficiaryProfile'].map(profile_keys).astype('int64')
+
+        if 'state_county' not in df.columns:
+            df['state_county'] = df['countyortownName'].astype(str) + ', ' + df['stateAbbrev'].astype(str)
+
+        if 'cliffs' not in df.columns: # one curve per profile and location
+            df = add_cliff_columns(df, ('ProfileKey', 'state_county'), 'income')
+
+        columns = [col for col in STORE_COLUMNS if col in df.columns]
+        rows = zip(*[df[col].tolist() for col in columns]) # python scalars, sqlite3 can't bind numpy types
+        profiles = df[['ProfileKey', 'BeneficiaryProfile']].drop_duplicates('ProfileKey').astype({'BeneficiaryProfile':str})
+        series = df[['ProfileKey', 'state_county']].drop_duplicates().astype({'state_county':str})
+
+        with self._connect() as connection: # one transaction
+            connection.executemany('INSERT OR REPLACE INTO profiles VALUES (?, ?)',
+                                   zip(profiles['ProfileKey'].tolist(), profiles['BeneficiaryProfile'].tolist()))
+            connection.executemany('DELETE FROM results WHERE ProfileKey = ? AND state_county = ?',
+                                   zip(series['ProfileKey'].tolist(), series['state_county'].tolist()))
+            cursor = connection.executemany(f'INSERT INTO results ({", ".join(_quote(col) for col in columns)}) '
+                                            f'VALUES ({", ".join("?" for _ in columns)})', rows)
+            n_rows = cursor.rowcount
+            connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+        return n_rows
+
+    def insert_csv(self, fp:str, beneficiary=None, source_name=None, stamp=None) -> int:
+        """Bulk insert a calculator output CSV (e.g. Beneficiary.output_path or an example_data CSV).
+
+        Args:
+
+        fp (str): path to the CSV
+
+        beneficiary (Beneficiary): profile the results belong to, if the CSV has no BeneficiaryProfile column
+
+        source_name, stamp: if given, record that this version of the source is loaded (see has_source())
+
+        """
+        n_rows = self.insert_frame(ingest_csv(fp), beneficiary=beneficiary)
+        if source_name is not None:
+            with self._connect() as connection:
+                connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (source_name, json.dumps(stamp, sort_keys=True)))
+        return n_rows
+
+    def has_source(self, source_name:str, stamp=None) -> bool:
+        """Whether insert_csv() already loaded this version of a source"""
+        row = self._connect().execute('SELECT stamp FROM sources WHERE name = ?', (source_name,)).fetchone()
+        return row is not None and row[0] == json.dumps(stamp, sort_keys=True)
+
+    ### --- READING --- ###
+
+    def query(self, profile_keys=None, locations=None, income_range=None) -> pd.DataFrame:
+        """Stored results as a long-format table with the same columns/dtypes as the ingested CSVs.
+
+        Args:
+
+        profile_keys (list): ProfileKey values (None for all)
+
+        locations (list): state_county values (None for all)
+
+        income_range (tuple): (min, max) income, inclusive (None for all)
+
+        Returns:
+
+        df (DataFrame): rows in insertion order (i.e. by profile, location, then income for calculator output)
+
+        """
+        conditions, params = [], []
+        if profile_keys is not None:
+            conditions.append(f'r.ProfileKey IN ({", ".join("?" for _ in profile_keys)})')
+            params.extend(int(k) for k in profile_keys)
+        if locations is not None:
+            conditions.append(f'r.state_county IN ({", ".join("?" for _ in locations)})')
+            params.extend(locations)
+        if income_range is not None:
+            conditions.append('r.income BETWEEN ? AND ?')
+            params.extend(income_range)
+
+        sql = 'SELECT r.*, p.BeneficiaryProfile FROM results r LEFT JOIN profiles p ON r.ProfileKey = p.ProfileKey'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY r.rowid'
+
+        df = pd.read_sql_query(sql, self._connect(), params=params)
+        if len(df) > 0: # columns the stored results don't have (e.g. CareerPath for county runs)
+            df = df.drop(columns=[col for col in df.columns if col not in CLIFF_COLUMNS and df[col].isna().all()])
+        return compact_dtypes(df)
+
+    def version(self) -> str:
+        """Changes whenever results are inserted, e.g. for cache keys. A counter insert_frame() bumps in its transaction,
+        so this is one primary key lookup however big the results table gets (cheap enough to call on every request)."""
+        counter, = self._connect().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return f'{self.db_path}:{counter}'
+
+    def profile_keys(self) -> list:
+        return [row[0] for row in self._connect().execute('SELECT ProfileKey FROM profiles')]
+
+    def locations(self, profile_key=None) -> list:
+        """Locations with stored results (for one profile, if given)"""
+        if profile_key is None:
+            rows = self._connect().execute('SELECT DISTINCT state_county FROM results')
+        else:
+            rows = self._connect().execute('SELECT DISTINCT state_county FROM results WHERE ProfileKey = ?', (int(profile_key),))
+        return [row[0] for row in rows]
@@ -0,0 +1,218 @@
+## Client for the CareerOneStop Skills Matcher API (see pages/skills_matcher.py).
+# One pooled requests.Session per process (kept-alive TLS connections are reused between submits), strict
+# connect/read timeouts, bounded retries with exponential backoff on connection errors and 429/5xx responses,
+# and a limit on how many requests are in flight at once so a slow upstream can't take every worker.
+#
+# The page calls it from a background callback (see app.py), which runs in a separate process: the session is
+# rebuilt after a fork, and the concurrency limit is shared by those processes through lock files (a slot is
+# freed by the OS if the process holding it is killed, e.g. when a background job is cancelled).
+#
+# Responses depend only on the answer vector (SKAValueList), so they're cached on disk (see utils/disk_cache.py)
+# under a canonical hash of the answers: resubmitting the same answers (or a repeated "Randomize Answers" seed)
+# doesn't call the API. The saved example request/response pair seeds the cache.
+#
+# For tests, point SKILLS_MATCHER_URL at the stub server (python -m utils.skills_matcher_stub).
+import os
+import json
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.load_creds import load_creds
+from utils.disk_cache import DiskCache
+from utils.slot_semaphore import shared_semaphore
+
+
+API_URL = os.environ.get('SKILLS_MATCHER_URL', 'https://api.careeronestop.org/v1/skillsmatcher')
+CONNECT_TIMEOUT = 3.05 # seconds
+READ_TIMEOUT = 20
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5 # sleeps 0.5s, 1s, 2s between retries
+MAX_CONCURRENT = 4 # requests in flight (across processes where fcntl is available)
+ACQUIRE_TIMEOUT = 30 # seconds to wait for a free slot before giving up
+SLOTS_DIR = os.path.join('output', 'skills_matcher_slots')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+RESPONSE_CACHE_DIR = os.path.join('output', 'skills_matcher_cache') # shared by the workers (None to disable)
+RESPONSE_CACHE_BYTES = 64 * 2**20
+RESPONSE_CACHE_TTL = 7 * 24 * 3600 # seconds, recommendations follow the occupation data upstream
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class SkillsMatcherError(Exception):
+    """Skills Matcher request failed (timeout, connection error, non-200 status after retries, or too busy)"""
+
+    def __init__(self, message:str, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _canonical_value(value):
+    try:
+        return float(value) # 50 and '50' are the same answer
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def answers_key(answers:list) -> str:
+    """Cache key of an answer vector ([{"ElementId":..., "DataValue":...}, ...]), independent of the answers' order"""
+    canonical = sorted([str(answer['ElementId']), _canonical_value(answer['DataValue'])] for answer in answers)
+    return 'ska:' + hashlib.blake2b(json.dumps(canonical).encode(), digest_size=16).hexdigest()
+
+
+class SkillsMatcherClient:
+
+    def __init__(self, user_id:str, token:str, headers=None, api_url=API_URL, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, max_concurrent=MAX_CONCURRENT, semaphore=None, pool_size=None, 
+                 response_cache=None):
+        """
+        Args:
+
+        user_id, token (str): CareerOneStop credentials (creds/api_info.yaml)
+
+        headers (dict): request headers (e.g. Authorization)
+
+        api_url (str): Skills Matcher endpoint, without the user id
+
+        connect_timeout, read_timeout (float): seconds
+
+        max_retries (int): retries on connection errors, timeouts and 429/5xx responses (with backoff_factor * 2^n sleeps)
+
+        max_concurrent (int): requests in flight at once
+
+        semaphore: shared concurrency limit with acquire()/release() (default: threading.BoundedSemaphore(max_concurrent))
+
+        pool_size (int): kept-alive connections per host (default: max_concurrent)
+
+        response_cache (DiskCache): responses by answers_key() (None to always call the API)
+
+        """
+        self.user_id = user_id
+        self.token = token
+        self.headers = dict(headers or {})
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                           backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                           allowed_methods=frozenset({'GET', 'POST'}), # Skills Matcher POSTs are read-only queries
+                           respect_retry_after_header=True, raise_on_status=False)
+        self.pool_size = pool_size or max_concurrent
+        self.semaphore = semaphore if semaphore is not None else threading.BoundedSemaphore(max_concurrent)
+        self.response_cache = response_cache
+        self.api_calls = 0
+
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """Pooled session of this process (pooled connections can't be shared with a forked child)"""
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=self.retry)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(self.headers)
+                self._session, self._pid = session, os.getpid()
+            return self._session
+
+    def submit_skills(self, answers:list) -> dict:
+        """Rank occupations by the answers to the skills questions.
+
+        Args:
+
+        answers (list): [{"ElementId": question id, "DataValue": chosen DataPoint}, ...]
+
+        Returns:
+
+        response JSON (dict), occupations are in 'SKARankList'
+
+        """
+        if self.response_cache is not None:
+            cached = self.response_cache.get(answers_key(answers))
+            if cached is not None:
+                return json.loads(cached)
+
+        request_body = {'SKAValueList':answers}
+        url = f"{self.api_url}/{self.user_id}"
+        params = {
+            'API Token':self.token,
+            'userId':self.user_id,
+            'body':request_body,
+            # sortColumn
+            # sortOrder
+            # eduFilterValue -- will use this in final app
+            }
+
+        if not self.semaphore.acquire(timeout=ACQUIRE_TIMEOUT):
+            raise SkillsMatcherError(f'Skills Matcher busy: {ACQUIRE_TIMEOUT}s waiting for a free request slot')
+        try:
+            response = self.session.post(url=url, params=params, json=request_body, timeout=self.timeout)
+        except requests.exceptions.RequestException as e: # timeouts, connection errors, retries exhausted
+            raise SkillsMatcherError(f'Skills Matcher request failed: {e}') from e
+        finally:
+            self.semaphore.release()
+
+        with self._lock:
+            self.api_calls += 1
+        if response.status_code != 200:
+            raise SkillsMatcherError(f"Non-200 status code: {response.status_code}", status_code=response.status_code)
+
+        if self.response_cache is not None: # only successful responses
+            self.response_cache.set(answers_key(answers), response.content)
+        return response.json()
+
+    def seed_response_cache(self, request_fp:str, response_fp:str) -> bool:
+        """Add a saved request/response pair (e.g. example_data/SubmitSkills_example_*.json) to the response cache, 
+        unless it's already cached. Returns whether it was added."""
+        if self.response_cache is None or not (os.path.isfile(request_fp) and os.path.isfile(response_fp)):
+            return False
+        with open(request_fp, 'r') as file:
+            answers = json.load(file).get('SKAValueList', [])
+        if not answers or answers_key(answers) in self.response_cache:
+            return False
+        with open(response_fp, 'rb') as file:
+            self.response_cache.set(answers_key(answers), file.read())
+        return True
+
+    def stats(self) -> dict:
+        """API calls of this process and the response cache's hit rate"""
+        stats = {'api_calls':self.api_calls}
+        if self.response_cache is not None:
+            stats['response_cache'] = self.response_cache.stats()
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def get_client(seed=None) -> SkillsMatcherClient:
+    """Client of this process, with credentials from creds/api_info.yaml and the response cache in RESPONSE_CACHE_DIR.
+
+    seed (tuple): (request_fp, response_fp) of a saved request/response pair to warm the response cache with
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            response_cache = None
+            if RESPONSE_CACHE_DIR is not None:
+                try:
+                    response_cache = DiskCache(RESPONSE_CACHE_DIR, max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL)
+                except OSError as e: # e.g. read-only deployment, always call the API
+                    print(f"Could not open Skills Matcher response cache {RESPONSE_CACHE_DIR}: {e}")
+
+            creds = load_creds()['career-onestop']
+            _client = SkillsMatcherClient(user_id=creds['user-id'], token=creds['token-key'], headers=creds['headers'],
+                                          semaphore=shared_semaphore(SLOTS_DIR, MAX_CONCURRENT), 
+                                          response_cache=response_cache)
+            if seed is not None:
+                _client.seed_response_cache(*seed)
+        return _client
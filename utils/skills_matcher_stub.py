@@ -0,0 +1,99 @@
+## Local stand-in for the Skills Matcher API, for testing the client and page without credentials or network.
+# Answers POST /v1/skillsmatcher/<user id> with the saved example response (example_data/SubmitSkills_example_response.json),
+# optionally after a delay or with a share of failing (503) responses to exercise the client's timeouts and retries.
+#
+# Run:   python -m utils.skills_matcher_stub --port 8765 --delay 0.5 --fail-rate 0.2
+# Then:  SKILLS_MATCHER_URL=http://127.0.0.1:8765/v1/skillsmatcher python app.py
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+EXAMPLE_RESPONSE = os.path.join('example_data', 'SubmitSkills_example_response.json')
+PATH_PREFIX = '/v1/skillsmatcher/'
+
+
+def make_handler(response_json:dict, delay=0.0, fail_rate=0.0):
+
+    class SkillsMatcherStubHandler(BaseHTTPRequestHandler):
+
+        requests_served = 0 # counted across threads, for tests
+
+        def do_POST(self):
+            type(self).requests_served += 1
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length) if length else b''
+
+            if not self.path.startswith(PATH_PREFIX):
+                return self._send(404, {'error':'not found'})
+            try:
+                request_json = json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                return self._send(400, {'error':'invalid JSON'})
+            if 'SKAValueList' not in request_json:
+                return self._send(400, {'error':'missing SKAValueList'})
+
+            if delay:
+                time.sleep(delay)
+            if fail_rate and random.random() < fail_rate:
+                return self._send(503, {'error':'unavailable'})
+            return self._send(200, response_json)
+
+        def _send(self, status:int, payload:dict):
+            data = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError): # client gave up (timeout)
+                pass
+
+        def log_message(self, format, *args): # quiet
+            pass
+
+    return SkillsMatcherStubHandler
+
+
+def start_stub_server(port=0, delay=0.0, fail_rate=0.0, response_fp=EXAMPLE_RESPONSE):
+    """Serve the stub from a daemon thread.
+
+    Args:
+
+    port (int): 0 for any free port
+
+    delay (float): seconds before each response
+
+    fail_rate (float): share of requests answered with 503
+
+    Returns:
+
+    server (ThreadingHTTPServer, call .shutdown() to stop), api_url (str) to pass to SkillsMatcherClient
+
+    """
+    with open(response_fp, 'r') as file:
+        response_json = json.load(file)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(response_json, delay=delay, fail_rate=fail_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}{PATH_PREFIX.rstrip("/")}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stub of the Skills Matcher API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503')
+    args = parser.parse_args()
+
+    server, api_url = start_stub_server(port=args.port, delay=args.delay, fail_rate=args.fail_rate)
+    print(f'Skills Matcher stub at {api_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,52 @@
+## Semaphore shared by processes (gunicorn workers, background callback processes), e.g. to bound how many
+# Skills Matcher requests or calculator runs are in flight at once.
+# There are `slots` lock files in a directory and a holder has an exclusive flock on one of them. The OS drops
+# the lock when the holder's process dies, so a killed job (e.g. a cancelled background callback) frees its slot.
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError: # not on Windows, use a threading.BoundedSemaphore (per process) there
+    fcntl = None
+
+
+class SlotSemaphore:
+    """Semaphore shared by processes: `slots` lock files in lock_dir, a holder has an exclusive flock on one of them"""
+
+    def __init__(self, lock_dir:str, slots:int, poll_interval=0.05):
+        self.paths = [os.path.join(lock_dir, f'slot-{n}.lock') for n in range(slots)]
+        self.poll_interval = poll_interval
+        self._held = threading.local() # fd of the slot held by this thread
+        if not os.path.exists(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def acquire(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError: # taken
+                    os.close(fd)
+                    continue
+                self._held.fd = fd
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+        fd = self._held.fd
+        self._held.fd = None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def shared_semaphore(lock_dir:str, slots:int):
+    """SlotSemaphore in lock_dir, or a threading.BoundedSemaphore (limit per process) where flock isn't available"""
+    if fcntl is None:
+        return threading.BoundedSemaphore(slots)
+    return SlotSemaphore(lock_dir, slots)
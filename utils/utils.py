@@ -1,4 +1,5 @@
 import os
+import functools
 import datetime as dt 
 import json
 import yaml
@@ -26,6 +27,27 @@ def get_hourly_wage(annual):
 def format_int_dollars(n:int) -> str: 
     return '${:,.7}'.format(float(n)).rstrip('0').rstrip('.')
 
+@functools.lru_cache(maxsize=256)
+def _dollar_labels(values:bytes, dtype:str) -> np.ndarray: 
+    values = np.frombuffer(values, dtype=dtype)
+    uniques, inverse = np.unique(values, return_inverse=True) # e.g. the same income grid repeated for every year/location 
+    return np.array([format_int_dollars(v) for v in uniques.tolist()], dtype=object)[inverse]
+
+def format_int_dollars_array(values) -> np.ndarray: 
+    """format_int_dollars() of each value (read-only object array). Each distinct value is formatted once, and the 
+    labels of an income grid are cached, since every curve on the same grid has the same labels."""
+    values = np.ascontiguousarray(values)
+    if values.dtype == object: 
+        return np.array([format_int_dollars(v) for v in values], dtype=object)
+    return _dollar_labels(values.tobytes(), values.dtype.str)
+
+def hover_text(incomes, lost_benefits:dict) -> list: 
+    """Hover text of each point of a curve: income, plus the benefits lost at a cliff peak ({position: label}, see plotting.lost_benefit_labels())"""
+    text_list = format_int_dollars_array(incomes).tolist()
+    for pos, label in lost_benefits.items(): 
+        text_list[pos] += "<br>Lost Benefits: " + label
+    return text_list
+
 def find_derivative(x,y, non_negative=True) -> tuple: 
     """Find derivative & relative minima """
     ## Derivative  
@@ -35,35 +57,32 @@ def find_derivative(x,y, non_negative=True) -> tuple:
         derivative_rel_minima = derivative_rel_minima[derivative_rel_minima > 0] # non-negative
     return derivative, derivative_rel_minima
 
+def zero_intercept_mask(values) -> np.ndarray: 
+    """Boolean array marking the points where each curve (column of values) first intersects with x-axis (0), 
+    i.e. the value is zero and the previous value is non-zero. The first row is never an intercept (there's no previous point)."""
+    values = np.asarray(values)
+    is_zero = values == 0
+    mask = np.zeros(is_zero.shape, dtype=bool)
+    mask[1:] = is_zero[1:] & ~is_zero[:-1]
+    return mask
+
 def find_zero_intercepts(ls:list):
     """Get points (indices) of curve (iterable) which first intersect with x-axis (0) (i.e. previous value must be non-zero)""" 
-
-    zero_indices = []
-    on_zero = True  # treat first element in list as if we're already on zero (there's no previous point)
-    for n in range(len(ls)):
-        if ls[n] == 0:
-            if not on_zero: # i.e. we found a zero and we're not already on the axis 
-                zero_indices.append(n)
-                on_zero = True
-            else: 
-                continue
-        else: 
-            on_zero = False
-
-    return zero_indices
+    return np.flatnonzero(zero_intercept_mask(np.asarray(ls).ravel())).tolist()
 
 ### ------------------------------------------------------------------------------ ###
 ### --- BENEFITS FUNCTIONS --- ###
 
 def filter_benefits(df, include_eitc=True, include_ctc=True): 
     """Filter df to relevant benefits columns"""
-    df_benefits = df.loc[:, ((df != 0).any(axis=0) & (df == 0).any(axis=0))]\
-            .filter(regex='value') # Must have non-zero and zero values to potentially cause a cliff
+    cols = [col for col in df.columns if 'value' in str(col)] # (same as df.filter(regex='value'))
     if not include_eitc: 
-        df_benefits = df_benefits[[col for col in df_benefits.columns if 'eitc' not in col]]
+        cols = [col for col in cols if 'eitc' not in col]
     if not include_ctc: 
-        df_benefits = df_benefits[[col for col in df_benefits.columns if 'ctc' not in col]]
-    return df_benefits
+        cols = [col for col in cols if 'ctc' not in col]
+    values = df[cols].to_numpy()
+    has_cliff = (values != 0).any(axis=0) & (values == 0).any(axis=0) # Must have non-zero and zero values to potentially cause a cliff
+    return df[[col for col, keep in zip(cols, has_cliff) if keep]]
 
 
 def find_benefits_cliffs(df, derivative_rel_minima, mode='peak') -> dict: 
@@ -91,15 +110,168 @@ def find_benefits_cliffs(df, derivative_rel_minima, mode='peak') -> dict:
     df_benefits = filter_benefits(df, include_eitc=False)
     cliffs = {}
 
-    for col in df_benefits.columns: 
-        zeros = find_zero_intercepts(df_benefits[col].tolist())
-        col_cliffs = [x - offset for x in zeros if any(x in range(e,e+2) for e in derivative_rel_minima)] # pd.Interval(e-1,e+1, closed='both') -- since derivative curve is discrete I don't think this is need
-        if len(col_cliffs) > 0:
-            cliffs[col] = col_cliffs
+    if df_benefits.shape[1] == 0: 
+        return cliffs 
+
+    # Zero intercepts of all benefits columns at once, ordered by column then row 
+    col_idx, zeros = np.nonzero(zero_intercept_mask(df_benefits.to_numpy(dtype=np.float64)).T)
+
+    # A zero is a cliff if it's at a derivative minimum e or the point after it (e <= x <= e + 1)
+    minima = np.sort(np.asarray(derivative_rel_minima, dtype=np.int64))
+    if len(minima) == 0: 
+        return cliffs 
+    nearest = np.searchsorted(minima, zeros, side='right') - 1 # largest minimum <= x
+    is_cliff = (nearest >= 0) & (zeros - minima[np.maximum(nearest, 0)] <= 1)
+
+    col_idx, col_cliffs = col_idx[is_cliff], zeros[is_cliff] - offset
+    bounds = np.searchsorted(col_idx, np.arange(df_benefits.shape[1] + 1))
+    for n, col in enumerate(df_benefits.columns): 
+        if bounds[n + 1] > bounds[n]: 
+            cliffs[col] = col_cliffs[bounds[n]:bounds[n + 1]].tolist()
 
     return cliffs 
 
 
+def group_offsets(df, group_var) -> tuple: 
+    """Sort df so each group (in order of first appearance) is one contiguous block of rows; rows keep their order within a group.
+    
+    Returns 
+
+    df (dataframe): sorted df (unchanged if it's already grouped), without rows where group_var is missing 
+
+    groups (list): group values 
+
+    offsets (np.ndarray): rows of groups[n] are df.iloc[offsets[n]:offsets[n+1]]
+    
+    """
+    codes, groups = pd.factorize(df[group_var], sort=False)
+    if np.any(codes[1:] < codes[:-1]) or np.any(codes < 0): 
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        df, codes = df.iloc[order], codes[order]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(groups)))]).astype(np.int64)
+    return df, list(groups), offsets
+
+
+def grouped_gradient(x, y, offsets) -> np.ndarray: 
+    """np.gradient(y, x) of each group (rows offsets[n]:offsets[n+1]) computed at once, with the same results and dtype.
+    Groups with less than 2 points get NaN (np.gradient raises)."""
+    x, y = np.asarray(x), np.asarray(y)
+    if np.issubdtype(x.dtype, np.integer): 
+        x = x.astype(np.float64)
+    if not np.issubdtype(y.dtype, np.inexact): 
+        y = y.astype(np.float64)
+
+    out = np.full(len(y), np.nan, dtype=y.dtype)
+    starts, stops = offsets[:-1], offsets[1:]
+    sizes = stops - starts
+    if len(y) < 2: 
+        return out
+    
+    dx = np.diff(x) # dx[i] = x[i+1] - x[i], within a group for starts <= i <= stops - 2
+    group_of_row = np.repeat(np.arange(len(sizes)), sizes)
+    is_start, is_stop = np.zeros(len(y), dtype=bool), np.zeros(len(y), dtype=bool)
+    is_start[starts[sizes >= 2]], is_stop[stops[sizes >= 2] - 1] = True, True
+    
+    # np.gradient uses the uniform spacing formula if all of a group's spacings equal its first one  
+    first_dx = dx[np.minimum(starts, len(dx) - 1)]
+    is_other_dx = np.concatenate([dx != first_dx[group_of_row[:-1]], [False]]) & ~is_stop
+    n_other_dx = np.concatenate([[0], np.cumsum(is_other_dx)])
+    uniform = (n_other_dx[np.maximum(stops - 1, 0)] - n_other_dx[starts]) == 0
+
+    ## 2nd order interior 
+    interior = np.flatnonzero(~is_start & ~is_stop & (sizes >= 3)[group_of_row])
+    is_uniform = uniform[group_of_row[interior]]
+
+    i = interior[is_uniform]
+    out[i] = (y[i + 1] - y[i - 1]) / (2. * dx[i])
+
+    i = interior[~is_uniform]
+    dx1, dx2 = dx[i - 1], dx[i]
+    a = -(dx2) / (dx1 * (dx1 + dx2))
+    b = (dx2 - dx1) / (dx1 * dx2)
+    c = dx1 / (dx2 * (dx1 + dx2))
+    out[i] = a * y[i - 1] + b * y[i] + c * y[i + 1]
+
+    ## 1st order edges 
+    i = np.flatnonzero(is_start)
+    out[i] = (y[i + 1] - y[i]) / dx[i]
+    i = np.flatnonzero(is_stop)
+    out[i] = (y[i] - y[i - 1]) / dx[i - 1]
+
+    return out
+
+
+def find_group_cliffs(df, x_var, y_var, group_var, mode='peak') -> dict: 
+    """find_derivative() and find_benefits_cliffs() (as used by plotting.plot_single_profile) for every group of a long-format table at once. 
+    
+    Args
+
+    df (dataframe): Dataframe with x_var, y_var, group_var and benefits columns 
+
+    mode (str): 'peak' (return index of peak of cliff) or 'valley' (return index of bottom of cliff)
+    
+    Returns 
+
+    results (dict): 
+        'df': df sorted by group (see group_offsets()) 
+        'groups': group values, in order of first appearance 
+        'offsets': rows of groups[n] are df.iloc[offsets[n]:offsets[n+1]]
+        'derivative': derivative of y_var for every row of df 
+        'rel_minima': [<relative minima of the derivative of each group>] (indices within the group)
+        'cliffs': [<{<benefits_column>:[<cliff-1>,...,<cliff-n>]} of each group>] (indices within the group)
+    
+    """
+    if mode == 'peak': 
+        offset = 1
+    elif mode == 'valley': 
+        offset = 0
+    else: 
+        raise Exception("'mode' must be one of 'peak' or 'valley'")
+
+    df, groups, offsets = group_offsets(df, group_var)
+    starts = offsets[:-1]
+    group_of_row = np.repeat(np.arange(len(groups)), np.diff(offsets))
+    is_start = np.zeros(len(df), dtype=bool)
+    is_start[starts[starts < len(df)]] = True
+    is_stop = np.roll(is_start, -1)
+    if len(df) > 0: 
+        is_stop[-1] = True
+
+    derivative = grouped_gradient(df[x_var].to_numpy(), df[y_var].to_numpy(), offsets)
+
+    # Relative minima (argrelextrema(derivative, np.less) within each group, which never includes the first or last point)
+    is_min = np.zeros(len(df), dtype=bool)
+    is_min[1:-1] = (derivative[1:-1] < derivative[:-2]) & (derivative[1:-1] < derivative[2:])
+    is_min &= ~is_start & ~is_stop
+    minima = np.flatnonzero(is_min)
+    rel_minima = np.split(minima - starts[group_of_row[minima]], np.searchsorted(minima, offsets[1:-1])) if len(groups) > 0 else []
+
+    # Cliffs: zero intercepts of the benefits columns at a derivative minimum or the point after it 
+    ben_cols = [col for col in df.filter(regex='value').columns if 'eitc' not in col and 'ctc' not in col]
+    cliffs = [{} for _ in groups]
+    if len(ben_cols) > 0 and len(df) > 0: 
+        is_near_min = is_min | np.concatenate([[False], is_min[:-1]])
+        is_cliff = zero_intercept_mask(df[ben_cols].to_numpy(dtype=np.float64)) & (is_near_min & ~is_start)[:, None]
+        rows, cols = np.nonzero(is_cliff)
+        order = np.lexsort((rows, cols, group_of_row[rows])) # by group, then column, then row 
+        for row, col in zip(rows[order].tolist(), cols[order].tolist()): 
+            g = group_of_row[row]
+            cliffs[g].setdefault(ben_cols[col], []).append(row - offset - int(starts[g]))
+
+    return {'df':df, 'groups':groups, 'offsets':offsets, 'derivative':derivative, 'rel_minima':rel_minima, 'cliffs':cliffs}
+
+
+def cliffs_from_column(df) -> dict: 
+    """find_benefits_cliffs() output (peak mode) of a curve from its precomputed 'cliffs' column (see utils/ingest.py add_cliff_columns())"""
+    cliffs = {}
+    positions = np.flatnonzero(df['cliffs'].notna().to_numpy())
+    for pos, cols in zip(positions.tolist(), df['cliffs'].iloc[positions].astype(str)): 
+        for col in cols.split(','): 
+            cliffs.setdefault(col, []).append(pos)
+    return {col:cliffs[col] for col in df.columns if col in cliffs} # in column order, like find_benefits_cliffs()
+
+
 ### ------------------------------------------------------------------------------ ###
 ## --- DEPRECATED: Used for illustration in identify-cliffs-plotly.ipynb only ---  ##
 
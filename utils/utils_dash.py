@@ -4,6 +4,7 @@ import os
 from dash import dcc, html, Input, Output, State
 import yaml
 from utils.BeneficiaryProfile import Beneficiary
+from utils.data_registry import get_dataset
 
 def list_ordinals(lower=False):
     ordinals = ['First', 'Second', 'Third', 'Fourth', 'Fifth', 'Sixth']
@@ -92,8 +93,7 @@ def load_job_dict(test_mode:bool) -> dict:
             all_job_dict = yaml.full_load(file)
 
         # Filter to those which are available in the test file
-        TEST_FILE = os.path.join('example_data', 'DASH_exports_combined_New-Castle-County_30-adult_5-child_2-child_EDU+CODES.csv')
-        df_test = pd.read_csv(TEST_FILE, index_col=0)
+        df_test = get_dataset('dash_exports')
         test_job_list = df_test['CareerPath'].drop_duplicates().to_list()
 
         job_dict = {}
@@ -203,4 +203,27 @@ def extract_ben_dict(states_list):
     locations = list(dict.fromkeys(locations)) # drop duplicates
     ben_dict['locations'] = locations
 
-    return ben_dict
\ No newline at end of file
+    return ben_dict
+
+def show_trace_group(trace_groups:dict, tab) -> dash.Patch: 
+    """Partial figure update showing only the traces of one tab.
+    Used with figures from plotting.plot_single_profile_tabs(), so switching tabs sends the traces' visibility
+    instead of a new figure.
+
+    Args: 
+
+    trace_groups (dict): layout.meta['trace_groups'] of the figure ({'tabs':{tab value: [trace indices]}, 'visible':[...]})
+
+    tab: value of the chosen tab (all traces are hidden if it has none)
+
+    Returns: 
+
+    dash.Patch for the dcc.Graph's figure property 
+    """
+    shown = set(trace_groups['tabs'].get(tab, []))
+
+    patched_fig = dash.Patch()
+    for idx, visible in enumerate(trace_groups['visible']): 
+        patched_fig['data'][idx]['visible'] = visible if idx in shown else False
+
+    return patched_fig